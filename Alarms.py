@@ -0,0 +1,306 @@
+from collections import OrderedDict, deque
+import ast
+import heapq
+import json
+import os
+import threading
+import time
+import logging
+import Metrics
+
+logger = logging.getLogger("OPCUA")
+
+SEVERITIES = ["critical", "warning", "info"]
+# 表达式规则允许的语法：布尔运算、比较、算术、变量名和常量
+EXPRESSION_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+                    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Eq, ast.NotEq, ast.Lt,
+                    ast.LtE, ast.Gt, ast.GtE, ast.Name, ast.Load, ast.Constant)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Rule:
+    # evaluate 返回 (是否报警, 下次需要按时间重新判断的时刻)；是否报警为 None 表示无法判断，保持原状态
+    def __init__(self, spec):
+        self.name = spec["name"]
+        self.severity = spec.get("severity", "warning")
+        if self.severity not in SEVERITIES:
+            raise ValueError(f"Alarm {self.name}: unknown severity {self.severity}")
+        self.message = spec.get("message", self.name)
+        self.variables = []
+
+    def evaluate(self, engine, now):
+        raise NotImplementedError
+
+
+class LimitRule(Rule):
+    # 上/下限报警，回差 deadband：超过 limit 报警，回到 limit ∓ deadband 以内才解除
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.var_name = spec["var"]
+        self.limit = float(spec["limit"])
+        self.deadband = float(spec.get("deadband", 0.0))
+        self.high = spec["type"] == "high"
+        self.variables = [self.var_name]
+
+    def evaluate(self, engine, now):
+        value = engine.values.get(self.var_name)
+        if not is_number(value):
+            return None, None
+        active = engine.states[self.name].active
+        if self.high:
+            return (value > self.limit - self.deadband) if active else (value > self.limit), None
+        return (value < self.limit + self.deadband) if active else (value < self.limit), None
+
+
+class RateRule(Rule):
+    # 变化率报警：window 秒内 Δ值/Δt 超过 limit (单位/s)，direction 为 rising/falling 时只检测单方向；
+    # 值不再变化时随样本过期自动解除
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.var_name = spec["var"]
+        self.limit = float(spec["limit"])
+        self.window = float(spec.get("window", 1.0))
+        self.direction = {"rising": 1, "falling": -1}.get(spec.get("direction"))
+        self.variables = [self.var_name]
+        self.samples = deque()
+        self.last_change = None
+
+    def evaluate(self, engine, now):
+        value = engine.values.get(self.var_name)
+        changed_at = engine.changed_at.get(self.var_name)
+        if changed_at != self.last_change and is_number(value):
+            self.last_change = changed_at
+            self.samples.append((changed_at, value))
+        # 过期判断与返回的截止时间用同一个表达式，避免浮点舍入使到期的样本不被删除
+        while self.samples and self.samples[0][0] + self.window <= now:
+            self.samples.popleft()
+        if len(self.samples) < 2:
+            return False, None
+        (t0, v0), (t1, v1) = self.samples[0], self.samples[-1]
+        rate = (v1 - v0) / max(t1 - t0, 1e-6)
+        rate = rate * self.direction if self.direction else abs(rate)
+        return rate > self.limit, self.samples[0][0] + self.window
+
+
+class StuckRule(Rule):
+    # 卡死检测：变量超过 timeout 秒没有变化
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.var_name = spec["var"]
+        self.timeout = float(spec["timeout"])
+        self.variables = [self.var_name]
+
+    def evaluate(self, engine, now):
+        changed_at = engine.changed_at.get(self.var_name)
+        if changed_at is None:
+            return None, None
+        if now - changed_at >= self.timeout:
+            return True, None
+        return False, changed_at + self.timeout
+
+
+class ExpressionRule(Rule):
+    # 组合条件，如 "DO_LASER_EXTERNAL_LIGHT_OUTPUT_H and not CHAMBER_O2_OK_LASER"
+    def __init__(self, spec, known_variables):
+        super().__init__(spec)
+        self.expression = spec["expr"]
+        tree = ast.parse(self.expression, mode="eval")
+        variables = OrderedDict()
+        for node in ast.walk(tree):
+            if not isinstance(node, EXPRESSION_NODES):
+                raise ValueError(f"Alarm {self.name}: unsupported syntax {type(node).__name__}")
+            if isinstance(node, ast.Name):
+                if node.id not in known_variables:
+                    raise ValueError(f"Alarm {self.name}: unknown variable {node.id}")
+                variables[node.id] = True
+        self.variables = list(variables)
+        self.code = compile(tree, f"<alarm {self.name}>", "eval")
+
+    def evaluate(self, engine, now):
+        # 有变量尚未收到或读取失败时不判断
+        values = {}
+        for var_name in self.variables:
+            value = engine.values.get(var_name)
+            if value is None or isinstance(value, str):
+                return None, None
+            values[var_name] = value
+        try:
+            return bool(eval(self.code, {"__builtins__": {}}, values)), None
+        except (ArithmeticError, TypeError):
+            return None, None
+
+
+RULE_TYPES = {"high": LimitRule, "low": LimitRule, "rate": RateRule, "stuck": StuckRule}
+
+
+def make_rule(spec, known_variables):
+    if spec.get("type") == "expression":
+        return ExpressionRule(spec, known_variables)
+    rule_type = RULE_TYPES.get(spec.get("type"))
+    if rule_type is None:
+        raise ValueError(f"Alarm {spec.get('name')}: unknown type {spec.get('type')}")
+    rule = rule_type(spec)
+    unknown = [v for v in rule.variables if v not in known_variables]
+    if unknown:
+        raise ValueError(f"Alarm {rule.name}: unknown variable {unknown[0]}")
+    return rule
+
+
+class AlarmState:
+    def __init__(self, rule):
+        self.name = rule.name
+        self.severity = rule.severity
+        self.message = rule.message
+        self.active = False
+        self.acknowledged = True
+        self.since = None  # 最近一次报警的时间 (time.time)
+
+    def as_dict(self):
+        return {"alarm": self.name, "severity": self.severity, "message": self.message, "active": self.active,
+                "acknowledged": self.acknowledged, "since": self.since}
+
+
+class AlarmEngine:
+    # 增量报警：只重新判断依赖于变化变量的规则；按时间判断的规则（卡死、变化率过期）放在截止时间堆中
+    def __init__(self, rules, known_variables, history_file=None, history_size=1000):
+        self.rules = OrderedDict()
+        self.dependents = {}  # 变量名 -> [规则]
+        for spec in rules:
+            rule = make_rule(spec, known_variables)
+            if rule.name in self.rules:
+                raise ValueError(f"Duplicate alarm name: {rule.name}")
+            self.rules[rule.name] = rule
+            for var_name in rule.variables:
+                self.dependents.setdefault(var_name, []).append(rule)
+        self.states = OrderedDict((name, AlarmState(rule)) for name, rule in self.rules.items())
+        self.values = {}
+        self.changed_at = {}  # 变量名 -> 最近变化时间 (monotonic)
+        self.deadlines = []  # 堆 [(时刻, 规则名)]，每个规则最多一个有效条目
+        self.scheduled = {}  # 规则名 -> 在堆中的有效条目的时刻
+        self.pending = {}  # 规则名 -> 规则最近要求的截止时间
+        self.history_file = history_file
+        self.history = deque(self.load_history(history_size), maxlen=history_size)
+        self.lock = threading.Lock()
+        self.on_alarm = lambda event: None
+
+    def load_history(self, history_size):
+        if not self.history_file or not os.path.exists(self.history_file):
+            return []
+        try:
+            with open(self.history_file, encoding="utf-8") as f:
+                return [json.loads(line) for line in deque(f, maxlen=history_size) if line.strip()]
+        except Exception as e:
+            logger.warning(f"Failed to load alarm history: {e}")
+            return []
+
+    def update(self, values, now=None):
+        # 在读取/订阅回调中调用，values 为 {变量名: 值}
+        now = time.monotonic() if now is None else now
+        events = []
+        with self.lock:
+            dirty = OrderedDict()
+            for var_name, value in values.items():
+                previous = self.values.get(var_name)
+                if var_name in self.values and previous == value and type(previous) is type(value):
+                    continue
+                self.values[var_name] = value
+                self.changed_at[var_name] = now
+                for rule in self.dependents.get(var_name, ()):
+                    dirty[rule.name] = rule
+            for rule in dirty.values():
+                self.evaluate(rule, now, events)
+            self.check_deadlines(now, events)
+        self.publish(events)
+
+    def check_timeouts(self, now=None):
+        # 由采集循环定期调用，处理不依赖新值的时间条件
+        now = time.monotonic() if now is None else now
+        events = []
+        with self.lock:
+            self.check_deadlines(now, events)
+        self.publish(events)
+
+    def check_deadlines(self, now, events):
+        # 截止时间推后的规则（如卡死检测的变量又变化了）到期时只重新入堆，不重新判断
+        while self.deadlines and self.deadlines[0][0] <= now:
+            scheduled, name = heapq.heappop(self.deadlines)
+            if self.scheduled.get(name) != scheduled:
+                continue  # 已被更早的条目取代
+            del self.scheduled[name]
+            deadline = self.pending.get(name)
+            if deadline is None:
+                continue
+            if deadline > now:
+                self.schedule(name, deadline)
+                continue
+            del self.pending[name]
+            self.evaluate(self.rules[name], now, events)
+
+    def schedule(self, name, deadline):
+        heapq.heappush(self.deadlines, (deadline, name))
+        self.scheduled[name] = deadline
+
+    def evaluate(self, rule, now, events):
+        Metrics.alarm_evaluations.inc()
+        active, deadline = rule.evaluate(self, now)
+        # 只记录规则的最新截止时间，堆中已有不晚于它的条目时不再加入
+        if deadline is None:
+            self.pending.pop(rule.name, None)
+        else:
+            self.pending[rule.name] = deadline
+            scheduled = self.scheduled.get(rule.name)
+            if scheduled is None or deadline < scheduled:
+                self.schedule(rule.name, deadline)
+        state = self.states[rule.name]
+        if active is None or active == state.active:
+            return
+        state.active = active
+        Metrics.alarms_active.inc(amount=1 if active else -1)
+        if active:
+            state.acknowledged = False
+            state.since = time.time()
+        events.append(self.record(state, "raised" if active else "cleared"))
+
+    def acknowledge(self, name=None):
+        # name 为 None 时确认全部未确认的报警
+        events = []
+        with self.lock:
+            for state in self.states.values():
+                if (name is None or state.name == name) and not state.acknowledged:
+                    state.acknowledged = True
+                    events.append(self.record(state, "acknowledged"))
+        self.publish(events)
+
+    def record(self, state, kind):
+        event = state.as_dict()
+        event.update({"time": time.time(), "event": kind, "values": {v: self.values.get(v)
+                                                                     for v in self.rules[state.name].variables}})
+        self.history.append(event)
+        return event
+
+    def publish(self, events):
+        if not events:
+            return
+        for event in events:
+            log = logger.warning if event["event"] == "raised" else logger.info
+            # 每次报警变化都要记录，不参与日志限流
+            log(f"Alarm {event['alarm']} {event['event']} ({event['severity']}): {event['values']}",
+                extra={"rate_limit": False})
+        if self.history_file:
+            try:
+                os.makedirs(os.path.dirname(self.history_file) or ".", exist_ok=True)
+                with open(self.history_file, "a", encoding="utf-8") as f:
+                    for event in events:
+                        f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+            except Exception as e:
+                logger.warning(f"Failed to write alarm history: {e}")
+        for event in events:
+            self.on_alarm(event)
+
+    def snapshot(self):
+        # 需要显示的报警：仍在报警或尚未确认
+        with self.lock:
+            return [state.as_dict() for state in self.states.values() if state.active or not state.acknowledged]
\ No newline at end of file
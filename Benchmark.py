@@ -0,0 +1,244 @@
+from ClientApp import OPCUAHandler, VARIABLES
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+# 端到端基准：启动模拟 PLC 子进程，测量读写、界面刷新、内存和重连，结果写入 JSON 便于跨版本比较
+BENCHMARK_FILE = "benchmark_results.json"
+BENCHMARK_ENDPOINT = "opc.tcp://127.0.0.1:4860"
+REGRESSION_TOLERANCE = 0.2  # 与基线相比变差超过 20% 视为回归
+# 参与回归比较的指标：(指标名, 统计项, 是否越大越好)
+COMPARED_METRICS = [
+    ("read_cycle_ms", "p95", False),
+    ("read_cycles_per_s", None, True),
+    ("write_rtt_ms", "p95", False),
+    ("ui_update_values_ms", "p95", False),
+    ("ui_render_ms", "p95", False),
+    ("memory_growth_bytes", None, False),
+    ("reconnect_socket_drop_ms", None, False),
+    ("reconnect_server_restart_ms", None, False),
+]
+
+
+def summarize(samples):
+    # 毫秒样本的统计摘要
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3)
+
+    return {"n": len(ordered), "mean": round(sum(ordered) / len(ordered), 3), "p50": percentile(0.5),
+            "p95": percentile(0.95), "p99": percentile(0.99), "max": round(ordered[-1], 3)}
+
+
+class SimulatorProcess:
+    # 模拟 PLC 在独立进程中运行，避免与被测客户端争用 GIL
+    def __init__(self, endpoint, latency_ms, jitter_ms):
+        self.endpoint = endpoint
+        self.command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ClientApp.py"),
+                        "--quiet", "simulate", "--endpoint", endpoint,
+                        "--latency", str(latency_ms), "--jitter", str(jitter_ms)]
+        self.process = None
+
+    def is_listening(self):
+        host, port = self.endpoint.split("//", 1)[1].rsplit(":", 1)
+        try:
+            socket.create_connection((host, int(port.split("/")[0])), timeout=0.5).close()
+            return True
+        except OSError:
+            return False
+
+    def start(self, timeout=15.0):
+        # 端口已被其他服务器占用时不启动，否则测量的将是那个服务器
+        if self.is_listening():
+            raise RuntimeError(f"{self.endpoint} is already in use, stop the other server or use another endpoint")
+        self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            code = self.process.poll()
+            if code is not None:
+                self.process = None
+                raise RuntimeError(f"Simulator exited with code {code} before listening on {self.endpoint}")
+            if self.is_listening():
+                return
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"Simulator did not start on {self.endpoint}")
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait(10)
+            self.process = None
+
+
+def bench_reads(opc_handler, cycles):
+    samples = []
+    start_time = time.perf_counter()
+    for _ in range(cycles):
+        cycle_start = time.perf_counter()
+        opc_handler.read_values()
+        samples.append((time.perf_counter() - cycle_start) * 1000)
+    elapsed = time.perf_counter() - start_time
+    return {"read_cycle_ms": summarize(samples), "read_cycles_per_s": round(cycles / elapsed, 2)}
+
+
+def bench_writes(opc_handler, count):
+    samples = []
+    for i in range(count):
+        start_time = time.perf_counter()
+        success, message = opc_handler.write_values({"X_MoveVel": float(i % 100)})["X_MoveVel"]
+        samples.append((time.perf_counter() - start_time) * 1000)
+        if not success:
+            raise RuntimeError(f"Benchmark write failed: {message}")
+    return {"write_rtt_ms": summarize(samples)}
+
+
+def bench_memory(opc_handler, cycles):
+    # 预热后统计 cycles 次读取周期中 Python 分配的净增长
+    for _ in range(min(cycles, 20)):
+        opc_handler.read_values()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(cycles):
+        opc_handler.read_values()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    growth = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {"memory_growth_bytes": growth}
+
+
+def bench_ui(cycles):
+    # 用离线平台创建 OPCUAGUI，不连接 PLC，测量 update_values 和实际重绘的耗时
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtCore import QObject, pyqtSignal
+    from PyQt5.QtWidgets import QApplication
+    from ClientGUI import OPCUAGUI
+
+    class IdleWorker(QObject):
+        connection_changed = pyqtSignal(bool, str)
+        values_ready = pyqtSignal(dict)
+        value_changed = pyqtSignal(str, object)
+        write_done = pyqtSignal(str, object, bool, str)
+        alarm_event = pyqtSignal(dict)
+        tags_changed = pyqtSignal(object)
+        finished = pyqtSignal()
+
+        def start(self):
+            pass
+
+        def alarm_snapshot(self):
+            return []
+
+        def stop(self):
+            pass
+
+        def isRunning(self):
+            return False
+
+    app = QApplication.instance() or QApplication([])
+    window = OPCUAGUI(IdleWorker())
+    update_samples, render_samples = [], []
+    for i in range(cycles):
+        values = {v: (i % 2 == 0) if info["type"] == "Boolean" else float(i) for v, info in VARIABLES.items()}
+        start_time = time.perf_counter()
+        window.update_values(values)
+        update_samples.append((time.perf_counter() - start_time) * 1000)
+        start_time = time.perf_counter()
+        window.render_dirty()
+        render_samples.append((time.perf_counter() - start_time) * 1000)
+        app.processEvents()
+    window.is_running = False
+    window.close()
+    return {"ui_update_values_ms": summarize(update_samples), "ui_render_ms": summarize(render_samples)}
+
+
+def bench_reconnect(opc_handler, simulator):
+    # 断开套接字后重新激活会话；重启模拟器后服务器已丢弃会话，测量从服务器恢复到重建会话的时间
+    opc_handler.client.disconnect_socket()
+    start_time = time.perf_counter()
+    if not opc_handler.reconnect():
+        raise RuntimeError("Reconnect after socket drop failed")
+    socket_drop_ms = (time.perf_counter() - start_time) * 1000
+    simulator.stop()
+    simulator.start()
+    start_time = time.perf_counter()
+    while not opc_handler.reconnect():
+        if time.perf_counter() - start_time > 30:
+            raise RuntimeError("Reconnect after server restart failed")
+        time.sleep(0.05)
+    restart_ms = (time.perf_counter() - start_time) * 1000
+    return {"reconnect_socket_drop_ms": round(socket_drop_ms, 3), "reconnect_server_restart_ms": round(restart_ms, 3)}
+
+
+def git_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    # 返回回归列表 [(指标, 基线值, 当前值)]
+    regressions = []
+    for name, stat, higher_is_better in COMPARED_METRICS:
+        current, previous = results["metrics"].get(name), baseline.get("metrics", {}).get(name)
+        if stat:
+            current = current.get(stat) if current else None
+            previous = previous.get(stat) if previous else None
+        if current is None or not previous:
+            continue
+        ratio = current / previous
+        if (ratio < 1 - tolerance) if higher_is_better else (ratio > 1 + tolerance):
+            regressions.append((f"{name}.{stat}" if stat else name, previous, current))
+    return regressions
+
+
+def run_benchmark(endpoint=None, latency_ms=0.0, jitter_ms=0.0, cycles=200, ui=True):
+    endpoint = endpoint or BENCHMARK_ENDPOINT
+    simulator = SimulatorProcess(endpoint, latency_ms, jitter_ms)
+    simulator.start()
+    metrics = {}
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            opc_handler = OPCUAHandler(endpoint, node_cache_file=os.path.join(cache_dir, "node_cache.json"))
+            start_time = time.perf_counter()
+            if not opc_handler.connect():
+                raise RuntimeError(f"Cannot connect to simulator at {endpoint}")
+            metrics["connect_ms"] = round((time.perf_counter() - start_time) * 1000, 3)
+            try:
+                metrics.update(bench_reads(opc_handler, cycles))
+                metrics.update(bench_writes(opc_handler, max(1, cycles // 4)))
+                metrics.update(bench_memory(opc_handler, cycles))
+                metrics.update(bench_reconnect(opc_handler, simulator))
+            finally:
+                opc_handler.disconnect()
+    finally:
+        simulator.stop()
+    if ui:
+        metrics.update(bench_ui(cycles))
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "version": git_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"latency_ms": latency_ms, "jitter_ms": jitter_ms, "cycles": cycles, "variables": len(VARIABLES)},
+        "metrics": metrics,
+    }
+
+
+def save_results(results, path=None):
+    with open(path or BENCHMARK_FILE, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
\ No newline at end of file
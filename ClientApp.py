@@ -1,22 +1,32 @@
-from opcua import Client
+from opcua import Client, ua
+from opcua.client.client import KeepAlive
 from opcua.ua import UaStatusCodeError, Variant, VariantType
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QTabWidget, QWidget, QGridLayout, QLabel, QPushButton,
-                             QLineEdit, QScrollArea, QVBoxLayout, QStatusBar, QMessageBox)
-from PyQt5.QtCore import QTimer
+from collections import OrderedDict
+from Alarms import AlarmEngine
+from Historian import Historian
+from Tags import TagFile, TagSubscriber, save_tags
+from Recorder import SessionRecorder, ReplayEngine, Recording, export_csv, export_parquet, session_path, \
+    remove_old_sessions
+from LogPipeline import setup_logging
+import Metrics
+import argparse
 import sys
+import json
+import os
+import random
+import signal
 import time
 import logging
+import threading
 
-# 配置日志
+# 日志配置：写入由后台线程完成，不阻塞读写循环和界面（在 main 中启用，作为模块导入时不改动日志设置）
 log_file = "opcua_monitor.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 按大小轮转的单个文件上限
+LOG_BACKUP_COUNT = 5
+LOG_ROTATE_WHEN = None  # 设为 "midnight" 等值改为按时间轮转
+LOG_JSON_FILE = None  # 结构化日志 (JSON lines) 文件，None 表示不输出
+LOG_RATE_LIMIT = 60  # 相同告警/错误日志的最短输出间隔 (s)
+LOG_LIBRARY_LEVEL = "WARNING"  # python-opcua 内部日志的级别，排查通信问题时改为 "INFO" 或 "DEBUG"
 logger = logging.getLogger("OPCUA")
 
 # PLC 连接信息
@@ -24,6 +34,103 @@ PLC_URL = "opc.tcp://192.168.1.10:4840"
 USERNAME = "admin"
 PASSWORD = "admin"
 
+# 批量读写：服务器未声明 MaxNodesPerRead/MaxNodesPerWrite 时每个请求的最大节点数
+DEFAULT_MAX_NODES_PER_READ = 500
+DEFAULT_MAX_NODES_PER_WRITE = 500
+DEFAULT_MAX_NODES_PER_REGISTER = 500
+# 启动加速：RegisterNodes 换取服务器优化的节点句柄；节点类型校验结果和操作限制缓存到本地，命名空间表不变时跳过
+REGISTER_NODES = True
+NODE_CACHE_FILE = "node_cache.json"
+# 配方文件：{配方名: {变量名: 值}}，一次 Write 请求写入
+RECIPE_FILE = "recipes.json"
+# 机群模式：[{"name": 机器名, "url": 端点, "username": 可选, "password": 可选}]，各机器使用相同的 VARIABLES；
+# 每台机器的节点缓存和历史记录保存在 FLEET_DIR/机器名 下
+FLEET_FILE = "fleet.json"
+FLEET_DIR = "fleet"
+# 网关：一个进程持有 PLC 会话，其他 HMI 经本地 TCP 共享数据并转发写入；USE_GATEWAY 为 True 时界面和 stream 连接网关
+USE_GATEWAY = False
+GATEWAY_HOST = "127.0.0.1"
+GATEWAY_PORT = 4850
+GATEWAY_FLUSH_INTERVAL = 0.02  # 变化合并后广播的周期 (s)
+GATEWAY_MAX_BACKLOG = 1000  # 单个客户端未发送消息上限，超过时断开该客户端
+# 性能指标：Prometheus 文本格式的本地 HTTP 端点，METRICS_PORT 为 None 时不启动（指标仍在进程内记录并显示在状态栏）
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9105
+
+# 刷新方式："subscription" 使用 OPC UA 订阅（服务器拒绝时回退为轮询），"polling" 定时轮询
+UPDATE_MODE = "subscription"
+PUBLISHING_INTERVAL = 100  # 订阅发布周期 (ms)
+# 连接监视：无成功通信超过 KEEPALIVE_INTERVAL 秒时读取服务器状态确认连接，断开后按指数退避（带随机抖动）重连
+KEEPALIVE_INTERVAL = 2.0
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+# 监控项默认参数，可在 VARIABLES 条目中用同名键单独覆盖
+MONITOR_DEFAULTS = {"sampling_interval": 100, "queue_size": 1, "deadband": 0.0}
+
+# 刷新等级及周期 (ms)，None 表示只在连接后读取一次（按需）
+SCAN_CLASSES = {"fast": 50, "medium": 300, "slow": 5000, "on_demand": None}
+DEFAULT_SCAN_CLASS = "medium"
+# 刷新等级的确定顺序：VARIABLES 条目中的 "scan" 键 > 变量名后缀 > 分组 > 可写设定值为 slow > 默认
+SCAN_SUFFIX_CLASSES = {"_PosNow": "fast", "_done": "fast"}
+GROUP_SCAN_CLASSES = {"工厂设置": "slow"}
+
+# 运动序列：使用独立的短周期订阅，等待条件由数据变化驱动；MOTION_AXES 为变量名前缀
+MOTION_AXES = ["X", "Y", "A", "B", "Z"]
+MOTION_PUBLISHING_INTERVAL = 20  # ms
+MOTION_SAMPLING_INTERVAL = 10  # ms
+MOTION_TOLERANCE = 0.01  # 到位判断的位置公差
+MOTION_TIMEOUT = 60.0  # 单步等待的默认超时 (s)
+MOTION_HOME_POSITION = 0.0
+
+# 历史记录：需要保留趋势的变量，每个变量一个固定大小的环形文件 (每个样本 16 字节)
+HISTORY_DIR = "history"
+HISTORY_CAPACITY = 2000000
+HISTORY_VARIABLES = [
+    "X_PosNow", "Y_PosNow", "A_PosNow", "B_PosNow", "Z_PosNow",
+    "AI_CHAMBER_O2_CONTENT_OUTPUT_SEAL", "AI_CHAMBER_PRESSURE_OUTPUT_SEAL", "AI_FILTER_ELEMENT_PRESSURE_OUTPUT"
+]
+
+# 会话录制：每次采集会话把全部变量的每次变化追加到一个二进制文件 (每个变化 19 字节)，可导出 CSV/Parquet 或在界面中回放
+RECORDING_DIR = "recordings"
+RECORDING_ENABLED = True
+RECORDING_FLUSH_INTERVAL = 1.0  # 后台线程批量写入的间隔 (s)
+RECORDING_KEEP_DAYS = 14  # 会话开始时删除更早的录制文件，0 表示不删除
+
+# 报警：值变化时只重新判断依赖该变量的规则。type 为 high/low (limit, deadband 回差)、
+# rate (limit 单位/s, window s, direction 可选 rising/falling)、
+# stuck (timeout s 内无变化)、expression (expr 为变量组成的表达式)；severity 为 critical/warning/info
+ALARM_HISTORY_FILE = "alarm_history.jsonl"
+ALARM_HISTORY_SIZE = 1000  # 内存中保留并在界面显示的历史条数
+ALARM_RULES = [
+    {"name": "O2_HIGH_SEAL", "type": "high", "var": "AI_CHAMBER_O2_CONTENT_OUTPUT_SEAL", "limit": 1000,
+     "deadband": 100, "message": "密封腔氧含量过高"},
+    {"name": "O2_HIGH_LASER", "type": "high", "var": "AI_CHAMBER_O2_CONTENT_OUTPUT_LASER", "limit": 1000,
+     "deadband": 100, "message": "激光腔氧含量过高"},
+    {"name": "O2_RISING_SEAL", "type": "rate", "var": "AI_CHAMBER_O2_CONTENT_OUTPUT_SEAL", "limit": 500,
+     "window": 2.0, "direction": "rising", "severity": "info", "message": "密封腔氧含量快速上升"},
+    {"name": "O2_SENSOR_STUCK_SEAL", "type": "stuck", "var": "AI_CHAMBER_O2_CONTENT_OUTPUT_SEAL", "timeout": 60,
+     "message": "密封腔氧含量长时间无变化，检查传感器"},
+    {"name": "PRESSURE_HIGH_SEAL", "type": "high", "var": "AI_CHAMBER_PRESSURE_OUTPUT_SEAL", "limit": 20,
+     "deadband": 1, "message": "密封腔压力过高"},
+    {"name": "PRESSURE_LOW_SEAL", "type": "low", "var": "AI_CHAMBER_PRESSURE_OUTPUT_SEAL", "limit": 5,
+     "deadband": 1, "message": "密封腔压力过低"},
+    {"name": "PRESSURE_HIGH_LASER", "type": "high", "var": "AI_CHAMBER_PRESSURE_OUTPUT_LASER", "limit": 20,
+     "deadband": 1, "message": "激光腔压力过高"},
+    {"name": "FILTER_PRESSURE_LOW", "type": "expression",
+     "expr": "RECIRCULATING_FAN_ON_H and AI_FILTER_ELEMENT_PRESSURE_OUTPUT < AI_FILTER_ELEMENT_PRESSURE_SET_H * 0.5",
+     "message": "循环风机运行时滤芯压力不足"},
+    {"name": "LASER_WITHOUT_O2_OK", "type": "expression",
+     "expr": "DO_LASER_EXTERNAL_LIGHT_OUTPUT_H and not CHAMBER_O2_OK_LASER", "severity": "critical",
+     "message": "激光出光时激光腔氧含量不合格"},
+]
+
+# 外部变量配置文件 (YAML 或 JSON，格式见 Tags.py)：存在时替换下面内置的 VARIABLES/GROUPED_VARIABLES，
+# 运行中修改后自动重新加载，只重建变化的节点和标签页；discover 命令浏览服务器上的 DISCOVERY_ROOT 生成该文件
+TAGS_FILE = "tags.yaml"
+TAGS_RELOAD_INTERVAL = 2.0  # 检查配置文件是否修改的周期 (s)
+DISCOVERY_ROOT = "ns=2;s=Application.GVL_HMI"
+DISCOVERY_GROUP = "新发现"  # 浏览发现的顶层新变量所在分组，结构体成员按结构体名分组
+
 # 变量配置（123 个，按分组排序）
 VARIABLES = {
     # CNC控制（14 个）
@@ -210,309 +317,1506 @@ GROUPED_VARIABLES = {
     ]
 }
 
+# 变量类型到 Python 类型和 OPC UA 数据类型的映射
+VARIANT_TYPES = {
+    "Boolean": (bool, VariantType.Boolean),
+    "Float": (float, VariantType.Float),
+    "REAL": (float, VariantType.Float),
+    "Int16": (int, VariantType.Int16),
+    "Int32": (int, VariantType.Int32),
+    "UInt16": (int, VariantType.UInt16),
+}
+# 浏览发现变量时服务器数据类型到配置类型的映射，其他类型不支持
+DISCOVERED_TYPES = {"Boolean": "Boolean", "Float": "REAL", "Int16": "Int16", "Int32": "Int32", "UInt16": "UInt16"}
+# 当前使用的变量配置，main 中从 TAGS_FILE 加载
+TAGS = TagFile(TAGS_FILE, VARIABLES, GROUPED_VARIABLES, VARIANT_TYPES, SCAN_CLASSES, TAGS_RELOAD_INTERVAL)
+
+
+def load_recipes():
+    if not os.path.exists(RECIPE_FILE):
+        return {}
+    try:
+        with open(RECIPE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"Failed to load recipes from {RECIPE_FILE}: {e}")
+        return {}
+
+
+def save_recipes(recipes):
+    with open(RECIPE_FILE, "w", encoding="utf-8") as f:
+        json.dump(recipes, f, ensure_ascii=False, indent=2)
+
+
+def load_fleet(path=None):
+    # 返回机器列表，机器名必须唯一；文件缺失或格式错误时抛出 ValueError
+    path = path or FLEET_FILE
+    try:
+        with open(path, encoding="utf-8") as f:
+            machines = json.load(f)
+    except Exception as e:
+        raise ValueError(f"Failed to load fleet from {path}: {e}")
+    names = set()
+    for machine in machines:
+        if not machine.get("name") or not machine.get("url"):
+            raise ValueError(f"Fleet entry needs name and url: {machine}")
+        if machine["name"] in names:
+            raise ValueError(f"Duplicate machine name in fleet: {machine['name']}")
+        names.add(machine["name"])
+    return machines
+
+
+class NodeRegistry:
+    # 多个变量名可能指向同一个 PLC 变量：每个唯一 NodeId 只建一个 Node、只读一次、只缓存一个值
+    def __init__(self, variables):
+        self.aliases = OrderedDict()  # NodeId -> 变量名列表
+        for var_name, info in variables.items():
+            self.aliases.setdefault(info["node"], []).append(var_name)
+        self.node_ids = {var_name: info["node"] for var_name, info in variables.items()}
+        self.nodes = {}  # NodeId -> Node
+        self.values = {}  # NodeId -> 最新值
+
+    def unique_node_ids(self, var_names):
+        return list(OrderedDict.fromkeys(self.node_ids[var_name] for var_name in var_names))
+
+    def update(self, node_id, value):
+        # 缓存值并展开到所有别名；配置重新加载时已删除的节点返回空
+        if node_id not in self.aliases:
+            return {}
+        self.values[node_id] = value
+        return {var_name: value for var_name in self.aliases[node_id]}
+
+    def add(self, var_name, node_id):
+        # 返回是否为新的 NodeId (需要创建节点)
+        self.node_ids[var_name] = node_id
+        aliases = self.aliases.setdefault(node_id, [])
+        aliases.append(var_name)
+        return len(aliases) == 1
+
+    def remove(self, var_name):
+        # 返回不再被任何变量引用的 NodeId，仍有别名时返回 None
+        node_id = self.node_ids.pop(var_name)
+        aliases = self.aliases[node_id]
+        aliases.remove(var_name)
+        if aliases:
+            return None
+        del self.aliases[node_id]
+        self.nodes.pop(node_id, None)
+        self.values.pop(node_id, None)
+        return node_id
+
+    def cached_value(self, var_name, default=None):
+        return self.values.get(self.node_ids[var_name], default)
+
+    def clear(self):
+        self.nodes = {}
+        self.values = {}
+
+
+class DataChangeHandler:
+    # 订阅回调运行在 opcua 的接收线程中，只负责把通知转交给 callback
+    def __init__(self, callback, registry, machine=""):
+        self.callback = callback
+        self.registry = registry
+        self.machine = machine  # 指标的 machine 标签
+        self.handles = {}  # client handle -> NodeId
+
+    def datachange_notification(self, node, val, data):
+        node_id = self.handles.get(data.subscription_data.client_handle)
+        if node_id is None:
+            return
+        Metrics.data_changes.inc(self.machine)
+        status = data.monitored_item.Value.StatusCode
+        if not status.is_good():
+            logger.error(f"Bad data change for {node_id}: {status}")
+            Metrics.node_errors.inc(self.machine, node_id)
+            val = "N/A"
+        for var_name, value in self.registry.update(node_id, val).items():
+            self.callback(var_name, value)
+
+    def status_change_notification(self, status):
+        logger.warning(f"Subscription status changed: {status}")
+
+
 class OPCUAHandler:
-    def __init__(self):
+    def __init__(self, url=None, username=None, password=None, node_cache_file=None, machine=""):
+        # 未指定的连接参数使用模块配置；machine 为指标的 machine 标签，机群中为机器名
+        self.machine = machine
+        self.url = url or PLC_URL
+        self.username = username or USERNAME
+        self.password = password or PASSWORD
+        self.node_cache_file = node_cache_file or NODE_CACHE_FILE
         self.client = None
         self.nodes = {}
+        self.registry = NodeRegistry(VARIABLES)
+        self.max_nodes_per_read = DEFAULT_MAX_NODES_PER_READ
+        self.max_nodes_per_write = DEFAULT_MAX_NODES_PER_WRITE
+        self.max_nodes_per_register = DEFAULT_MAX_NODES_PER_REGISTER
+        self.data_types = {}  # NodeId -> 服务器上的数据类型名
+        self.last_read_ms = None
+        self.subscription = None
+        self.data_handler = None
+        self.monitored_items = {}  # NodeId -> 服务器返回的监控项 id
+        self.next_handle = 1
+        self.connected = False
+        self.last_ok = 0.0  # 最近一次成功通信的时间 (monotonic)
 
-    def connect(self):
-        self.cleanup_sessions()
-        self.client = Client(PLC_URL)
-        self.client.set_user(USERNAME)
-        self.client.set_password(PASSWORD)
+    def connect(self, init_nodes=True):
+        # init_nodes 为 False 时只建立会话 (discover 浏览服务器时不需要配置中的节点)
+        self.client = Client(self.url)
+        self.client.set_user(self.username)
+        self.client.set_password(self.password)
         self.client.connect_timeout = 5
         max_retries = 3
         for attempt in range(max_retries):
             try:
                 self.client.connect()
-                logger.info("Successfully connected to PLC")
-                for var_name, info in VARIABLES.items():
-                    self.nodes[var_name] = self.client.get_node(info["node"])
-                    logger.info(f"Initialized node {var_name}: {info['node']}")
+                self.mark_ok()
+                logger.info(f"Successfully connected to PLC at {self.url}")
+                if init_nodes:
+                    self.init_nodes()
                 return True
             except UaStatusCodeError as e:
-                logger.error(f"Connection attempt {attempt + 1}/{max_retries} failed: {e}")
+                logger.error(f"Connection attempt {attempt + 1}/{max_retries} to {self.url} failed: {e}")
                 if "BadTooManySessions" in str(e):
-                    logger.warning("Too many sessions detected, attempting cleanup...")
-                    self.cleanup_sessions()
+                    logger.warning("Too many sessions on the server, waiting for stale sessions to time out...")
                 time.sleep(1)
                 if attempt == max_retries - 1:
                     logger.error("Max connection retries reached")
                     return False
             except Exception as e:
-                logger.error(f"Unexpected connection error: {e}")
+                logger.error(f"Unexpected connection error ({self.url}): {e}")
                 return False
 
-    def cleanup_sessions(self):
+    def init_nodes(self):
+        for node_id, aliases in self.registry.aliases.items():
+            node = self.client.get_node(node_id)
+            self.registry.nodes[node_id] = node
+            for var_name in aliases:
+                self.nodes[var_name] = node
+        namespaces = self.client.get_namespace_array()
+        cache = self.load_node_cache(namespaces)
+        if cache:
+            limits = cache["limits"]
+            self.max_nodes_per_read = limits["MaxNodesPerRead"]
+            self.max_nodes_per_write = limits["MaxNodesPerWrite"]
+            self.max_nodes_per_register = limits["MaxNodesPerRegisterNodes"]
+            self.data_types = {k: v for k, v in cache["data_types"].items() if k in self.registry.nodes}
+        else:
+            self.max_nodes_per_read = self.read_operation_limit(
+                ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRead, "MaxNodesPerRead",
+                DEFAULT_MAX_NODES_PER_READ)
+            self.max_nodes_per_write = self.read_operation_limit(
+                ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerWrite, "MaxNodesPerWrite",
+                DEFAULT_MAX_NODES_PER_WRITE)
+            self.max_nodes_per_register = self.read_operation_limit(
+                ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRegisterNodes,
+                "MaxNodesPerRegisterNodes", DEFAULT_MAX_NODES_PER_REGISTER)
+            self.data_types = {}
+        # 只校验缓存中没有的节点
+        unchecked = [node_id for node_id in self.registry.nodes if node_id not in self.data_types]
+        if unchecked:
+            self.validate_types(unchecked)
+        self.register_nodes()
+        if unchecked or not cache:
+            self.save_node_cache(namespaces)
+        logger.info(f"Initialized {len(self.registry.nodes)} nodes for {len(self.nodes)} variables "
+                    f"({'cached' if cache else 'no cache'}, {len(unchecked)} types checked)")
+
+    def load_node_cache(self, namespaces):
+        # 缓存只在连接同一地址且服务器命名空间表一致时有效
+        if not os.path.exists(self.node_cache_file):
+            return None
         try:
-            if self.client:
-                self.client.disconnect()
-                logger.info("Disconnected existing client for cleanup")
-            temp_client = Client(PLC_URL)
-            temp_client.set_user(USERNAME)
-            temp_client.set_password(PASSWORD)
-            temp_client.connect_timeout = 5
-            temp_client.connect()
-            temp_client.disconnect()
-            logger.info("Session cleanup completed successfully")
+            with open(self.node_cache_file, encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("endpoint") != self.url or cache.get("namespaces") != namespaces:
+                logger.info("Node cache is stale, rebuilding")
+                return None
+            return cache
+        except Exception as e:
+            logger.warning(f"Failed to load node cache: {e}")
+            return None
+
+    def save_node_cache(self, namespaces):
+        cache = {
+            "endpoint": self.url,
+            "namespaces": namespaces,
+            "limits": {
+                "MaxNodesPerRead": self.max_nodes_per_read,
+                "MaxNodesPerWrite": self.max_nodes_per_write,
+                "MaxNodesPerRegisterNodes": self.max_nodes_per_register,
+            },
+            "data_types": self.data_types,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.node_cache_file) or ".", exist_ok=True)
+            with open(self.node_cache_file, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"Failed to save node cache: {e}")
+
+    def validate_types(self, node_ids):
+        # 一次批量读取 DataType 属性，与 VARIABLES 中声明的类型比较
+        results = self.read_attributes([self.registry.nodes[node_id].nodeid for node_id in node_ids],
+                                       ua.AttributeIds.DataType)
+        for node_id, result in zip(node_ids, results):
+            var_name = self.registry.aliases[node_id][0]
+            if not result.StatusCode.is_good():
+                logger.error(f"Node {node_id} ({var_name}) not available: {result.StatusCode}")
+                continue
+            data_type = result.Value.Value
+            try:
+                type_name = ua.VariantType(data_type.Identifier).name if data_type.NamespaceIndex == 0 else data_type.to_string()
+            except ValueError:
+                type_name = data_type.to_string()
+            self.data_types[node_id] = type_name
+            expected = VARIANT_TYPES[VARIABLES[var_name]["type"]][1].name
+            if type_name != expected:
+                logger.warning(f"Type mismatch for {var_name}: configured {VARIABLES[var_name]['type']}, server reports {type_name}")
+
+    def register_nodes(self, nodes=None):
+        # 注册节点后服务器返回优化的 NodeId；新会话需要重新注册，先恢复原 NodeId。nodes 默认为全部节点
+        nodes = list(self.registry.nodes.values()) if nodes is None else nodes
+        for node in nodes:
+            if getattr(node, "basenodeid", None):
+                node.nodeid = node.basenodeid
+                node.basenodeid = None
+        if not REGISTER_NODES:
+            return
+        chunk_size = max(1, self.max_nodes_per_register)
+        registered = []
+        try:
+            for i in range(0, len(nodes), chunk_size):
+                registered.extend(self.client.register_nodes(nodes[i:i + chunk_size]))
+            logger.info(f"Registered {len(registered)} nodes")
+        except Exception as e:
+            logger.warning(f"RegisterNodes failed, using string NodeIds: {e}")
+            for node in registered:
+                node.nodeid = node.basenodeid
+                node.basenodeid = None
+
+    def mark_ok(self):
+        self.connected = True
+        self.last_ok = time.monotonic()
+
+    def check_alive(self):
+        # 看门狗：读取服务器状态确认连接仍然可用
+        try:
+            self.client.get_node(ua.NodeId(ua.ObjectIds.Server_ServerStatus_State)).get_value()
+            self.mark_ok()
+        except Exception as e:
+            logger.error(f"Keepalive failed: {e}")
+            Metrics.keepalive_failures.inc(self.machine)
+            self.connected = False
+        return self.connected
+
+    def reconnect(self):
+        # 优先在新的安全通道上重新激活原会话，服务器已丢弃会话时再创建新会话；Node 句柄随同一个 Client 继续有效
+        if self.client.keepalive:
+            self.client.keepalive.stop()
+        try:
+            self.client.disconnect_socket()
+        except Exception:
+            pass
+        if self.reactivate_session():
+            logger.info(f"Reactivated existing session on {self.url}")
+        else:
+            try:
+                self.client.connect()
+                logger.info(f"Created new session on {self.url}")
+                self.register_nodes()
+            except Exception as e:
+                logger.error(f"Reconnect to {self.url} failed: {e}")
+                try:
+                    self.client.disconnect_socket()
+                except Exception:
+                    pass
+                return False
+        self.mark_ok()
+        return True
+
+    # python-opcua 没有公开会话的认证令牌，重新激活会话只能读写其私有属性 (在 opcua 0.98.13 上验证)；
+    # 库的内部结构变化时这两个方法返回 None/False，reconnect 改为创建新会话
+    def session_token(self):
+        try:
+            return self.client.uaclient._uasocket.authentication_token
+        except AttributeError:
+            return None
+
+    def set_session_token(self, token):
+        try:
+            socket = self.client.uaclient._uasocket
+        except AttributeError:
+            return False
+        if not hasattr(socket, "authentication_token"):
+            return False
+        socket.authentication_token = token
+        return True
+
+    def reactivate_session(self):
+        token = self.session_token()
+        if token is None:
+            logger.warning("Session token not accessible in this python-opcua version, creating a new session")
+            return False
+        try:
+            self.client.connect_socket()
         except Exception as e:
-            logger.error(f"Failed to cleanup sessions: {e}")
+            logger.warning(f"Reconnect socket failed: {e}")
+            return False
+        try:
+            self.client.send_hello()
+            self.client.open_secure_channel()
+            if not self.set_session_token(token):
+                raise RuntimeError("session token not accessible in this python-opcua version")
+            self.client.activate_session(username=self.username, password=self.password)
+            self.client.keepalive = KeepAlive(
+                self.client, min(self.client.session_timeout, self.client.secure_channel_timeout) * 0.7)
+            self.client.keepalive.start()
+            return True
+        except Exception as e:
+            logger.warning(f"Session reactivation failed: {e}")
+            try:
+                self.client.disconnect_socket()
+            except Exception:
+                pass
+            return False
 
-    def read_values(self):
+    def read_operation_limit(self, object_id, name, default):
+        # 读取服务器的操作限制，0 表示不限制
+        try:
+            limit = int(self.client.get_node(ua.NodeId(object_id)).get_value() or 0)
+            logger.info(f"Server {name}: {limit or 'unlimited'}")
+            return limit or default
+        except Exception as e:
+            logger.warning(f"Failed to read {name}, using {default}: {e}")
+            return default
+
+    def read_attributes(self, nodeids, attribute):
+        # 按 MaxNodesPerRead 分块的批量读取
+        results = []
+        chunk_size = max(1, self.max_nodes_per_read)
+        for i in range(0, len(nodeids), chunk_size):
+            results.extend(self.client.uaclient.get_attributes(nodeids[i:i + chunk_size], attribute))
+        return results
+
+    def read_values(self, var_names=None):
         values = {}
         start_time = time.time()
         try:
-            for var_name, node in self.nodes.items():
-                try:
-                    values[var_name] = node.get_value()
-                    logger.debug(f"Read {var_name}: {values[var_name]}")
-                except UaStatusCodeError as e:
-                    logger.error(f"Failed to read {var_name}: {str(e)} (Node: {node.nodeid.to_string()})")
-                    values[var_name] = "N/A"
+            var_names = list(self.nodes.keys()) if var_names is None else list(var_names)
+            node_ids = self.registry.unique_node_ids(var_names)
+            # 一次 Read 服务请求读取所有节点，超过 MaxNodesPerRead 时分块
+            results = self.read_attributes([self.registry.nodes[node_id].nodeid for node_id in node_ids],
+                                           ua.AttributeIds.Value)
+            requests = -(-len(node_ids) // max(1, self.max_nodes_per_read))
+            for node_id, result in zip(node_ids, results):
+                if result.StatusCode.is_good():
+                    value = result.Value.Value
+                    logger.debug(f"Read {node_id}: {value}")
+                else:
+                    logger.error(f"Failed to read {node_id}: {result.StatusCode}")
+                    Metrics.node_errors.inc(self.machine, node_id)
+                    value = "N/A"
+                values.update(self.registry.update(node_id, value))
             elapsed_time = (time.time() - start_time) * 1000
-            logger.debug(f"Read all values in {elapsed_time:.2f} ms")
+            Metrics.read_cycle_seconds.observe(elapsed_time / 1000, self.machine)
+            Metrics.read_nodes.inc(self.machine, amount=len(node_ids))
+            previous = f"{self.last_read_ms:.2f} ms" if self.last_read_ms is not None else "n/a"
+            logger.debug(f"Read all values in {elapsed_time:.2f} ms "
+                         f"({len(node_ids)} nodes, {requests} requests, previous cycle {previous})")
+            self.last_read_ms = elapsed_time
+            self.mark_ok()
             return values
         except Exception as e:
             logger.error(f"Read failed: {e}")
+            Metrics.read_failures.inc(self.machine)
+            self.connected = False
             return {}
 
-    def write_value(self, var_name, value):
+    def make_monitored_item(self, handle, var_name, node, sampling_interval=None):
+        # 别名共用监控项时以第一个变量名的配置为准；未单独配置采样周期时使用刷新等级的周期
+        settings = {key: VARIABLES[var_name].get(key, default) for key, default in MONITOR_DEFAULTS.items()}
+        if sampling_interval:
+            settings["sampling_interval"] = sampling_interval
+        elif "sampling_interval" not in VARIABLES[var_name]:
+            settings["sampling_interval"] = SCAN_CLASSES[scan_class(var_name)] or SCAN_CLASSES["slow"]
+        read_id = ua.ReadValueId()
+        read_id.NodeId = node.nodeid
+        read_id.AttributeId = ua.AttributeIds.Value
+        params = ua.MonitoringParameters()
+        params.ClientHandle = handle
+        params.SamplingInterval = settings["sampling_interval"]
+        params.QueueSize = settings["queue_size"]
+        params.DiscardOldest = True
+        # 死区只对数值型变量有意义
+        if settings["deadband"] and VARIABLES[var_name]["type"] != "Boolean":
+            deadband = ua.DataChangeFilter()
+            deadband.Trigger = ua.DataChangeTrigger.StatusValue
+            deadband.DeadbandType = ua.DeadbandType.Absolute
+            deadband.DeadbandValue = float(settings["deadband"])
+            params.Filter = deadband
+        request = ua.MonitoredItemCreateRequest()
+        request.ItemToMonitor = read_id
+        request.MonitoringMode = ua.MonitoringMode.Reporting
+        request.RequestedParameters = params
+        return request
+
+    def subscribe(self, callback, var_names=None, publishing_interval=None, sampling_interval=None):
+        # 每个唯一 NodeId 创建一个监控项，返回订阅成功的变量名；失败的变量由调用方轮询
+        # var_names 限定订阅的变量，publishing_interval/sampling_interval 覆盖默认周期 (ms)
         try:
-            node = self.nodes[var_name]
-            var_type = VARIABLES[var_name]["type"]
-            if var_type == "Boolean":
-                node.set_value(Variant(bool(value), VariantType.Boolean))
-            elif var_type in ["Float", "REAL"]:
-                node.set_value(Variant(float(value), VariantType.Float))
-            elif var_type == "Int16":
-                node.set_value(Variant(int(value), VariantType.Int16))
-            elif var_type == "Int32":
-                node.set_value(Variant(int(value), VariantType.Int32))
-            elif var_type == "UInt16":
-                node.set_value(Variant(int(value), VariantType.UInt16))
-            logger.info(f"Successfully wrote {value} to {var_name}")
-            return True, f"{var_name} 已设置为 {value}"
-        except UaStatusCodeError as e:
-            if str(e).find("BadWriteNotSupported") != -1:
-                try:
-                    current_value = node.get_value()
-                    if var_type in ["Float", "REAL"]:
-                        success = abs(float(current_value) - float(value)) < 1e-6
-                    else:
-                        success = current_value == value
-                    if success:
-                        logger.info(f"Write to {var_name} succeeded despite BadWriteNotSupported (verified value: {current_value})")
-                        return True, f"{var_name} 已设置为 {value}"
-                    else:
-                        logger.error(f"Write to {var_name} failed (verified value: {current_value}, expected: {value})")
-                        return False, f"写入失败: 值未更新 (期望 {value}, 实际 {current_value})"
-                except Exception as verify_error:
-                    logger.error(f"Failed to verify write to {var_name}: {verify_error}")
-                    return False, f"写入失败: 无法验证写入结果 ({str(verify_error)})"
+            self.data_handler = DataChangeHandler(callback, self.registry, self.machine)
+            self.subscription = self.client.create_subscription(publishing_interval or PUBLISHING_INTERVAL,
+                                                                self.data_handler)
+            node_ids = list(self.registry.nodes.keys())
+            if var_names is not None:
+                node_ids = [node_id for node_id in self.registry.unique_node_ids(var_names)
+                            if node_id in self.registry.nodes]
+            monitored = self.monitor_nodes(node_ids, sampling_interval)
+            requested = len(self.nodes) if var_names is None else len(var_names)
+            logger.info(f"Subscribed to {len(monitored)}/{requested} variables ({len(node_ids)} unique nodes)")
+            return monitored
+        except Exception as e:
+            logger.error(f"Subscription failed, falling back to polling: {e}")
+            self.unsubscribe()
+            return []
+
+    def monitor_nodes(self, node_ids, sampling_interval=None):
+        # 在当前订阅中为每个 NodeId 创建一个监控项，返回订阅成功的变量名
+        items = []
+        handles = []
+        for node_id in node_ids:
+            handle = self.next_handle
+            self.next_handle += 1
+            self.data_handler.handles[handle] = node_id
+            handles.append(handle)
+            items.append(self.make_monitored_item(handle, self.registry.aliases[node_id][0],
+                                                  self.registry.nodes[node_id], sampling_interval))
+        results = self.subscription.create_monitored_items(items) if items else []
+        monitored = []
+        for node_id, handle, result in zip(node_ids, handles, results):
+            if isinstance(result, ua.StatusCode):
+                logger.warning(f"Monitored item for {node_id} rejected: {result}")
+                del self.data_handler.handles[handle]
             else:
-                logger.error(f"Failed to write {var_name}: {e}")
-                return False, f"写入失败: {e}"
-        except ValueError as e:
-            logger.error(f"Invalid value for {var_name}: {e}")
-            return False, f"无效值: {e}"
+                self.monitored_items[node_id] = (handle, result)
+                monitored.extend(self.registry.aliases[node_id])
+        return monitored
+
+    def unmonitor_nodes(self, node_ids):
+        # 一次请求删除这些节点的监控项
+        entries = [self.monitored_items.pop(node_id) for node_id in node_ids if node_id in self.monitored_items]
+        for handle, _ in entries:
+            self.data_handler.handles.pop(handle, None)
+        if entries:
+            try:
+                self.subscription.unsubscribe([item_id for _, item_id in entries])
+            except Exception as e:
+                logger.warning(f"Failed to delete {len(entries)} monitored items: {e}")
+
+    def update_variables(self, detach, attach):
+        # 变量配置重新加载后只处理变化的变量：删除不再引用的节点及其监控项，新节点校验类型、注册并加入订阅；
+        # 返回在订阅中的新变量名，其余由调用方轮询
+        stale = []
+        for var_name in detach:
+            self.nodes.pop(var_name, None)
+            node_id = self.registry.remove(var_name) if var_name in self.registry.node_ids else None
+            if node_id:
+                stale.append(node_id)
+                self.data_types.pop(node_id, None)
+        created = []
+        for var_name in attach:
+            node_id = VARIABLES[var_name]["node"]
+            if self.registry.add(var_name, node_id):
+                self.registry.nodes[node_id] = self.client.get_node(node_id)
+                created.append(node_id)
+            self.nodes[var_name] = self.registry.nodes[node_id]
+        monitored = []
+        try:
+            if created:
+                self.validate_types(created)
+                self.register_nodes([self.registry.nodes[node_id] for node_id in created])
+            if self.subscription:
+                self.unmonitor_nodes(stale)
+                # 已在订阅中的节点新增的别名沿用原监控项
+                monitored = [v for v in attach if self.registry.node_ids[v] in self.monitored_items]
+                monitored += self.monitor_nodes(created)
         except Exception as e:
-            logger.error(f"Unexpected write error for {var_name}: {e}")
-            return False, f"写入错误: {e}"
+            # 按连接中断处理，重连后重新创建全部监控项
+            logger.error(f"Failed to update nodes after tag reload: {e}")
+            self.connected = False
+            return []
+        logger.info(f"Updated nodes after tag reload: {len(stale)} removed, {len(created)} added")
+        return monitored
+
+    def browse_variables(self, root_node_id):
+        # 逐层批量浏览 root 下的变量和对象，结构体成员的变量名用 _ 连接路径；再批量读取数据类型、访问级别、
+        # 数组维数和描述。返回 ({变量名: 配置}, {变量名: 所属结构体路径，顶层为 ""}, [跳过的变量])
+        found = []  # (变量名, 父路径, NodeId)
+        level = [(ua.NodeId.from_string(root_node_id), "")]
+        while level:
+            next_level = []
+            for (_, path), references in zip(level, self.browse_children([nodeid for nodeid, _ in level])):
+                for reference in references:
+                    name = f"{path}_{reference.BrowseName.Name}" if path else reference.BrowseName.Name
+                    if reference.NodeClass == ua.NodeClass.Variable:
+                        found.append((name, path, reference.NodeId))
+                    next_level.append((reference.NodeId, name))
+            level = next_level
+        nodeids = [nodeid for _, _, nodeid in found]
+        parent_paths = {path for _, path, _ in found}
+        attributes = [self.read_attributes(nodeids, attribute) for attribute in (
+            ua.AttributeIds.DataType, ua.AttributeIds.UserAccessLevel, ua.AttributeIds.ValueRank,
+            ua.AttributeIds.Description)]
+        variables = OrderedDict()
+        parents = {}
+        skipped = []
+        for (name, path, nodeid), data_type, access, rank, description in zip(found, *attributes):
+            data_type = data_type.Value.Value if data_type.StatusCode.is_good() else None
+            var_type = None
+            if data_type is not None and data_type.NamespaceIndex == 0:
+                try:
+                    var_type = DISCOVERED_TYPES.get(ua.VariantType(data_type.Identifier).name)
+                except ValueError:
+                    pass
+            if var_type is None or (rank.StatusCode.is_good() and rank.Value.Value != -1):
+                # 结构体本身、数组和不支持的类型；结构体的成员已作为单独的变量浏览
+                if name not in parent_paths:
+                    skipped.append(name)
+                continue
+            comment = ""
+            if description.StatusCode.is_good() and description.Value.Value:
+                comment = description.Value.Value.Text or ""
+            writable = access.StatusCode.is_good() and bool(access.Value.Value & ua.AccessLevel.CurrentWrite.mask)
+            variables[name] = {"node": nodeid.to_string(), "type": var_type,
+                               "comment": "" if comment == name else comment, "writable": writable}
+            parents[name] = path
+        logger.info(f"Discovered {len(variables)} variables under {root_node_id} ({len(skipped)} skipped)")
+        return variables, parents, skipped
+
+    def browse_children(self, nodeids):
+        # 一次 Browse 请求浏览多个节点的下级变量和对象 (不含属性)，返回每个节点的 ReferenceDescription 列表
+        children = []
+        chunk_size = max(1, self.max_nodes_per_read)
+        for i in range(0, len(nodeids), chunk_size):
+            params = ua.BrowseParameters()
+            params.View = ua.ViewDescription()
+            params.RequestedMaxReferencesPerNode = 0
+            for nodeid in nodeids[i:i + chunk_size]:
+                description = ua.BrowseDescription()
+                description.NodeId = nodeid
+                description.BrowseDirection = ua.BrowseDirection.Forward
+                description.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+                description.IncludeSubtypes = True
+                description.NodeClassMask = ua.NodeClass.Object | ua.NodeClass.Variable
+                description.ResultMask = ua.BrowseResultMask.All
+                params.NodesToBrowse.append(description)
+            for nodeid, result in zip(nodeids[i:i + chunk_size], self.client.uaclient.browse(params)):
+                if result.ContinuationPoint:
+                    # 服务器分页返回时改用逐个节点浏览 (python-opcua 处理续传)
+                    references = self.client.get_node(nodeid).get_children_descriptions()
+                else:
+                    references = result.References
+                children.append([reference for reference in references
+                                 if reference.NodeClass in (ua.NodeClass.Object, ua.NodeClass.Variable)
+                                 and reference.ReferenceTypeId != ua.NodeId(ua.ObjectIds.HasProperty)])
+        return children
+
+    def unsubscribe(self):
+        if self.subscription:
+            try:
+                self.subscription.delete()
+            except Exception as e:
+                logger.error(f"Failed to delete subscription: {e}")
+            finally:
+                self.subscription = None
+                self.data_handler = None
+                self.monitored_items = {}
+
+    def write_value(self, var_name, value):
+        return self.write_values({var_name: value})[var_name]
+
+    def write_values(self, values):
+        # 一次 Write 服务请求写入多个变量，返回 {变量名: (是否成功, 消息)}
+        results = {}
+        variants = OrderedDict()
+        for var_name, value in values.items():
+            try:
+                convert, variant_type = VARIANT_TYPES[VARIABLES[var_name]["type"]]
+                variants[var_name] = Variant(convert(value), variant_type)
+            except ValueError as e:
+                logger.error(f"Invalid value for {var_name}: {e}")
+                results[var_name] = (False, f"无效值: {e}")
+            except Exception as e:
+                logger.error(f"Unexpected write error for {var_name}: {e}")
+                results[var_name] = (False, f"写入错误: {e}")
+        var_names = list(variants.keys())
+        unsupported = []
+        chunk_size = max(1, self.max_nodes_per_write)
+        for i in range(0, len(var_names), chunk_size):
+            chunk = var_names[i:i + chunk_size]
+            params = ua.WriteParameters()
+            for var_name in chunk:
+                write_value = ua.WriteValue()
+                write_value.NodeId = self.nodes[var_name].nodeid
+                write_value.AttributeId = ua.AttributeIds.Value
+                write_value.Value = ua.DataValue(variants[var_name])
+                params.NodesToWrite.append(write_value)
+            try:
+                with Metrics.write_seconds.time(self.machine):
+                    statuses = self.client.uaclient.write(params)
+                self.mark_ok()
+            except Exception as e:
+                self.connected = False
+                for var_name in chunk:
+                    logger.error(f"Unexpected write error for {var_name}: {e}")
+                    results[var_name] = (False, f"写入错误: {e}")
+                continue
+            for var_name, status in zip(chunk, statuses):
+                value = variants[var_name].Value
+                if status.is_good():
+                    self.registry.update(self.registry.node_ids[var_name], value)
+                    logger.info(f"Successfully wrote {value} to {var_name}")
+                    results[var_name] = (True, f"{var_name} 已设置为 {value}")
+                elif status.value == ua.StatusCodes.BadWriteNotSupported:
+                    unsupported.append(var_name)
+                else:
+                    logger.error(f"Failed to write {var_name}: {status}")
+                    results[var_name] = (False, f"写入失败: {status}")
+        if unsupported:
+            results.update(self.verify_writes({var_name: variants[var_name].Value for var_name in unsupported}))
+        for var_name, (success, _) in results.items():
+            if not success:
+                Metrics.write_errors.inc(self.machine, var_name)
+        return results
+
+    def verify_writes(self, expected):
+        # 部分 PLC 对写入返回 BadWriteNotSupported 但实际已写入，批量回读确认
+        results = {}
+        current_values = self.read_values(expected.keys())
+        for var_name, value in expected.items():
+            if var_name not in current_values:
+                logger.error(f"Failed to verify write to {var_name}: read failed")
+                results[var_name] = (False, "写入失败: 无法验证写入结果 (读取失败)")
+                continue
+            current_value = current_values[var_name]
+            try:
+                if VARIABLES[var_name]["type"] in ["Float", "REAL"]:
+                    success = abs(float(current_value) - float(value)) < 1e-6
+                else:
+                    success = current_value == value
+            except (TypeError, ValueError):
+                success = False
+            if success:
+                logger.info(f"Write to {var_name} succeeded despite BadWriteNotSupported (verified value: {current_value})")
+                results[var_name] = (True, f"{var_name} 已设置为 {value}")
+            else:
+                logger.error(f"Write to {var_name} failed (verified value: {current_value}, expected: {value})")
+                results[var_name] = (False, f"写入失败: 值未更新 (期望 {value}, 实际 {current_value})")
+        return results
+
+    def apply_recipe(self, name, recipes=None):
+        recipes = load_recipes() if recipes is None else recipes
+        if name not in recipes:
+            return {name: (False, f"配方不存在: {name}")}
+        logger.info(f"Applying recipe {name} ({len(recipes[name])} variables)")
+        return self.write_values(recipes[name])
 
     def disconnect(self):
+        self.unsubscribe()
         if self.client:
             try:
                 self.client.disconnect()
                 logger.info("Disconnected from PLC")
-                self.cleanup_sessions()
             except Exception as e:
                 logger.error(f"Disconnect failed: {e}")
             finally:
                 self.client = None
+                self.connected = False
                 self.nodes = {}
+                self.registry.clear()
+
+def scan_class(var_name):
+    info = VARIABLES[var_name]
+    if "scan" in info:
+        return info["scan"]
+    for suffix, class_name in SCAN_SUFFIX_CLASSES.items():
+        if var_name.endswith(suffix):
+            return class_name
+    for group_name, class_name in GROUP_SCAN_CLASSES.items():
+        if var_name in GROUPED_VARIABLES.get(group_name, []):
+            return class_name
+    if info["writable"] and info["type"] != "Boolean":
+        return "slow"
+    return DEFAULT_SCAN_CLASS
+
+
+class ScanScheduler:
+    # 多速率轮询：每个刷新等级按固定节拍发出自己的批量读取，同时到期的等级合并为一次读取
+    def __init__(self, var_names, machine=""):
+        self.machine = machine  # 指标的 machine 标签
+        self.classes = OrderedDict()
+        for var_name in var_names:
+            self.classes.setdefault(scan_class(var_name), []).append(var_name)
+        now = time.monotonic()
+        self.next_due = {class_name: now for class_name in self.classes}
+        self.overruns = 0
+        for class_name, members in self.classes.items():
+            interval = SCAN_CLASSES[class_name]
+            logger.info(f"Scan class {class_name} ({interval or 'on demand'} ms): {len(members)} variables")
 
-class OPCUAGUI(QMainWindow):
+    def time_until_due(self):
+        if not self.next_due:
+            return None
+        return max(0.0, min(self.next_due.values()) - time.monotonic())
+
+    def due_vars(self):
+        now = time.monotonic()
+        var_names = []
+        for class_name, due in list(self.next_due.items()):
+            if now < due:
+                continue
+            Metrics.scan_lag_seconds.observe(now - due, self.machine, class_name)
+            var_names.extend(self.classes[class_name])
+            interval = SCAN_CLASSES[class_name]
+            if interval is None:
+                del self.next_due[class_name]
+                continue
+            interval /= 1000
+            # 按固定节拍推进避免漂移；落后超过一个周期时丢弃错过的周期并记为超限
+            next_due = due + interval
+            if next_due <= now:
+                missed = int((now - due) // interval)
+                self.overruns += missed
+                Metrics.scan_overruns.inc(self.machine, class_name, amount=missed)
+                logger.warning(f"Scan class {class_name} overrun: {missed} cycle(s) missed")
+                next_due = due + (missed + 1) * interval
+            self.next_due[class_name] = next_due
+        return var_names
+
+    def check_duration(self, var_names, elapsed):
+        # 一次读取耗时超过参与等级中最短周期时记为超限
+        intervals = {SCAN_CLASSES[scan_class(v)]: scan_class(v) for v in var_names if SCAN_CLASSES[scan_class(v)]}
+        if intervals and elapsed * 1000 > min(intervals):
+            self.overruns += 1
+            Metrics.scan_overruns.inc(self.machine, intervals[min(intervals)])
+            logger.warning(f"Scan read took {elapsed * 1000:.1f} ms, longer than the {min(intervals)} ms cycle")
+
+
+class WriteQueue:
+    # 按变量合并的写入队列：同一变量未执行的写入只保留最新值，并按最后一次提交的顺序执行
     def __init__(self):
-        super().__init__()
-        self.setWindowTitle("PLC OPC UA 实时监控")
-        self.setGeometry(100, 100, 1000, 800)
-        self.opc_handler = OPCUAHandler()
-        self.value_labels = {}
-        self.entries = {}
-        self.bool_buttons = {}  # 存储布尔型按钮
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def put(self, var_name, value):
+        self.put_many({var_name: value})
+
+    def put_many(self, values):
+        with self.condition:
+            for var_name, value in values.items():
+                self.pending.pop(var_name, None)
+                self.pending[var_name] = value
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        # 取出全部待写入的变量，由调用方合并为一次批量写入
+        with self.condition:
+            if not self.pending and not self.closed:
+                self.condition.wait(timeout)
+            pending, self.pending = self.pending, OrderedDict()
+            return pending
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+def open_recorder(directory, url):
+    # 每次采集会话一个录制文件，开始前清理过期的文件
+    remove_old_sessions(directory, RECORDING_KEEP_DAYS)
+    return SessionRecorder(session_path(directory), list(VARIABLES), {"url": url}, RECORDING_FLUSH_INTERVAL)
+
+
+class AcquisitionEngine:
+    # 不依赖界面的采集循环：独占 OPCUAHandler 会话，所有 PLC 读写都在调用 run 的线程执行，结果通过回调通知。
+    # 连接、读写和重连流程只写一份 (session 等生成器)：阻塞的 PLC 调用 ("call", 函数, 参数...) 和等待写入
+    # ("wait", 超时) 交给 drive 执行；机群的 MachineSession 用协程实现 drive，复用同一流程
+    retry_connect = False  # 首次连接失败时是否持续重试
+    log_prefix = ""
+
+    def __init__(self, opc_handler=None, state_dir=""):
+        self.opc_handler = opc_handler or OPCUAHandler()
+        self.state_dir = state_dir  # 历史、录制和报警历史所在目录
+        self.on_connection_changed = lambda connected, message: None
+        self.on_values = lambda values: None
+        self.on_value_changed = lambda var_name, value: None
+        self.on_write_done = lambda var_name, value, success, message: None
+        self.writes = WriteQueue()
+        self.historian = None
+        self.recorder = None
+        self.record_history = True
+        self.alarms = AlarmEngine(ALARM_RULES, VARIABLES, os.path.join(state_dir, ALARM_HISTORY_FILE),
+                                  ALARM_HISTORY_SIZE)
+        self.alarms.on_alarm = lambda event: self.on_alarm(event)
+        self.on_alarm = lambda event: None
+        self.tags = TagSubscriber(TAGS)
+        self.on_tags_changed = lambda changes: None
+        self.monitored = set()  # 订阅中的变量，其余轮询
         self.is_running = True
-        self.init_ui()
-        self.start_opcua()
-
-    def init_ui(self):
-        main_widget = QWidget()
-        self.setCentralWidget(main_widget)
-        main_layout = QVBoxLayout(main_widget)
-
-        tabs = QTabWidget()
-        main_layout.addWidget(tabs)
-
-        for group_name, var_names in GROUPED_VARIABLES.items():
-            tab = QWidget()
-            tab_layout = QVBoxLayout(tab)
-            scroll = QScrollArea()
-            scroll.setWidgetResizable(True)
-            scroll_content = QWidget()
-            grid_layout = QGridLayout(scroll_content)
-
-            # 按只读、布尔型、其他类型排序
-            read_only_vars = [v for v in var_names if not VARIABLES[v]["writable"]]
-            writable_bool_vars = [v for v in var_names if VARIABLES[v]["writable"] and VARIABLES[v]["type"] == "Boolean"]
-            writable_other_vars = [v for v in var_names if VARIABLES[v]["writable"] and VARIABLES[v]["type"] != "Boolean"]
-            sorted_var_names = read_only_vars + writable_bool_vars + writable_other_vars
-
-            # 计算分组中最长中文注释长度
-            max_comment_length = max(len(VARIABLES[var]["comment"]) for var in sorted_var_names) if sorted_var_names else 10
-            button_width = max_comment_length * 13  # 按字体大小估算宽度
-            
-            row = 0
-            for var_name in sorted_var_names:
-                info = VARIABLES[var_name]
-                # 注释在前，变量名在括号内
-                label_text = f"{info['comment'] or var_name}"
-                grid_layout.addWidget(QLabel(label_text), row, 0)
-                self.value_labels[var_name] = QLabel("N/A")
-                grid_layout.addWidget(self.value_labels[var_name], row, 1)
-                if info["writable"]:
-                    if info["type"] == "Boolean":
-                        btn = QPushButton(info["comment"])
-                        btn.setCheckable(True)
-                        btn.setMinimumWidth(button_width)
-                        btn.clicked.connect(lambda checked, v=var_name: self.toggle_boolean(v))
-                        grid_layout.addWidget(btn, row, 2)
-                        self.bool_buttons[var_name] = btn
-                    elif info["type"] in ["Float", "REAL", "Int16", "Int32", "UInt16"]:
-                        self.entries[var_name] = QLineEdit()
-                        self.entries[var_name].setPlaceholderText("输入值")
-                        grid_layout.addWidget(self.entries[var_name], row, 2)
-                        btn = QPushButton("写入")
-                        btn.clicked.connect(lambda checked, v=var_name: self.submit_value(v))
-                        grid_layout.addWidget(btn, row, 3)
-                else:
-                    grid_layout.addWidget(QLabel(""), row, 2)  # 占位
-                    grid_layout.addWidget(QLabel(""), row, 3)  # 占位
-                row += 1
-
-            scroll.setWidget(scroll_content)
-            tab_layout.addWidget(scroll)
-            tabs.addTab(tab, group_name)
-
-        exit_btn = QPushButton("退出")
-        exit_btn.clicked.connect(self.on_exit)
-        main_layout.addWidget(exit_btn)
-
-        self.status_bar = QStatusBar()
-        self.status_bar.showMessage("未连接")
-        self.setStatusBar(self.status_bar)
-
-        self.setStyleSheet("""
-            QMainWindow { background-color: #f0f0f0; }
-            QLabel { font-size: 14px; padding: 5px; }
-            QPushButton {
-                background-color: #007bff;
-                color: white;
-                padding: 5px;
-                border-radius: 3px;
-                font-size: 13px;
-            }
-            QPushButton:hover { background-color: #0056b3; }
-            QPushButton:checked { background-color: #dc3545; }
-            QLineEdit {
-                padding: 5px;
-                border: 1px solid #ccc;
-                border-radius: 3px;
-                font-size: 13px;
-            }
-            QTabWidget::pane { border: 1px solid #ccc; }
-            QTabBar::tab {
-                background: #e0e0e0;
-                padding: 8px;
-                margin-right: 2px;
-                font-size: 13px;
-            }
-            QTabBar::tab:selected { background: #007bff; color: white; }
-        """)
-
-    def toggle_boolean(self, var_name):
-        try:
-            current_value = self.opc_handler.read_values().get(var_name, False)
-            new_value = not current_value
-            success, message = self.opc_handler.write_value(var_name, new_value)
-            if success:
-                self.value_labels[var_name].setText(str(new_value))
-                self.bool_buttons[var_name].setChecked(new_value)
-            else:
-                QMessageBox.critical(self, "错误", message)
-        except Exception as e:
-            QMessageBox.critical(self, "错误", str(e))
 
-    def submit_value(self, var_name):
+    def write(self, var_name, value):
+        self.writes.put(var_name, value)
+
+    def write_many(self, values):
+        self.writes.put_many(values)
+
+    def stop(self):
+        self.is_running = False
+        self.writes.close()
+
+    def acknowledge(self, name=None):
+        self.alarms.acknowledge(name)
+
+    def alarm_snapshot(self):
+        return self.alarms.snapshot()
+
+    def alarm_history(self):
+        return list(self.alarms.history)
+
+    def set_connection(self, connected, message):
+        Metrics.connected.set(1 if connected else 0, self.opc_handler.machine)
+        self.on_connection_changed(connected, message)
+
+    def on_data_change(self, var_name, value):
+        if self.historian:
+            self.historian.record(var_name, value)
+        if self.recorder:
+            self.recorder.record(var_name, value)
+        self.alarms.update({var_name: value})
+        self.on_value_changed(var_name, value)
+
+    def start_acquisition(self):
+        polled_vars = list(VARIABLES.keys())
+        self.monitored = set()
+        if UPDATE_MODE == "subscription":
+            self.monitored = set(self.opc_handler.subscribe(self.on_data_change))
+            polled_vars = [v for v in VARIABLES if v not in self.monitored]
+        return ScanScheduler(polled_vars, self.opc_handler.machine)
+
+    def open_recorder(self):
+        return open_recorder(os.path.join(self.state_dir, RECORDING_DIR), self.opc_handler.url)
+
+    def open_history(self):
+        if self.record_history and HISTORY_VARIABLES:
+            try:
+                self.historian = Historian(os.path.join(self.state_dir, HISTORY_DIR), HISTORY_VARIABLES,
+                                           HISTORY_CAPACITY)
+            except Exception as e:
+                logger.error(f"{self.log_prefix}Failed to open historian: {e}")
+        if self.record_history and RECORDING_ENABLED:
+            try:
+                self.recorder = self.open_recorder()
+            except Exception as e:
+                logger.error(f"{self.log_prefix}Failed to start session recording: {e}")
+
+    def close_history(self):
+        if self.historian:
+            self.historian.close()
+            self.historian = None
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+
+    def reload_tags(self, scheduler):
+        # 变量配置文件变化时只增删变化的节点和监控项，并重建轮询计划；变量表变化时录制换到新文件
+        TAGS.reload_if_changed()
+        changes = self.tags.changes()
+        if not changes:
+            return scheduler
+        self.monitored.difference_update(changes.detach)
+        self.monitored.update((yield "call", self.opc_handler.update_variables, changes.detach, changes.attach))
+        if self.recorder and (changes.added or changes.removed):
+            self.recorder.close()
+            self.recorder = self.open_recorder()
+        self.on_tags_changed(changes)
+        return ScanScheduler([v for v in VARIABLES if v not in self.monitored], self.opc_handler.machine)
+
+    def acquire(self, scheduler):
+        # 读写循环，连接中断或停止时返回
+        opc_handler = self.opc_handler
+        while self.is_running and opc_handler.connected:
+            scheduler = yield from self.reload_tags(scheduler)
+            idle = KEEPALIVE_INTERVAL - (time.monotonic() - opc_handler.last_ok)
+            due = scheduler.time_until_due()
+            pending = yield "wait", max(0.0, idle if due is None else min(due, idle))
+            if pending:
+                results = yield "call", opc_handler.write_values, pending
+                for var_name, value in pending.items():
+                    success, message = results[var_name]
+                    self.on_write_done(var_name, value, success, message)
+            due_vars = scheduler.due_vars() if self.is_running else []
+            if due_vars:
+                start_time = time.monotonic()
+                values = yield "call", opc_handler.read_values, due_vars
+                if self.historian:
+                    self.historian.record_values(values)
+                if self.recorder:
+                    self.recorder.record_values(values)
+                self.alarms.update(values)
+                self.on_values(values)
+                scheduler.check_duration(due_vars, time.monotonic() - start_time)
+            self.alarms.check_timeouts()
+            if self.is_running and time.monotonic() - opc_handler.last_ok >= KEEPALIVE_INTERVAL:
+                yield "call", opc_handler.check_alive
+
+    def retry(self, function, message):
+        # 指数退避加随机抖动重试直到成功或停止，避免多台 HMI 同时冲击 PLC；等待期间提交的写入直接判为失败
+        delay = RECONNECT_MIN_DELAY
+        attempt = 0
+        start_time = time.monotonic()
+        while self.is_running:
+            attempt += 1
+            if (yield "call", function):
+                elapsed = time.monotonic() - start_time
+                logger.info(f"{self.log_prefix}Connected after {attempt} attempt(s) in {elapsed:.1f} s")
+                if function == self.opc_handler.reconnect:
+                    Metrics.reconnects.inc(self.opc_handler.machine)
+                    Metrics.reconnect_seconds.observe(elapsed, self.opc_handler.machine)
+                self.set_connection(True, "已连接")
+                return True
+            self.set_connection(False, f"{message} (第 {attempt} 次)")
+            pending = yield "wait", delay * random.uniform(0.5, 1.5)
+            for var_name, value in pending.items():
+                self.on_write_done(var_name, value, False, "写入失败: 连接中断")
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        return False
+
+    def session(self):
+        # 连接、采集，连接中断后重连，直到停止；首次连接失败时返回 False
+        if self.retry_connect:
+            if not (yield from self.retry(self.opc_handler.connect, "无法连接，正在重试")):
+                return False
+        elif (yield "call", self.opc_handler.connect):
+            self.set_connection(True, "已连接")
+        else:
+            self.set_connection(False, "无法连接到 PLC，请检查网络或配置")
+            return False
+        self.open_history()
         try:
-            value = self.entries[var_name].text()
-            if not value or not value.replace(".", "").replace("-", "").isdigit():
-                QMessageBox.critical(self, "错误", "请输入有效的数字")
-                return
-            var_type = VARIABLES[var_name]["type"]
-            if var_type in ["Float", "REAL"]:
-                value = float(value)
-            elif var_type in ["Int16", "Int32", "UInt16"]:
-                value = int(value)
-            success, message = self.opc_handler.write_value(var_name, value)
-            if success:
-                if var_type in ["Float", "REAL"]:
-                    self.value_labels[var_name].setText(f"{value:.4f}")
+            while self.is_running:
+                yield from self.acquire((yield "call", self.start_acquisition))
+                if not self.is_running:
+                    break
+                self.set_connection(False, "连接中断，正在重连")
+                if (yield from self.retry(self.opc_handler.reconnect, "连接中断，正在重连")):
+                    # 会话被重新激活时旧订阅仍在服务器上，删除后重新创建
+                    yield "call", self.opc_handler.unsubscribe
+        finally:
+            yield "call", self.opc_handler.disconnect
+            Metrics.connected.set(0, self.opc_handler.machine)
+            self.close_history()
+        return True
+
+    def drive(self, steps):
+        # 在当前线程直接执行各步骤；调用抛出的异常交回流程，使其 finally 中的断开和关闭照常执行
+        result = None
+        error = None
+        while True:
+            try:
+                step = steps.throw(error) if error else steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                if step[0] == "wait":
+                    result = self.writes.get(step[1])
                 else:
-                    self.value_labels[var_name].setText(str(value))
-                self.entries[var_name].clear()
-            else:
-                QMessageBox.critical(self, "错误", message)
-        except Exception as e:
-            QMessageBox.critical(self, "错误", str(e))
+                    result = step[1](*step[2:])
+            except BaseException as e:
+                error = e
+
+    def run(self):
+        return self.drive(self.session())
+
+
+def select_variables(groups=None, var_names=None):
+    # 命令行按分组和变量名筛选，均未指定时为全部变量
+    if not groups and not var_names:
+        return list(VARIABLES.keys())
+    selected = []
+    for group_name in groups or []:
+        if group_name not in GROUPED_VARIABLES:
+            raise ValueError(f"Unknown group: {group_name}")
+        selected.extend(GROUPED_VARIABLES[group_name])
+    for var_name in var_names or []:
+        if var_name not in VARIABLES:
+            raise ValueError(f"Unknown variable: {var_name}")
+        selected.append(var_name)
+    return list(OrderedDict.fromkeys(selected))
 
-    def update_values(self):
-        if not self.is_running:
+
+def parse_value(var_name, text):
+    # 命令行写入的值按变量类型转换
+    if var_name not in VARIABLES:
+        raise ValueError(f"Unknown variable: {var_name}")
+    var_type = VARIABLES[var_name]["type"]
+    if var_type == "Boolean":
+        if text.lower() in ("1", "true", "on"):
+            return True
+        if text.lower() in ("0", "false", "off"):
+            return False
+        raise ValueError(f"Invalid Boolean value for {var_name}: {text}")
+    if var_type in ["Float", "REAL"]:
+        return float(text)
+    return int(text)
+
+
+def print_json(entry, indent=None):
+    # 标准输出只输出数据，日志走标准错误
+    print(json.dumps(entry, ensure_ascii=False, default=str, indent=indent), flush=True)
+
+
+class ChangeStream:
+    # 只输出筛选变量真正变化的值，每个变化一行 JSON；机群模式下附带机器名，回调可来自多个线程。
+    # var_names 为 None 时输出全部变量，包括变量配置重新加载后新增的变量
+    def __init__(self, var_names=None):
+        self.selected = None if var_names is None else set(var_names)
+        self.last_values = {}
+        self.lock = threading.Lock()
+
+    def value_changed(self, var_name, value, machine=None):
+        if self.selected is not None and var_name not in self.selected:
             return
+        key = (machine, var_name)
+        with self.lock:
+            previous = self.last_values.get(key)
+            if key in self.last_values and previous == value and type(previous) is type(value):
+                return
+            self.last_values[key] = value
+            entry = {"time": time.time(), "var": var_name, "value": value}
+            if machine is not None:
+                entry["machine"] = machine
+            print_json(entry)
+
+    def values(self, values, machine=None):
+        for var_name, value in values.items():
+            self.value_changed(var_name, value, machine)
+
+    def connection_changed(self, connected, message, machine=None):
+        entry = {"time": time.time(), "connected": connected, "message": message}
+        if machine is not None:
+            entry["machine"] = machine
+        with self.lock:
+            print_json(entry)
+
+    def alarm(self, event, machine=None):
+        # 报警事件不受变量筛选影响
+        entry = dict(event)
+        if machine is not None:
+            entry["machine"] = machine
+        with self.lock:
+            print_json(entry)
+
+
+def run_snapshot(args):
+    var_names = select_variables(args.group, args.var)
+    opc_handler = OPCUAHandler()
+    if not opc_handler.connect():
+        return 1
+    try:
+        values = opc_handler.read_values(var_names)
+        if not opc_handler.connected:
+            return 1
+    finally:
+        opc_handler.disconnect()
+    print_json({"time": time.time(), "values": {v: values[v] for v in var_names}}, indent=2 if args.pretty else None)
+    return 0
+
+
+def print_write_results(values, results):
+    failed = 0
+    for var_name, (success, message) in results.items():
+        print_json({"var": var_name, "value": values.get(var_name), "success": success, "message": message})
+        failed += not success
+    return 1 if failed else 0
+
+
+def run_write(args):
+    values = OrderedDict()
+    for assignment in args.assignments:
+        var_name, sep, text = assignment.partition("=")
+        if not sep:
+            raise ValueError(f"Expected VAR=VALUE, got: {assignment}")
+        values[var_name] = parse_value(var_name, text)
+    opc_handler = OPCUAHandler()
+    if not opc_handler.connect():
+        return 1
+    try:
+        return print_write_results(values, opc_handler.write_values(values))
+    finally:
+        opc_handler.disconnect()
+
+
+def run_recipe(args):
+    recipes = load_recipes()
+    opc_handler = OPCUAHandler()
+    if not opc_handler.connect():
+        return 1
+    try:
+        return print_write_results(recipes.get(args.name, {}), opc_handler.apply_recipe(args.name, recipes))
+    finally:
+        opc_handler.disconnect()
+
+
+def make_engine():
+    # 界面和 stream 的数据来源：直接连接 PLC，或经网关共享会话
+    if USE_GATEWAY:
+        from Gateway import GatewayClient
+        return GatewayClient()
+    return AcquisitionEngine()
+
+
+def run_acquisition(args, stream=False):
+    # 前台持续采集直到 SIGINT/SIGTERM；stream 时把变化以 JSON lines 输出到标准输出
+    engine = make_engine() if stream else AcquisitionEngine()
+    engine.record_history = not args.no_history
+    if stream:
+        changes = ChangeStream(select_variables(args.group, args.var) if args.group or args.var else None)
+        engine.on_value_changed = changes.value_changed
+        engine.on_values = changes.values
+        engine.on_connection_changed = changes.connection_changed
+        engine.on_alarm = changes.alarm
+    else:
+        engine.on_connection_changed = lambda connected, message: logger.info(
+            f"Acquisition {'connected' if connected else 'disconnected'}: {message}")
+    stop_on_signal(engine.stop)
+    return 0 if engine.run() else 1
+
+
+def stop_on_signal(stop):
+    def on_signal(signum, frame):
+        # 第一次信号优雅停止，再次 Ctrl+C 立即中断
+        logger.info(f"Received signal {signum}, stopping acquisition")
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        stop()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+
+def run_gateway(args):
+    from Gateway import Gateway
+    gateway = Gateway(args.bind, args.port, args.allow_remote)
+    gateway.engine.record_history = not args.no_history
+    stop_on_signal(gateway.stop)
+    return 0 if gateway.run() else 1
+
+
+def run_simulator(args):
+    from Simulator import SimulatedPLC
+    simulator = SimulatedPLC(args.endpoint, args.latency / 1000, args.jitter / 1000, demo=not args.no_demo)
+    stopped = threading.Event()
+    stop_on_signal(stopped.set)
+    simulator.start()
+    try:
+        stopped.wait()
+    finally:
+        simulator.stop()
+    return 0
+
+
+def run_benchmark(args):
+    import Benchmark
+    results = Benchmark.run_benchmark(latency_ms=args.latency, jitter_ms=args.jitter, cycles=args.cycles,
+                                      ui=not args.no_ui)
+    Benchmark.save_results(results, args.output)
+    print_json(results, indent=2)
+    logger.info(f"Benchmark results saved to {args.output or Benchmark.BENCHMARK_FILE}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = Benchmark.compare(results, json.load(f))
+        for name, previous, current in regressions:
+            logger.error(f"Regression in {name}: {previous} -> {current}")
+        return 1 if regressions else 0
+    return 0
+
+
+def run_fleet(args):
+    # 机群模式：一个事件循环管理 fleet 文件中的全部 PLC，--gui 显示总览界面，否则变化以 JSON lines 输出
+    from Fleet import FleetMonitor
+    machines = load_fleet(args.file)
+    if args.gui:
+        from ClientGUI import fleet_main
+        return fleet_main(machines)
+    monitor = FleetMonitor(machines)
+    monitor.record_history = not args.no_history
+    changes = ChangeStream(select_variables(args.group, args.var) if args.group or args.var else None)
+    monitor.on_value_changed = lambda machine, var_name, value: changes.value_changed(var_name, value, machine)
+    monitor.on_values = lambda machine, values: changes.values(values, machine)
+    monitor.on_connection_changed = lambda machine, connected, message: changes.connection_changed(
+        connected, message, machine)
+    monitor.on_alarm = lambda machine, event: changes.alarm(event, machine)
+    stop_on_signal(monitor.stop)
+    monitor.run()
+    return 0
+
+
+def run_move(args):
+    # 运动序列：先使能并回零 --home 指定的轴，再并行定位到 AXIS=POS 目标，每步完成后输出一行 JSON
+    import asyncio
+    from Motion import MotionSequencer, MotionError
+    targets = OrderedDict()
+    for target in args.targets:
+        axis, _, position = target.partition("=")
+        if axis not in MOTION_AXES or not position:
+            print(f"无效目标: {target}（格式 AXIS=POS，轴为 {'/'.join(MOTION_AXES)}）", file=sys.stderr)
+            return 2
         try:
-            values = self.opc_handler.read_values()
-            if values:
-                for var_name, value in values.items():
-                    if VARIABLES[var_name]["type"] in ["Float", "REAL"] and isinstance(value, (int, float)):
-                        self.value_labels[var_name].setText(f"{value:.4f}")
-                    else:
-                        self.value_labels[var_name].setText(str(value))
-                    # 同步布尔型按钮状态
-                    if var_name in self.bool_buttons:
-                        self.bool_buttons[var_name].setChecked(bool(value))
-                self.status_bar.showMessage("已连接")
-            else:
-                self.status_bar.showMessage("连接中断")
-            logger.info("Values updated")
-        except Exception as e:
-            logger.error(f"Update failed: {e}")
-            self.status_bar.showMessage(f"错误: {str(e)}")
-
-    def start_opcua(self):
-        if self.opc_handler.connect():
-            self.status_bar.showMessage("已连接")
-            self.timer = QTimer()
-            self.timer.timeout.connect(self.update_values)
-            self.timer.start(300)  # 300ms 刷新
-        else:
-            QMessageBox.critical(self, "错误", "无法连接到 PLC，请检查网络或配置")
-            self.on_exit()
+            targets[axis] = float(position)
+        except ValueError:
+            print(f"无效位置: {target}", file=sys.stderr)
+            return 2
+    home_axes = []
+    if args.home:
+        home_axes = MOTION_AXES if "all" in args.home else list(OrderedDict.fromkeys(args.home))
+    if not targets and not home_axes:
+        print("没有要执行的运动", file=sys.stderr)
+        return 2
+
+    async def report(axis, step, target, coroutine):
+        elapsed = await coroutine
+        print_json({"time": time.time(), "axis": axis, "step": step, "target": target,
+                    "elapsed_ms": round(elapsed * 1000, 1)})
+
+    async def sequence():
+        async with MotionSequencer() as motion:
+            await motion.enable(*OrderedDict.fromkeys(list(home_axes) + list(targets)))
+            if home_axes:
+                await motion.parallel(*(report(axis, "home", MOTION_HOME_POSITION,
+                                               motion.home(axis, timeout=args.timeout)) for axis in home_axes))
+            if targets:
+                await motion.parallel(*(report(axis, "move_abs", position,
+                                               motion.move_abs(axis, position, args.velocity, timeout=args.timeout))
+                                        for axis, position in targets.items()))
+
+    try:
+        asyncio.run(sequence())
+    except MotionError as e:
+        logger.error(f"Motion sequence failed: {e}")
+        return 1
+    return 0
+
+
+def run_export(args):
+    # 录制文件导出为长表 (时间戳, 变量, 值)，默认输出到录制文件旁的同名文件
+    recording = Recording(args.file)
+    output = args.output or os.path.splitext(args.file)[0] + "." + args.format
+    export = export_parquet if args.format == "parquet" else export_csv
+    export(recording, output)
+    logger.info(f"Exported {recording.count} changes from {args.file} to {output}")
+    return 0
+
+
+def run_replay(args):
+    # 界面中回放录制文件，代替 PLC 连接；报警按当前规则重新判断
+    from ClientGUI import replay_main
+    return replay_main(ReplayEngine(args.file, args.speed, ALARM_RULES))
+
+
+def merge_discovered(discovered, parents, variables, groups):
+    # 以服务器为准合并：已有变量保留名称、注释、分组、可写和刷新设置，只更新数据类型；服务器上没有的变量删除。
+    # 新变量按所属结构体分组，顶层的新变量放入 DISCOVERY_GROUP
+    server_types = {info["node"]: info["type"] for info in discovered.values()}
+    merged = OrderedDict()
+    for var_name, info in variables.items():
+        server_type = server_types.get(info["node"])
+        if server_type is None:
+            logger.warning(f"{var_name} ({info['node']}) not found on the server, removed")
+            continue
+        if VARIANT_TYPES[info["type"]][1] != VARIANT_TYPES[server_type][1]:
+            logger.info(f"{var_name}: type {info['type']} -> {server_type}")
+            info = dict(info, type=server_type)
+        merged[var_name] = info
+    known_nodes = {info["node"] for info in merged.values()}
+    merged_groups = OrderedDict((g, [v for v in var_names if v in merged]) for g, var_names in groups.items())
+    for var_name, info in discovered.items():
+        if info["node"] in known_nodes:
+            continue
+        if var_name in merged:
+            logger.warning(f"{var_name} already names {merged[var_name]['node']}, skipped {info['node']}")
+            continue
+        merged[var_name] = info
+        merged_groups.setdefault(parents[var_name] or DISCOVERY_GROUP, []).append(var_name)
+    return merged, OrderedDict((g, var_names) for g, var_names in merged_groups.items() if var_names)
+
+
+def run_discover(args):
+    # 浏览服务器生成变量配置文件；写入正在使用的配置文件时，运行中的界面和采集会自动重新加载
+    opc_handler = OPCUAHandler()
+    if not opc_handler.connect(init_nodes=False):
+        return 1
+    try:
+        discovered, parents, skipped = opc_handler.browse_variables(args.root or DISCOVERY_ROOT)
+    finally:
+        opc_handler.disconnect()
+    if skipped:
+        logger.warning(f"Skipped {len(skipped)} arrays or variables with unsupported types: "
+                       f"{', '.join(skipped[:20])}{' ...' if len(skipped) > 20 else ''}")
+    if not discovered:
+        logger.error(f"No variables found under {args.root or DISCOVERY_ROOT}")
+        return 1
+    if args.fresh:
+        variables, groups = merge_discovered(discovered, parents, {}, {})
+    else:
+        variables, groups = merge_discovered(discovered, parents, VARIABLES, GROUPED_VARIABLES)
+    output = args.output or TAGS.path
+    save_tags(output, variables, groups)
+    logger.info(f"Wrote {len(variables)} variables in {len(groups)} groups to {output}")
+    return 0
+
+
+def run_gui(args):
+    # PyQt 只在启动界面时导入，无界面的采集/命令行不加载
+    from ClientGUI import main as gui_main
+    return gui_main()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="PLC OPC UA 监控：图形界面及无界面采集/命令行工具")
+    parser.add_argument("--url", help=f"PLC 端点 (默认 {PLC_URL})")
+    parser.add_argument("--mode", choices=["subscription", "polling"], help=f"刷新方式 (默认 {UPDATE_MODE})")
+    parser.add_argument("--quiet", action="store_true", help="不在标准错误输出日志，只写日志文件")
+    parser.add_argument("--metrics-port", type=int, help=f"指标 HTTP 端口 (默认 {METRICS_PORT}，0 表示不启动)")
+    parser.add_argument("--gateway", nargs="?", const="", metavar="HOST:PORT",
+                        help=f"界面和 stream 经网关连接 (默认 {GATEWAY_HOST}:{GATEWAY_PORT})")
+    parser.add_argument("--tags", help=f"变量配置文件 (默认 {TAGS_FILE}，不存在时使用内置配置)")
+    commands = parser.add_subparsers(dest="command")
+
+    commands.add_parser("gui", help="启动图形界面（默认）")
+
+    run_parser = commands.add_parser("run", help="无界面持续采集并记录历史")
+    run_parser.add_argument("--no-history", action="store_true", help="不记录历史趋势和会话录制")
+
+    stream_parser = commands.add_parser("stream", help="持续采集，变化以 JSON lines 输出到标准输出")
+    stream_parser.add_argument("--history", dest="no_history", action="store_false",
+                               help="同时记录历史趋势和会话录制")
+    stream_parser.set_defaults(no_history=True)
+
+    snapshot_parser = commands.add_parser("snapshot", help="读取一次全部（或筛选的）变量并输出 JSON")
+    snapshot_parser.add_argument("--pretty", action="store_true", help="缩进输出")
+
+    gateway_parser = commands.add_parser("gateway", help="运行网关，供多个界面共享一个 PLC 会话")
+    gateway_parser.add_argument("--bind", help=f"监听地址 (默认 {GATEWAY_HOST})")
+    gateway_parser.add_argument("--port", type=int, help=f"监听端口 (默认 {GATEWAY_PORT})")
+    gateway_parser.add_argument("--allow-remote", action="store_true",
+                                help="允许监听非回环地址 (网关没有身份验证，其他主机可写入 PLC)")
+    gateway_parser.add_argument("--no-history", action="store_true", help="不记录历史趋势和会话录制")
+
+    simulate_parser = commands.add_parser("simulate", help="运行模拟 PLC（提供 VARIABLES 中的全部节点）")
+    simulate_parser.add_argument("--endpoint", help="监听端点 (默认 opc.tcp://127.0.0.1:4841)")
+    simulate_parser.add_argument("--no-demo", action="store_true", help="轴和腔体只响应写入，不自行变化")
+
+    benchmark_parser = commands.add_parser("benchmark", help="对模拟 PLC 运行端到端基准并保存 JSON 结果")
+    benchmark_parser.add_argument("--cycles", type=int, default=200, help="每项测量的周期数")
+    benchmark_parser.add_argument("--output", help="结果文件 (默认 benchmark_results.json)")
+    benchmark_parser.add_argument("--baseline", help="与之前的结果文件比较，出现回归时返回 1")
+    benchmark_parser.add_argument("--no-ui", action="store_true", help="跳过界面刷新测量（不导入 PyQt）")
+
+    for sub_parser in (simulate_parser, benchmark_parser):
+        sub_parser.add_argument("--latency", type=float, default=0.0, help="模拟每个请求的延迟 (ms)")
+        sub_parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机抖动幅度 (ms)")
+
+    fleet_parser = commands.add_parser("fleet", help="同时监控 fleet 文件中的多台 PLC")
+    fleet_parser.add_argument("--file", help=f"机器列表文件 (默认 {FLEET_FILE})")
+    fleet_parser.add_argument("--gui", action="store_true", help="显示机群总览界面，否则变化以 JSON lines 输出")
+    fleet_parser.add_argument("--no-history", action="store_true", help="不记录历史趋势和会话录制")
+
+    for sub_parser in (stream_parser, snapshot_parser, fleet_parser):
+        sub_parser.add_argument("--group", action="append", help="只包含该分组（可重复）")
+        sub_parser.add_argument("--var", action="append", help="只包含该变量（可重复）")
+
+    write_parser = commands.add_parser("write", help="写入变量，如 X_Speed=100 Start=true")
+    write_parser.add_argument("assignments", nargs="+", metavar="VAR=VALUE")
+
+    recipe_parser = commands.add_parser("recipe", help="应用配方文件中的配方")
+    recipe_parser.add_argument("name")
+
+    move_parser = commands.add_parser("move", help="运动序列：各轴并行回零/定位，等待完成并输出耗时")
+    move_parser.add_argument("targets", nargs="*", metavar="AXIS=POS", help="定位目标，如 X=100 Y=-20")
+    move_parser.add_argument("--home", nargs="+", choices=MOTION_AXES + ["all"], metavar="AXIS",
+                             help=f"定位前先回零的轴 ({'/'.join(MOTION_AXES)}，all 为全部轴)，放在定位目标之后，"
+                                  f"如 move X=100 --home X Y")
+    move_parser.add_argument("--velocity", type=float, help="定位速度，不指定时使用 PLC 中的设定")
+    move_parser.add_argument("--timeout", type=float, default=MOTION_TIMEOUT, help="每步的超时 (s)")
+
+    export_parser = commands.add_parser("export", help=f"把会话录制文件 ({RECORDING_DIR}/*.opcrec) 导出为 CSV 或 Parquet")
+    export_parser.add_argument("file")
+    export_parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                               help="导出格式，Parquet 需要安装 pyarrow (默认 csv)")
+    export_parser.add_argument("--output", help="输出文件 (默认与录制文件同名)")
+
+    replay_parser = commands.add_parser("replay", help="在界面中回放会话录制文件")
+    replay_parser.add_argument("file")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示尽快回放 (默认 1)")
+
+    discover_parser = commands.add_parser("discover", help="浏览服务器上的变量，生成带数据类型的变量配置文件")
+    discover_parser.add_argument("--root", help=f"浏览的起点 (默认 {DISCOVERY_ROOT})")
+    discover_parser.add_argument("--output", help="输出文件，扩展名为 .yaml/.yml 或 .json (默认为变量配置文件)")
+    discover_parser.add_argument("--fresh", action="store_true", help="不合并当前配置中的注释和分组")
+    return parser
+
+
+def main(argv=None):
+    global PLC_URL, UPDATE_MODE, USE_GATEWAY, GATEWAY_HOST, GATEWAY_PORT, METRICS_PORT
+    args = build_parser().parse_args(argv)
+    if args.url:
+        PLC_URL = args.url
+    if args.gateway is not None:
+        USE_GATEWAY = True
+        host, _, port = args.gateway.rpartition(":")
+        GATEWAY_HOST = host or GATEWAY_HOST
+        GATEWAY_PORT = int(port) if port else GATEWAY_PORT
+    if args.metrics_port is not None:
+        METRICS_PORT = args.metrics_port or None
+    if args.mode:
+        UPDATE_MODE = args.mode
+    setup_logging(log_file, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, rotate_when=LOG_ROTATE_WHEN,
+                  json_file=LOG_JSON_FILE, rate_limit=LOG_RATE_LIMIT, console=not args.quiet,
+                  library_level=LOG_LIBRARY_LEVEL)
+    commands = {
+        "gui": run_gui,
+        "run": run_acquisition,
+        "stream": lambda args: run_acquisition(args, stream=True),
+        "snapshot": run_snapshot,
+        "write": run_write,
+        "recipe": run_recipe,
+        "fleet": run_fleet,
+        "gateway": run_gateway,
+        "simulate": run_simulator,
+        "benchmark": run_benchmark,
+        "move": run_move,
+        "export": run_export,
+        "replay": run_replay,
+        "discover": run_discover,
+    }
+    # 长时间运行的命令才启动指标端点
+    if METRICS_PORT and (args.command or "gui") in ("gui", "run", "stream", "gateway", "fleet"):
+        Metrics.start_server(METRICS_HOST, METRICS_PORT)
+    if args.tags:
+        TAGS.path = args.tags
+    try:
+        TAGS.load()
+        return commands[args.command or "gui"](args)
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
 
-    def on_exit(self):
-        self.is_running = False
-        self.opc_handler.disconnect()
-        self.close()
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = OPCUAGUI()
-    window.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    # 作为脚本运行时登记为 ClientApp 模块，界面模块导入时共用同一份配置而不是重新加载
+    sys.modules.setdefault("ClientApp", sys.modules[__name__])
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,812 @@
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QTabWidget, QWidget, QGridLayout, QLabel, QPushButton,
+                             QLineEdit, QScrollArea, QVBoxLayout, QStatusBar, QMessageBox, QHBoxLayout,
+                             QComboBox, QInputDialog, QTableWidget, QTableWidgetItem, QHeaderView, QDialog)
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor
+from collections import OrderedDict
+from ClientApp import make_engine, VARIABLES, GROUPED_VARIABLES, load_recipes, save_recipes
+import Metrics
+import os
+import sys
+import time
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+FRAME_INTERVAL = 16  # 界面刷新合并周期 (ms)，每帧最多重绘一次
+METRICS_INTERVAL = 1000  # 状态栏性能摘要的刷新周期 (ms)
+# 机群总览表中每台机器显示的变量，双击机器打开完整的分组界面
+FLEET_OVERVIEW_VARIABLES = [
+    "X_PosNow", "Y_PosNow", "Z_PosNow", "AI_CHAMBER_O2_CONTENT_OUTPUT_SEAL", "AI_CHAMBER_PRESSURE_OUTPUT_SEAL"
+]
+# 报警显示：级别名称和底色，按列表顺序排列
+ALARM_SEVERITY_STYLES = OrderedDict([("critical", ("严重", "#f8d7da")), ("warning", ("警告", "#fff3cd")),
+                                     ("info", ("提示", "#d1ecf1"))])
+ALARM_EVENT_TEXT = {"raised": "报警", "cleared": "恢复", "acknowledged": "确认"}
+
+
+def alarm_state_text(state):
+    if state["active"]:
+        return "报警已确认" if state["acknowledged"] else "报警未确认"
+    return "已恢复未确认"
+
+
+def format_time(timestamp):
+    return time.strftime("%m-%d %H:%M:%S", time.localtime(timestamp)) if timestamp else ""
+
+
+class OPCUAWorker(QThread):
+    # 在后台线程运行 AcquisitionEngine（或网关客户端），回调转为信号排队回 GUI 线程
+    connection_changed = pyqtSignal(bool, str)
+    values_ready = pyqtSignal(dict)
+    value_changed = pyqtSignal(str, object)
+    write_done = pyqtSignal(str, object, bool, str)
+    alarm_event = pyqtSignal(dict)
+    tags_changed = pyqtSignal(object)
+
+    def __init__(self, parent=None, engine=None):
+        super().__init__(parent)
+        self.engine = engine or make_engine()
+        self.engine.on_connection_changed = self.connection_changed.emit
+        self.engine.on_values = self.values_ready.emit
+        self.engine.on_value_changed = self.value_changed.emit
+        self.engine.on_write_done = self.write_done.emit
+        self.engine.on_alarm = self.alarm_event.emit
+        self.engine.on_tags_changed = self.tags_changed.emit
+
+    def write(self, var_name, value):
+        self.engine.write(var_name, value)
+
+    def write_many(self, values):
+        self.engine.write_many(values)
+
+    def acknowledge(self, name=None):
+        self.engine.acknowledge(name)
+
+    def alarm_snapshot(self):
+        return self.engine.alarm_snapshot()
+
+    def alarm_history(self):
+        return self.engine.alarm_history()
+
+    def stop(self):
+        self.engine.stop()
+
+    def run(self):
+        self.engine.run()
+
+
+class OPCUAGUI(QMainWindow):
+    def __init__(self, worker=None, title=None):
+        # worker 需提供 OPCUAWorker 的信号及 start/stop/isRunning/write/write_many 和报警方法，默认直接连接 PLC
+        super().__init__()
+        self.setWindowTitle(title or "PLC OPC UA 实时监控")
+        self.setGeometry(100, 100, 1000, 800)
+        self.worker = worker or OPCUAWorker(self)
+        self.value_labels = {}
+        self.entries = {}
+        self.bool_buttons = {}  # 存储布尔型按钮
+        self.last_values = {}  # 最新收到的值
+        self.rendered = {}  # 已显示的 (值, 文本)
+        self.dirty = set()  # 值已变化但尚未显示的变量
+        self.var_tabs = {}  # 变量名 -> 所在分组 (标签页名)
+        self.tab_vars = {}  # 已创建的标签页 -> 其中的变量
+        self.alarm_rows = OrderedDict()  # 报警名 -> 最新状态
+        self.is_running = True
+        self.was_connected = False
+        self.connection_message = "已连接"  # 收到数据时状态栏恢复的连接状态
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(FRAME_INTERVAL)
+        self.render_timer.timeout.connect(self.render_dirty)
+        self.init_ui()
+        self.start_opcua()
+
+    def init_ui(self):
+        main_widget = QWidget()
+        self.setCentralWidget(main_widget)
+        main_layout = QVBoxLayout(main_widget)
+
+        self.tabs = QTabWidget()
+        main_layout.addWidget(self.tabs)
+
+        # 标签页内容在第一次显示时才创建，启动时只建当前页
+        for group_name, var_names in GROUPED_VARIABLES.items():
+            for var_name in var_names:
+                self.var_tabs[var_name] = group_name
+            tab = QWidget()
+            QVBoxLayout(tab)
+            self.tabs.addTab(tab, group_name)
+        self.build_tab(self.tabs.currentIndex())
+        # 切换标签页时创建该页并补画积压的变化
+        self.tabs.currentChanged.connect(self.on_tab_changed)
+
+        # 报警：仍在报警或尚未确认的条目，严重的在前
+        alarm_layout = QHBoxLayout()
+        self.alarm_table = QTableWidget(0, 5)
+        self.alarm_table.setHorizontalHeaderLabels(["时间", "级别", "报警", "说明", "状态"])
+        self.alarm_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.Stretch)
+        self.alarm_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.alarm_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.alarm_table.verticalHeader().setVisible(False)
+        self.alarm_table.setMaximumHeight(160)
+        alarm_layout.addWidget(self.alarm_table, 1)
+        alarm_buttons = QVBoxLayout()
+        for text, slot in [("确认", self.acknowledge_selected), ("全部确认", self.acknowledge_all),
+                           ("报警历史", self.show_alarm_history)]:
+            btn = QPushButton(text)
+            btn.clicked.connect(slot)
+            alarm_buttons.addWidget(btn)
+        alarm_buttons.addStretch()
+        alarm_layout.addLayout(alarm_buttons)
+        main_layout.addLayout(alarm_layout)
+
+        # 配方：一组参数一次写入
+        recipe_layout = QHBoxLayout()
+        self.recipe_combo = QComboBox()
+        self.recipe_combo.addItems(load_recipes().keys())
+        recipe_layout.addWidget(QLabel("配方"))
+        recipe_layout.addWidget(self.recipe_combo, 1)
+        apply_recipe_btn = QPushButton("应用配方")
+        apply_recipe_btn.clicked.connect(self.apply_recipe)
+        recipe_layout.addWidget(apply_recipe_btn)
+        save_recipe_btn = QPushButton("保存当前分组为配方")
+        save_recipe_btn.clicked.connect(self.save_recipe)
+        recipe_layout.addWidget(save_recipe_btn)
+        main_layout.addLayout(recipe_layout)
+
+        exit_btn = QPushButton("退出")
+        exit_btn.clicked.connect(self.on_exit)
+        main_layout.addWidget(exit_btn)
+
+        self.status_bar = QStatusBar()
+        self.status_bar.showMessage("未连接")
+        self.setStatusBar(self.status_bar)
+        self.alarm_label = QLabel()
+        self.status_bar.addPermanentWidget(self.alarm_label)
+        # 性能摘要常驻状态栏右侧，出现新的刷新超限时标红
+        self.metrics_label = QLabel()
+        self.status_bar.addPermanentWidget(self.metrics_label)
+        self.last_overruns = 0
+        self.last_changes = 0
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metrics)
+        self.metrics_timer.start(METRICS_INTERVAL)
+        self.render_alarms()
+
+        self.setStyleSheet("""
+            QMainWindow { background-color: #f0f0f0; }
+            QLabel { font-size: 14px; padding: 5px; }
+            QPushButton {
+                background-color: #007bff;
+                color: white;
+                padding: 5px;
+                border-radius: 3px;
+                font-size: 13px;
+            }
+            QPushButton:hover { background-color: #0056b3; }
+            QPushButton:checked { background-color: #dc3545; }
+            QLineEdit {
+                padding: 5px;
+                border: 1px solid #ccc;
+                border-radius: 3px;
+                font-size: 13px;
+            }
+            QTabWidget::pane { border: 1px solid #ccc; }
+            QTabBar::tab {
+                background: #e0e0e0;
+                padding: 8px;
+                margin-right: 2px;
+                font-size: 13px;
+            }
+            QTabBar::tab:selected { background: #007bff; color: white; }
+        """)
+
+    def build_tab(self, tab_index):
+        group_name = self.tabs.tabText(tab_index)
+        if tab_index < 0 or group_name in self.tab_vars:
+            return
+        # 变量配置可能在 I/O 线程中重新加载，先取出本页用到的配置
+        infos = {v: VARIABLES.get(v) for v in GROUPED_VARIABLES.get(group_name, [])}
+        var_names = [v for v, info in infos.items() if info is not None]
+        tab_layout = self.tabs.widget(tab_index).layout()
+        scroll = QScrollArea()
+        scroll.setWidgetResizable(True)
+        scroll_content = QWidget()
+        grid_layout = QGridLayout(scroll_content)
+
+        # 按只读、布尔型、其他类型排序
+        read_only_vars = [v for v in var_names if not infos[v]["writable"]]
+        writable_bool_vars = [v for v in var_names if infos[v]["writable"] and infos[v]["type"] == "Boolean"]
+        writable_other_vars = [v for v in var_names if infos[v]["writable"] and infos[v]["type"] != "Boolean"]
+        sorted_var_names = read_only_vars + writable_bool_vars + writable_other_vars
+        self.tab_vars[group_name] = sorted_var_names
+
+        # 计算分组中最长中文注释长度
+        max_comment_length = max(len(infos[var]["comment"]) for var in sorted_var_names) if sorted_var_names else 10
+        button_width = max_comment_length * 13  # 按字体大小估算宽度
+
+        row = 0
+        for var_name in sorted_var_names:
+            info = infos[var_name]
+            # 注释在前，变量名在括号内
+            label_text = f"{info['comment'] or var_name}"
+            grid_layout.addWidget(QLabel(label_text), row, 0)
+            self.value_labels[var_name] = QLabel("N/A")
+            grid_layout.addWidget(self.value_labels[var_name], row, 1)
+            if info["writable"]:
+                if info["type"] == "Boolean":
+                    btn = QPushButton(info["comment"])
+                    btn.setCheckable(True)
+                    btn.setMinimumWidth(button_width)
+                    btn.clicked.connect(lambda checked, v=var_name: self.toggle_boolean(v))
+                    grid_layout.addWidget(btn, row, 2)
+                    self.bool_buttons[var_name] = btn
+                elif info["type"] in ["Float", "REAL", "Int16", "Int32", "UInt16"]:
+                    self.entries[var_name] = QLineEdit()
+                    self.entries[var_name].setPlaceholderText("输入值")
+                    grid_layout.addWidget(self.entries[var_name], row, 2)
+                    btn = QPushButton("写入")
+                    btn.clicked.connect(lambda checked, v=var_name: self.submit_value(v))
+                    grid_layout.addWidget(btn, row, 3)
+            else:
+                grid_layout.addWidget(QLabel(""), row, 2)  # 占位
+                grid_layout.addWidget(QLabel(""), row, 3)  # 占位
+            row += 1
+
+        scroll.setWidget(scroll_content)
+        tab_layout.addWidget(scroll)
+
+    def on_tab_changed(self, tab_index):
+        self.build_tab(tab_index)
+        self.render_dirty()
+
+    def tab_index(self, group_name):
+        for index in range(self.tabs.count()):
+            if self.tabs.tabText(index) == group_name:
+                return index
+        return -1
+
+    def clear_tab(self, group_name):
+        # 删除已创建的页面内容，下次显示时按新配置重建；已收到的值在重建后补画
+        for var_name in self.tab_vars.pop(group_name, []):
+            if self.var_tabs.get(var_name) == group_name:
+                for widgets in (self.value_labels, self.entries, self.bool_buttons, self.rendered):
+                    widgets.pop(var_name, None)
+                if var_name in self.last_values:
+                    self.dirty.add(var_name)
+        layout = self.tabs.widget(self.tab_index(group_name)).layout()
+        while layout.count():
+            layout.takeAt(0).widget().deleteLater()
+
+    def on_tags_changed(self, changes):
+        # 变量配置重新加载后只重建内容变化的分组，未显示过的分组仍在第一次显示时创建
+        for group_name in changes.groups:
+            if group_name in self.tab_vars:
+                self.clear_tab(group_name)
+        self.tabs.blockSignals(True)
+        for group_name in [g for g in changes.groups if g not in changes.group_names]:
+            index = self.tab_index(group_name)
+            if index >= 0:
+                widget = self.tabs.widget(index)
+                self.tabs.removeTab(index)
+                widget.deleteLater()
+        for position, group_name in enumerate(changes.group_names):
+            index = self.tab_index(group_name)
+            if index < 0:
+                tab = QWidget()
+                QVBoxLayout(tab)
+                self.tabs.insertTab(position, tab, group_name)
+            elif index != position:
+                self.tabs.tabBar().moveTab(index, position)
+        self.tabs.blockSignals(False)
+        self.var_tabs = {v: g for g in changes.group_names for v in GROUPED_VARIABLES.get(g, [])}
+        for var_name in changes.removed:
+            for values in (self.last_values, self.rendered):
+                values.pop(var_name, None)
+            self.dirty.discard(var_name)
+        logger.info(f"Tags reloaded: {changes.summary()}")
+        self.on_tab_changed(self.tabs.currentIndex())
+
+    def toggle_boolean(self, var_name):
+        # 按钮点击时 Qt 已切换勾选状态，先恢复为当前值，等写入结果回来再更新
+        current_value = bool(self.last_values.get(var_name, False))
+        self.bool_buttons[var_name].setChecked(current_value)
+        self.worker.write(var_name, not current_value)
+
+    def submit_value(self, var_name):
+        try:
+            value = self.entries[var_name].text()
+            if not value or not value.replace(".", "").replace("-", "").isdigit():
+                QMessageBox.critical(self, "错误", "请输入有效的数字")
+                return
+            var_type = VARIABLES[var_name]["type"]
+            if var_type in ["Float", "REAL"]:
+                value = float(value)
+            elif var_type in ["Int16", "Int32", "UInt16"]:
+                value = int(value)
+            self.worker.write(var_name, value)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", str(e))
+
+    def apply_recipe(self):
+        name = self.recipe_combo.currentText()
+        recipe = load_recipes().get(name)
+        if not recipe:
+            QMessageBox.critical(self, "错误", f"配方不存在: {name}")
+            return
+        summary = "\n".join(f"{VARIABLES[v]['comment'] or v}: {value}" for v, value in recipe.items() if v in VARIABLES)
+        if QMessageBox.question(self, "应用配方", f"确认写入配方 {name}？\n{summary}") != QMessageBox.Yes:
+            return
+        self.worker.write_many(recipe)
+
+    def save_recipe(self):
+        # 保存当前分组中可写数值参数的当前值
+        group_name = self.tabs.tabText(self.tabs.currentIndex())
+        infos = {v: VARIABLES.get(v) for v in GROUPED_VARIABLES.get(group_name, [])}
+        recipe = {v: self.last_values[v] for v, info in infos.items()
+                  if info and info["writable"] and info["type"] != "Boolean"
+                  and isinstance(self.last_values.get(v), (int, float))}
+        if not recipe:
+            QMessageBox.critical(self, "错误", "当前分组没有可保存的参数")
+            return
+        name, ok = QInputDialog.getText(self, "保存配方", "配方名称:", text=group_name)
+        if not ok or not name:
+            return
+        recipes = load_recipes()
+        recipes[name] = recipe
+        try:
+            save_recipes(recipes)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"保存配方失败: {e}")
+            return
+        if self.recipe_combo.findText(name) < 0:
+            self.recipe_combo.addItem(name)
+        self.recipe_combo.setCurrentText(name)
+
+    def on_alarm_event(self, event):
+        if not self.is_running:
+            return
+        self.alarm_rows[event["alarm"]] = event
+        self.render_alarms()
+
+    def load_alarms(self):
+        # 连接（或重连网关）后以报警引擎的当前状态为准
+        self.alarm_rows = OrderedDict((state["alarm"], state) for state in self.worker.alarm_snapshot())
+        self.render_alarms()
+
+    def render_alarms(self):
+        severities = list(ALARM_SEVERITY_STYLES)
+        shown = sorted((state for state in self.alarm_rows.values() if state["active"] or not state["acknowledged"]),
+                       key=lambda state: (severities.index(state["severity"]), -(state["since"] or 0)))
+        self.alarm_rows = OrderedDict((state["alarm"], state) for state in shown)
+        self.alarm_table.setRowCount(len(shown))
+        for row, state in enumerate(shown):
+            severity_text, color = ALARM_SEVERITY_STYLES[state["severity"]]
+            texts = [format_time(state["since"]), severity_text, state["alarm"], state["message"],
+                     alarm_state_text(state)]
+            for column, text in enumerate(texts):
+                item = QTableWidgetItem(text)
+                # 未确认的用底色突出，已确认的只保留级别列颜色
+                if not state["acknowledged"] or column == 1:
+                    item.setBackground(QColor(color))
+                self.alarm_table.setItem(row, column, item)
+        active = sum(state["active"] for state in shown)
+        unacknowledged = sum(not state["acknowledged"] for state in shown)
+        self.alarm_label.setText(f"报警 {active} | 未确认 {unacknowledged}" if shown else "无报警")
+        self.alarm_label.setStyleSheet("color: #dc3545; font-weight: bold;" if unacknowledged else "")
+
+    def acknowledge_selected(self):
+        names = [self.alarm_table.item(index.row(), 2).text()
+                 for index in self.alarm_table.selectionModel().selectedRows()]
+        for name in names:
+            self.worker.acknowledge(name)
+
+    def acknowledge_all(self):
+        self.worker.acknowledge()
+
+    def show_alarm_history(self):
+        history = list(reversed(self.worker.alarm_history()))
+        dialog = QDialog(self)
+        dialog.setWindowTitle("报警历史")
+        dialog.resize(800, 500)
+        table = QTableWidget(len(history), 5, dialog)
+        table.setHorizontalHeaderLabels(["时间", "事件", "级别", "报警", "说明"])
+        table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row, event in enumerate(history):
+            severity_text, color = ALARM_SEVERITY_STYLES.get(event["severity"], (event["severity"], "#ffffff"))
+            texts = [format_time(event["time"]), ALARM_EVENT_TEXT.get(event["event"], event["event"]), severity_text,
+                     event["alarm"], event["message"]]
+            for column, text in enumerate(texts):
+                table.setItem(row, column, QTableWidgetItem(text))
+            if event["event"] == "raised":
+                table.item(row, 1).setBackground(QColor(color))
+        QVBoxLayout(dialog).addWidget(table)
+        dialog.exec_()
+
+    def on_write_done(self, var_name, value, success, message):
+        if not self.is_running:
+            return
+        if success:
+            self.display_value(var_name, value)
+            if var_name in self.entries:
+                self.entries[var_name].clear()
+        else:
+            QMessageBox.critical(self, "错误", message)
+
+    def display_value(self, var_name, value):
+        # 只记录变化并合并到下一帧绘制，返回值是否发生变化
+        if not self.is_running:
+            return False
+        previous = self.last_values.get(var_name)
+        self.last_values[var_name] = value
+        if var_name in self.rendered and previous == value and type(previous) is type(value):
+            return False
+        self.dirty.add(var_name)
+        if not self.render_timer.isActive():
+            self.render_timer.start()
+        return True
+
+    def render_dirty(self):
+        # 只绘制当前可见标签页，其他页在切换过去时再补画
+        visible_tab = self.tabs.tabText(self.tabs.currentIndex())
+        with Metrics.render_seconds.time():
+            for var_name in [v for v in self.dirty if self.var_tabs.get(v) == visible_tab]:
+                self.dirty.discard(var_name)
+                self.render_value(var_name)
+
+    def update_metrics(self):
+        overruns = Metrics.scan_overruns.total()
+        self.metrics_label.setStyleSheet("color: #dc3545;" if overruns > self.last_overruns else "")
+        self.last_overruns = overruns
+        # 订阅模式下没有轮询读取，用数据变化速率反映刷新情况
+        changes = Metrics.data_changes.total()
+        rate = (changes - self.last_changes) * 1000 / METRICS_INTERVAL
+        self.last_changes = changes
+        summary = Metrics.summary()
+        self.metrics_label.setText(f"变化 {rate:.0f}/s | {summary}" if summary else f"变化 {rate:.0f}/s")
+
+    def render_value(self, var_name):
+        value = self.last_values[var_name]
+        rendered = self.rendered.get(var_name)
+        if rendered and rendered[0] == value and type(rendered[0]) is type(value):
+            return
+        info = VARIABLES.get(var_name)
+        if info is None or var_name not in self.value_labels:
+            return  # 变量配置重新加载中，已删除的变量
+        if info["type"] in ["Float", "REAL"] and isinstance(value, (int, float)):
+            text = f"{value:.4f}"
+        else:
+            text = str(value)
+        if not rendered or rendered[1] != text:
+            self.value_labels[var_name].setText(text)
+        # 同步布尔型按钮状态
+        if var_name in self.bool_buttons and (not rendered or bool(rendered[0]) != bool(value)):
+            self.bool_buttons[var_name].setChecked(bool(value))
+        self.rendered[var_name] = (value, text)
+
+    def update_values(self, values):
+        if not self.is_running:
+            return
+        try:
+            if values:
+                changed = sum(self.display_value(var_name, value) for var_name, value in values.items())
+                if self.status_bar.currentMessage() != self.connection_message:
+                    self.status_bar.showMessage(self.connection_message)
+                if changed:
+                    logger.debug(f"Values updated ({changed} changed)")
+            else:
+                self.status_bar.showMessage("连接中断")
+        except Exception as e:
+            logger.error(f"Update failed: {e}")
+            self.status_bar.showMessage(f"错误: {str(e)}")
+
+    def on_connection_changed(self, connected, message):
+        if connected:
+            self.was_connected = True
+            self.connection_message = message
+            self.status_bar.showMessage(message)
+            self.load_alarms()
+        elif self.was_connected:
+            # 连接中断后由 I/O 线程自动重连，只更新状态栏
+            self.status_bar.showMessage(message)
+        elif self.is_running:
+            QMessageBox.critical(self, "错误", message)
+            self.on_exit()
+
+    def start_opcua(self):
+        self.worker.connection_changed.connect(self.on_connection_changed)
+        self.worker.values_ready.connect(self.update_values)
+        self.worker.value_changed.connect(self.display_value)
+        self.worker.write_done.connect(self.on_write_done)
+        self.worker.alarm_event.connect(self.on_alarm_event)
+        self.worker.tags_changed.connect(self.on_tags_changed)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.status_bar.showMessage("连接中...")
+        self.worker.start()
+
+    def on_worker_finished(self):
+        if not self.is_running:
+            self.worker.wait()
+            self.close()
+
+    def on_exit(self):
+        self.is_running = False
+        self.worker.stop()
+        if self.worker.isRunning():
+            # 断开连接在 I/O 线程中完成，线程结束后再关闭窗口
+            self.centralWidget().setEnabled(False)
+            self.status_bar.showMessage("正在断开连接...")
+        else:
+            self.close()
+
+    def closeEvent(self, event):
+        # 标题栏关闭与退出按钮相同，I/O 线程结束前不关闭窗口
+        if self.is_running:
+            self.on_exit()
+        if self.worker.isRunning():
+            event.ignore()
+        else:
+            event.accept()
+
+
+class FleetWorker(QThread):
+    # 在后台线程运行 FleetMonitor 的事件循环，回调转为带机器名的信号
+    connection_changed = pyqtSignal(str, bool, str)
+    values_ready = pyqtSignal(str, dict)
+    value_changed = pyqtSignal(str, str, object)
+    write_done = pyqtSignal(str, str, object, bool, str)
+    alarm_event = pyqtSignal(str, dict)
+    tags_changed = pyqtSignal(str, object)
+
+    def __init__(self, machines, parent=None):
+        super().__init__(parent)
+        from Fleet import FleetMonitor
+        self.monitor = FleetMonitor(machines)
+        self.monitor.on_connection_changed = self.connection_changed.emit
+        self.monitor.on_values = self.values_ready.emit
+        self.monitor.on_value_changed = self.value_changed.emit
+        self.monitor.on_write_done = self.write_done.emit
+        self.monitor.on_alarm = self.alarm_event.emit
+        self.monitor.on_tags_changed = self.tags_changed.emit
+
+    def stop(self):
+        self.monitor.stop()
+
+    def run(self):
+        self.monitor.run()
+
+
+class MachineChannel(QObject):
+    # 把机群中一台机器的信号转换为 OPCUAWorker 的接口，供 OPCUAGUI 作为单机界面显示
+    connection_changed = pyqtSignal(bool, str)
+    values_ready = pyqtSignal(dict)
+    value_changed = pyqtSignal(str, object)
+    write_done = pyqtSignal(str, object, bool, str)
+    alarm_event = pyqtSignal(dict)
+    tags_changed = pyqtSignal(object)
+    finished = pyqtSignal()
+
+    def __init__(self, fleet_worker, machine, latest_values, parent=None):
+        super().__init__(parent)
+        self.fleet_worker = fleet_worker
+        self.machine = machine
+        self.latest_values = latest_values
+        self.was_connected = False
+
+    def start(self):
+        # 先补发当前状态和最新值，再转发后续变化
+        self.fleet_worker.connection_changed.connect(self.on_connection_changed)
+        self.fleet_worker.values_ready.connect(self.on_values)
+        self.fleet_worker.value_changed.connect(self.on_value_changed)
+        self.fleet_worker.write_done.connect(self.on_write_done)
+        self.fleet_worker.alarm_event.connect(self.on_alarm)
+        self.fleet_worker.tags_changed.connect(self.on_tags_changed)
+        session = self.fleet_worker.monitor.sessions[self.machine]
+        if session.connected:
+            self.on_connection_changed(self.machine, True, session.message)
+        if self.latest_values:
+            self.values_ready.emit(dict(self.latest_values))
+
+    def on_connection_changed(self, machine, connected, message):
+        # 首次连上之前不转发断开，避免单机界面把机群重试当作启动失败而退出
+        if machine == self.machine and (connected or self.was_connected):
+            self.was_connected = self.was_connected or connected
+            self.connection_changed.emit(connected, message)
+
+    def on_values(self, machine, values):
+        if machine == self.machine:
+            self.values_ready.emit(values)
+
+    def on_value_changed(self, machine, var_name, value):
+        if machine == self.machine:
+            self.value_changed.emit(var_name, value)
+
+    def on_write_done(self, machine, var_name, value, success, message):
+        if machine == self.machine:
+            self.write_done.emit(var_name, value, success, message)
+
+    def on_alarm(self, machine, event):
+        if machine == self.machine:
+            self.alarm_event.emit(event)
+
+    def on_tags_changed(self, machine, changes):
+        if machine == self.machine:
+            self.tags_changed.emit(changes)
+
+    def write(self, var_name, value):
+        self.fleet_worker.monitor.write(self.machine, var_name, value)
+
+    def write_many(self, values):
+        self.fleet_worker.monitor.write_many(self.machine, values)
+
+    def acknowledge(self, name=None):
+        self.fleet_worker.monitor.acknowledge(self.machine, name)
+
+    def alarm_snapshot(self):
+        return self.fleet_worker.monitor.sessions[self.machine].alarms.snapshot()
+
+    def alarm_history(self):
+        return list(self.fleet_worker.monitor.sessions[self.machine].alarms.history)
+
+    def stop(self):
+        # 只停止转发，机器的会话继续由机群维持
+        for signal, slot in [(self.fleet_worker.connection_changed, self.on_connection_changed),
+                             (self.fleet_worker.values_ready, self.on_values),
+                             (self.fleet_worker.value_changed, self.on_value_changed),
+                             (self.fleet_worker.write_done, self.on_write_done),
+                             (self.fleet_worker.alarm_event, self.on_alarm),
+                             (self.fleet_worker.tags_changed, self.on_tags_changed)]:
+            try:
+                signal.disconnect(slot)
+            except TypeError:
+                pass
+
+    def isRunning(self):
+        return False
+
+
+class FleetGUI(QMainWindow):
+    def __init__(self, machines):
+        super().__init__()
+        self.setWindowTitle(f"PLC 机群监控 ({len(machines)} 台)")
+        self.setGeometry(100, 100, 1000, 600)
+        self.worker = FleetWorker(machines, self)
+        self.machines = [machine["name"] for machine in machines]
+        self.rows = {name: row for row, name in enumerate(self.machines)}
+        self.columns = {var_name: column for column, var_name in enumerate(FLEET_OVERVIEW_VARIABLES, 3)}
+        self.latest_values = {name: {} for name in self.machines}  # 每台机器的最新值，打开详情时补发
+        self.details = {}  # 机器名 -> 详情窗口
+        self.dirty = set()  # (机器名, 变量名)
+        self.is_running = True
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(FRAME_INTERVAL)
+        self.render_timer.timeout.connect(self.render_dirty)
+        self.init_ui()
+        self.start_fleet()
+
+    def init_ui(self):
+        main_widget = QWidget()
+        self.setCentralWidget(main_widget)
+        main_layout = QVBoxLayout(main_widget)
+
+        headers = ["机器", "状态", "报警"] + [VARIABLES[v]["comment"] or v for v in FLEET_OVERVIEW_VARIABLES]
+        self.table = QTableWidget(len(self.machines), len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        for name, row in self.rows.items():
+            self.table.setItem(row, 0, QTableWidgetItem(name))
+            for column in range(1, len(headers)):
+                self.table.setItem(row, column, QTableWidgetItem("N/A"))
+            self.table.item(row, 1).setText("连接中...")
+            self.table.item(row, 2).setText("无")
+        self.table.cellDoubleClicked.connect(lambda row, column: self.open_machine(self.machines[row]))
+        main_layout.addWidget(self.table)
+
+        exit_btn = QPushButton("退出")
+        exit_btn.clicked.connect(self.on_exit)
+        main_layout.addWidget(exit_btn)
+
+        self.status_bar = QStatusBar()
+        self.status_bar.showMessage("双击机器查看全部变量")
+        self.setStatusBar(self.status_bar)
+
+    def open_machine(self, machine):
+        window = self.details.get(machine)
+        if window is None or not window.is_running:
+            channel = MachineChannel(self.worker, machine, self.latest_values[machine], self)
+            window = OPCUAGUI(channel, f"{machine} - PLC OPC UA 实时监控")
+            self.details[machine] = window
+        window.show()
+        window.raise_()
+
+    def on_connection_changed(self, machine, connected, message):
+        self.table.item(self.rows[machine], 1).setText(message)
+
+    def on_alarm(self, machine, event):
+        # 总览只显示报警数，有未确认的报警时标红
+        shown = self.worker.monitor.sessions[machine].alarms.snapshot()
+        active = sum(state["active"] for state in shown)
+        item = self.table.item(self.rows[machine], 2)
+        item.setText(f"{active} 个报警" if active else "无" if not shown else "已恢复未确认")
+        item.setBackground(QColor("#f8d7da") if any(not state["acknowledged"] for state in shown)
+                           else QColor("#ffffff"))
+
+    def update_values(self, machine, values):
+        for var_name, value in values.items():
+            self.display_value(machine, var_name, value)
+
+    def display_value(self, machine, var_name, value):
+        self.latest_values[machine][var_name] = value
+        if var_name in self.columns and self.is_running:
+            self.dirty.add((machine, var_name))
+            if not self.render_timer.isActive():
+                self.render_timer.start()
+
+    def render_dirty(self):
+        dirty, self.dirty = self.dirty, set()
+        for machine, var_name in dirty:
+            value = self.latest_values[machine][var_name]
+            if VARIABLES.get(var_name, {}).get("type") in ["Float", "REAL"] and isinstance(value, (int, float)):
+                text = f"{value:.4f}"
+            else:
+                text = str(value)
+            item = self.table.item(self.rows[machine], self.columns[var_name])
+            if item.text() != text:
+                item.setText(text)
+
+    def start_fleet(self):
+        self.worker.connection_changed.connect(self.on_connection_changed)
+        self.worker.values_ready.connect(self.update_values)
+        self.worker.value_changed.connect(self.display_value)
+        self.worker.alarm_event.connect(self.on_alarm)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.worker.start()
+
+    def on_worker_finished(self):
+        self.worker.wait()
+        self.close()
+
+    def on_exit(self):
+        self.is_running = False
+        for window in self.details.values():
+            window.close()
+        self.worker.stop()
+        if self.worker.isRunning():
+            self.centralWidget().setEnabled(False)
+            self.status_bar.showMessage("正在断开连接...")
+        else:
+            self.close()
+
+    def closeEvent(self, event):
+        if self.is_running:
+            self.on_exit()
+        if self.worker.isRunning():
+            event.ignore()
+        else:
+            event.accept()
+
+
+def main():
+    app = QApplication(sys.argv)
+    window = OPCUAGUI()
+    window.show()
+    return app.exec_()
+
+
+def replay_main(engine):
+    app = QApplication(sys.argv)
+    window = OPCUAGUI(OPCUAWorker(engine=engine), title=f"回放: {os.path.basename(engine.recording.path)}")
+    window.show()
+    return app.exec_()
+
+
+def fleet_main(machines):
+    app = QApplication(sys.argv)
+    window = FleetGUI(machines)
+    window.show()
+    return app.exec_()
\ No newline at end of file
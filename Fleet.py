@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from ClientApp import AcquisitionEngine, OPCUAHandler, USERNAME, PASSWORD, FLEET_DIR
+import asyncio
+import os
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+
+class MachineSession(AcquisitionEngine):
+    # 一台 PLC 的会话：连接、读写和重连流程与 AcquisitionEngine 相同，由 FleetMonitor 的事件循环以协程执行；
+    # 首次连接失败也持续重试，一台机器连不上不影响其他机器
+    retry_connect = True
+
+    def __init__(self, monitor, name, url, username=None, password=None):
+        state_dir = os.path.join(FLEET_DIR, name)
+        super().__init__(OPCUAHandler(url, username or USERNAME, password or PASSWORD,
+                                      os.path.join(state_dir, "node_cache.json"), name), state_dir)
+        self.monitor = monitor
+        self.name = name
+        self.log_prefix = f"{name}: "
+        self.on_connection_changed = lambda connected, message: monitor.on_connection_changed(name, connected,
+                                                                                              message)
+        self.on_values = lambda values: monitor.on_values(name, values)
+        self.on_value_changed = lambda var_name, value: monitor.on_value_changed(name, var_name, value)
+        self.on_write_done = lambda var_name, value, success, message: monitor.on_write_done(
+            name, var_name, value, success, message)
+        self.on_alarm = lambda event: monitor.on_alarm(name, event)
+        self.on_tags_changed = lambda changes: monitor.on_tags_changed(name, changes)
+        self.wakeup = None  # asyncio.Event，事件循环启动后创建
+        self.connected = False
+        self.message = "未连接"
+
+    def write_many(self, values):
+        # 可在任意线程调用
+        self.writes.put_many(values)
+        self.monitor.wake(self)
+
+    def stop(self):
+        self.is_running = False
+        self.monitor.wake(self)
+
+    def set_connection(self, connected, message):
+        self.connected = connected
+        self.message = message
+        super().set_connection(connected, message)
+
+    async def call(self, function, *args):
+        # python-opcua 的服务调用是阻塞的，放到线程池执行；每台机器同一时刻只有一个调用
+        return await self.monitor.loop.run_in_executor(self.monitor.executor, function, *args)
+
+    async def wait_writes(self, timeout):
+        # 等待新的写入或超时，返回全部待写入的变量
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+        return self.writes.get(0)
+
+    async def drive(self, steps):
+        # 与 AcquisitionEngine.drive 相同，调用在线程池中执行、等待不阻塞事件循环
+        result = None
+        error = None
+        while True:
+            try:
+                step = steps.throw(error) if error else steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                if step[0] == "wait":
+                    result = await self.wait_writes(step[1])
+                else:
+                    result = await self.call(*step[1:])
+            except BaseException as e:
+                error = e
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        self.record_history = self.monitor.record_history
+        try:
+            return await self.drive(self.session())
+        finally:
+            self.connected = False
+
+
+class FleetMonitor:
+    # 多台相同变量表的 PLC：单线程 asyncio 事件循环调度全部会话，阻塞的 OPC UA 调用在线程池中并发执行
+    def __init__(self, machines):
+        self.sessions = OrderedDict((machine["name"], MachineSession(self, **machine)) for machine in machines)
+        self.on_connection_changed = lambda machine, connected, message: None
+        self.on_values = lambda machine, values: None
+        self.on_value_changed = lambda machine, var_name, value: None
+        self.on_write_done = lambda machine, var_name, value, success, message: None
+        self.on_alarm = lambda machine, event: None
+        self.on_tags_changed = lambda machine, changes: None
+        self.record_history = True
+        self.is_running = True
+        self.loop = None
+        self.executor = None
+
+    def write(self, machine, var_name, value):
+        self.write_many(machine, {var_name: value})
+
+    def write_many(self, machine, values):
+        # 可在任意线程调用
+        self.sessions[machine].write_many(values)
+
+    def acknowledge(self, machine, name=None):
+        self.sessions[machine].alarms.acknowledge(name)
+
+    def wake(self, session):
+        loop = self.loop
+        if loop is not None and session.wakeup is not None:
+            try:
+                loop.call_soon_threadsafe(session.wakeup.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def stop(self):
+        self.is_running = False
+        for session in self.sessions.values():
+            session.stop()
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        # 每台机器最多一个进行中的调用，线程数与机器数相同即互不阻塞
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.sessions)), thread_name_prefix="Fleet")
+        try:
+            results = await asyncio.gather(*(session.run() for session in self.sessions.values()),
+                                           return_exceptions=True)
+            for name, result in zip(self.sessions, results):
+                if isinstance(result, Exception):
+                    logger.error(f"{name}: session stopped with error: {result}")
+        finally:
+            self.executor.shutdown(wait=False)
+            self.loop = None
+
+    def run(self):
+        # 阻塞直到 stop()
+        logger.info(f"Fleet monitoring {len(self.sessions)} machines")
+        asyncio.run(self.main())
\ No newline at end of file
@@ -0,0 +1,430 @@
+from collections import OrderedDict, deque
+from ClientApp import (AcquisitionEngine, GATEWAY_HOST, GATEWAY_PORT, GATEWAY_FLUSH_INTERVAL, GATEWAY_MAX_BACKLOG,
+                       RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY, ALARM_HISTORY_SIZE, TAGS, VARIABLES)
+from Tags import TagSubscriber
+import ipaddress
+import json
+import queue
+import random
+import socket
+import socketserver
+import threading
+import time
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+# 协议：TCP 上每行一个 UTF-8 JSON 对象
+# 网关 -> 客户端: {"type": "connection", "connected", "message"} | {"type": "values", "values": {变量名: 值}}
+#                 | {"type": "write_done", "var", "value", "success", "message"}
+#                 | {"type": "alarms", "active": [报警状态], "history": [报警事件]} (连接时) | {"type": "alarm", "event"}
+#                 | {"type": "tags", "variables", "groups"} (连接时及配置重新加载后，客户端以网关的变量配置为准)
+# 客户端 -> 网关: {"type": "write", "values": {变量名: 值}}，按收到的顺序进入写入队列
+#                 | {"type": "acknowledge", "alarm": 报警名或 null}，报警在网关判断，确认对所有客户端生效
+# 无效的客户端消息不执行，网关回复 {"type": "error", "message"}
+# 网关不做身份验证，连接的客户端都可以写 PLC，默认只允许监听本机回环地址
+
+
+def encode(message):
+    return (json.dumps(message, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def is_loopback(host):
+    # 主机名解析出的所有地址都是回环地址时才算本机
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (OSError, UnicodeError):
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+
+def parse_request(line):
+    # 校验客户端消息，无效时抛出 ValueError，消息内容回复给客户端
+    try:
+        message = json.loads(line)
+    except ValueError:
+        raise ValueError("消息不是有效的 JSON")
+    if not isinstance(message, dict):
+        raise ValueError("消息必须是 JSON 对象")
+    kind = message.get("type")
+    if kind == "write":
+        values = message.get("values")
+        if not isinstance(values, dict) or not values:
+            raise ValueError("write 消息的 values 必须是非空对象")
+        for var_name, value in values.items():
+            if var_name not in VARIABLES:
+                raise ValueError(f"未知变量: {var_name}")
+            if not isinstance(value, (bool, int, float, str)):
+                raise ValueError(f"变量 {var_name} 的值必须是数字、布尔值或字符串")
+        return kind, OrderedDict(values)
+    if kind == "acknowledge":
+        alarm = message.get("alarm")
+        if alarm is not None and not isinstance(alarm, str):
+            raise ValueError("acknowledge 消息的 alarm 必须是报警名或 null")
+        return kind, alarm
+    raise ValueError(f"未知消息类型: {kind}")
+
+
+class Subscriber:
+    # 网关侧的一个客户端连接：消息先进入发送队列，由独立线程发送，慢客户端不会阻塞采集
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.outbox = queue.Queue(GATEWAY_MAX_BACKLOG)
+        self.alive = True
+        threading.Thread(target=self.send_loop, name=f"Gateway-{address[1]}", daemon=True).start()
+
+    def send(self, data):
+        try:
+            self.outbox.put_nowait(data)
+        except queue.Full:
+            logger.warning(f"Gateway client {self.address} is too slow, disconnecting")
+            self.close()
+
+    def send_loop(self):
+        while self.alive:
+            data = self.outbox.get()
+            if data is None:
+                break
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+
+    def close(self):
+        if not self.alive:
+            return
+        self.alive = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.outbox.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class GatewayRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        gateway = self.server.gateway
+        subscriber = gateway.add_subscriber(self.connection, self.client_address)
+        try:
+            for line in self.rfile:
+                try:
+                    kind, argument = parse_request(line)
+                except ValueError as e:
+                    logger.warning(f"Invalid gateway message from {self.client_address}: {e}")
+                    subscriber.send(encode({"type": "error", "message": str(e)}))
+                    continue
+                if kind == "write":
+                    gateway.submit(subscriber, argument)
+                else:
+                    gateway.engine.acknowledge(argument)
+        except OSError:
+            pass
+        finally:
+            gateway.remove_subscriber(subscriber)
+
+
+class GatewayServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Gateway:
+    # 一个进程持有 PLC 会话和 AcquisitionEngine，把变化广播给所有客户端并按顺序转发它们的写入
+    def __init__(self, host=None, port=None, allow_remote=False):
+        self.address = (host or GATEWAY_HOST, port or GATEWAY_PORT)
+        self.allow_remote = allow_remote
+        self.engine = AcquisitionEngine()
+        self.engine.on_connection_changed = self.on_connection_changed
+        self.engine.on_values = self.on_values
+        self.engine.on_value_changed = self.on_value_changed
+        self.engine.on_write_done = self.on_write_done
+        self.engine.on_alarm = self.on_alarm
+        self.engine.on_tags_changed = self.on_tags_changed
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.latest = OrderedDict()  # 最新值，新客户端连接时先收到完整快照
+        self.status = None  # 最近的 (是否连接, 消息)
+        self.changes = OrderedDict()  # 尚未广播的变化
+        self.changed = threading.Event()
+        self.writers = {}  # 变量名 -> [(提交者, 值)]，按提交顺序
+        self.server = None
+
+    def add_subscriber(self, sock, address):
+        subscriber = Subscriber(sock, address)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            subscriber.send(self.encode_tags())
+            subscriber.send(encode({"type": "alarms", "active": self.engine.alarm_snapshot(),
+                                    "history": self.engine.alarm_history()}))
+            if self.latest:
+                subscriber.send(encode({"type": "values", "values": self.latest}))
+            if self.status:
+                connected, message = self.status
+                subscriber.send(encode({"type": "connection", "connected": connected, "message": message}))
+        logger.info(f"Gateway client connected from {address} ({len(self.subscribers)} total)")
+        return subscriber
+
+    def remove_subscriber(self, subscriber):
+        subscriber.close()
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            for var_name, entries in self.writers.items():
+                self.writers[var_name] = [entry for entry in entries if entry[0] is not subscriber]
+        logger.info(f"Gateway client {subscriber.address} disconnected")
+
+    def submit(self, subscriber, values):
+        with self.lock:
+            for var_name, value in values.items():
+                self.writers.setdefault(var_name, []).append((subscriber, value))
+        self.engine.write_many(values)
+
+    def flush(self):
+        # 调用方持有 self.lock
+        if self.changes:
+            data = encode({"type": "values", "values": self.changes})
+            self.changes = OrderedDict()
+            for subscriber in self.subscribers:
+                subscriber.send(data)
+
+    def update(self, values):
+        # 只广播与最新值不同的值：轮询每个周期都返回全部到期变量，未变化的不再发给客户端
+        changed = False
+        with self.lock:
+            for var_name, value in values.items():
+                previous = self.latest.get(var_name)
+                if var_name in self.latest and previous == value and type(previous) is type(value):
+                    continue
+                self.latest[var_name] = value
+                self.changes[var_name] = value
+                changed = True
+        if changed:
+            self.changed.set()
+
+    def on_values(self, values):
+        self.update(values)
+
+    def on_value_changed(self, var_name, value):
+        self.update({var_name: value})
+
+    def on_connection_changed(self, connected, message):
+        with self.lock:
+            self.flush()
+            self.status = (connected, message)
+            data = encode({"type": "connection", "connected": connected, "message": message})
+            for subscriber in self.subscribers:
+                subscriber.send(data)
+
+    def on_alarm(self, event):
+        # 先发出触发报警的值，再发报警
+        with self.lock:
+            self.flush()
+            data = encode({"type": "alarm", "event": event})
+            for subscriber in self.subscribers:
+                subscriber.send(data)
+
+    def encode_tags(self):
+        _, variables, groups = TAGS.snapshot()
+        return encode({"type": "tags", "variables": variables, "groups": groups})
+
+    def on_tags_changed(self, changes):
+        with self.lock:
+            self.flush()
+            data = self.encode_tags()
+            for subscriber in self.subscribers:
+                subscriber.send(data)
+
+    def on_write_done(self, var_name, value, success, message):
+        # 写入队列按变量合并，结果通知写入的值及之前被它覆盖的提交者
+        with self.lock:
+            entries = self.writers.get(var_name, [])
+            written = [i for i, (_, v) in enumerate(entries) if v == value and type(v) is type(value)]
+            count = written[-1] + 1 if written else len(entries)
+            notified, self.writers[var_name] = entries[:count], entries[count:]
+            self.flush()
+        data = encode({"type": "write_done", "var": var_name, "value": value, "success": success,
+                       "message": message})
+        for subscriber in OrderedDict.fromkeys(entry[0] for entry in notified):
+            subscriber.send(data)
+
+    def broadcast_loop(self):
+        # 合并 GATEWAY_FLUSH_INTERVAL 内的变化为一条消息
+        while self.engine.is_running:
+            self.changed.wait()
+            self.changed.clear()
+            time.sleep(GATEWAY_FLUSH_INTERVAL)
+            with self.lock:
+                self.flush()
+
+    def stop(self):
+        self.engine.stop()
+        self.changed.set()
+
+    def run(self):
+        # 阻塞直到 stop() 或首次连接 PLC 失败
+        if not is_loopback(self.address[0]):
+            if not self.allow_remote:
+                logger.error(f"Refusing to listen on non-loopback address {self.address[0]}: gateway clients "
+                             f"can write to the PLC without authentication (use --allow-remote to override)")
+                return False
+            logger.warning(f"Gateway listening on non-loopback address {self.address[0]}: any client that can "
+                           f"reach it can write to the PLC without authentication")
+        self.server = GatewayServer(self.address, GatewayRequestHandler)
+        self.server.gateway = self
+        threading.Thread(target=self.server.serve_forever, name="GatewayServer", daemon=True).start()
+        threading.Thread(target=self.broadcast_loop, name="GatewayBroadcast", daemon=True).start()
+        logger.info(f"Gateway listening on {self.address[0]}:{self.address[1]}")
+        try:
+            return self.engine.run()
+        finally:
+            self.changed.set()
+            self.server.shutdown()
+            self.server.server_close()
+            with self.lock:
+                for subscriber in self.subscribers:
+                    subscriber.close()
+                self.subscribers.clear()
+
+
+class GatewayClient:
+    # 与 AcquisitionEngine 接口相同，数据来自网关而不是直接连接 PLC
+    def __init__(self, host=None, port=None):
+        self.address = (host or GATEWAY_HOST, port or GATEWAY_PORT)
+        self.on_connection_changed = lambda connected, message: None
+        self.on_values = lambda values: None
+        self.on_value_changed = lambda var_name, value: None
+        self.on_write_done = lambda var_name, value, success, message: None
+        self.on_alarm = lambda event: None
+        self.tags = TagSubscriber(TAGS)
+        self.on_tags_changed = lambda changes: None
+        self.alarms = OrderedDict()  # 报警名 -> 网关上的最新状态
+        self.history = deque(maxlen=ALARM_HISTORY_SIZE)
+        self.alarm_lock = threading.Lock()
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.was_connected = False
+        self.is_running = True
+
+    def write(self, var_name, value):
+        self.write_many({var_name: value})
+
+    def write_many(self, values):
+        if self.send({"type": "write", "values": values}):
+            return
+        for var_name, value in values.items():
+            self.on_write_done(var_name, value, False, "写入失败: 网关连接中断")
+
+    def send(self, message):
+        with self.send_lock:
+            if self.sock:
+                try:
+                    self.sock.sendall(encode(message))
+                    return True
+                except OSError as e:
+                    logger.error(f"Failed to send {message['type']} to gateway: {e}")
+        return False
+
+    def acknowledge(self, name=None):
+        self.send({"type": "acknowledge", "alarm": name})
+
+    def alarm_snapshot(self):
+        with self.alarm_lock:
+            return [dict(state) for state in self.alarms.values() if state["active"] or not state["acknowledged"]]
+
+    def alarm_history(self):
+        with self.alarm_lock:
+            return list(self.history)
+
+    def stop(self):
+        self.is_running = False
+        self.stopped.set()
+        with self.send_lock:
+            if self.sock:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=5)
+        sock.settimeout(None)
+        with self.send_lock:
+            self.sock = sock
+        logger.info(f"Connected to gateway at {self.address[0]}:{self.address[1]}")
+        return sock
+
+    def dispatch(self, message):
+        kind = message.get("type")
+        if kind == "values":
+            self.on_values(message["values"])
+        elif kind == "connection":
+            # 首次连上 PLC 之前不转发断开，网关仍在重连时界面保持“连接中”
+            if message["connected"] or self.was_connected:
+                self.was_connected = self.was_connected or message["connected"]
+                self.on_connection_changed(message["connected"], message["message"])
+        elif kind == "write_done":
+            self.on_write_done(message["var"], message["value"], message["success"], message["message"])
+        elif kind == "error":
+            logger.warning(f"Gateway rejected request: {message['message']}")
+        elif kind == "alarm":
+            event = message["event"]
+            with self.alarm_lock:
+                self.alarms[event["alarm"]] = {k: event[k] for k in ("alarm", "severity", "message", "active",
+                                                                     "acknowledged", "since")}
+                self.history.append(event)
+            self.on_alarm(event)
+        elif kind == "alarms":
+            with self.alarm_lock:
+                self.alarms = OrderedDict((state["alarm"], state) for state in message["active"])
+                self.history.clear()
+                self.history.extend(message["history"])
+        elif kind == "tags":
+            TAGS.replace(message["variables"], message["groups"])
+            changes = self.tags.changes()
+            if changes:
+                logger.info(f"Tags updated from gateway: {changes.summary()}")
+                self.on_tags_changed(changes)
+
+    def receive(self, sock):
+        with sock, sock.makefile("rb") as stream:
+            for line in stream:
+                self.dispatch(json.loads(line))
+        with self.send_lock:
+            self.sock = None
+
+    def run(self):
+        try:
+            sock = self.connect()
+        except OSError as e:
+            logger.error(f"Failed to connect to gateway at {self.address[0]}:{self.address[1]}: {e}")
+            self.on_connection_changed(False, "无法连接到网关，请确认网关已启动")
+            return False
+        while self.is_running:
+            try:
+                self.receive(sock)
+            except (OSError, ValueError) as e:
+                logger.error(f"Gateway connection error: {e}")
+                with self.send_lock:
+                    self.sock = None
+            sock = self.reconnect()
+        return True
+
+    def reconnect(self):
+        # 与 PLC 重连相同的指数退避加随机抖动
+        delay = RECONNECT_MIN_DELAY
+        attempt = 0
+        while self.is_running:
+            attempt += 1
+            if self.was_connected:
+                self.on_connection_changed(False, f"网关连接中断，正在重连 (第 {attempt} 次)")
+            try:
+                return self.connect()
+            except OSError as e:
+                logger.warning(f"Gateway reconnect failed: {e}")
+            self.stopped.wait(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        return None
\ No newline at end of file
@@ -0,0 +1,143 @@
+from array import array
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+# 环形文件格式：文件头 + 时间戳列 (float64) + 数值列 (float64)
+RING_MAGIC = b"OPCRING1"
+RING_HEADER = struct.Struct("<8sQQQ")  # magic, capacity, head, count
+
+
+class RingFile:
+    # 单个变量的固定大小内存映射环形存储，写满后覆盖最旧的样本
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        size = RING_HEADER.size + capacity * 16
+        fresh = not os.path.exists(path) or os.path.getsize(path) != size
+        self.file = open(path, "w+b" if fresh else "r+b")
+        if fresh:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        magic, stored_capacity, self.head, self.count = RING_HEADER.unpack_from(self.map, 0)
+        if magic != RING_MAGIC or stored_capacity != capacity:
+            self.head, self.count = 0, 0
+            self.write_header()
+        column_bytes = capacity * 8
+        self.times = memoryview(self.map)[RING_HEADER.size:RING_HEADER.size + column_bytes].cast("d")
+        self.values = memoryview(self.map)[RING_HEADER.size + column_bytes:].cast("d")
+
+    def write_header(self):
+        RING_HEADER.pack_into(self.map, 0, RING_MAGIC, self.capacity, self.head, self.count)
+
+    def append(self, timestamp, value):
+        with self.lock:
+            self.times[self.head] = timestamp
+            self.values[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.write_header()
+
+    def position(self, logical_index):
+        # 逻辑序号 0 为最旧样本
+        return (self.head - self.count + logical_index) % self.capacity
+
+    def bisect(self, timestamp):
+        # 返回第一个时间戳 >= timestamp 的逻辑序号
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.times[self.position(mid)] < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def columns(self, start=None, end=None):
+        # 按时间范围取出两列的副本，环形跨界时分两段拷贝
+        with self.lock:
+            first = self.bisect(start) if start is not None else 0
+            last = self.bisect(end) if end is not None else self.count
+            times, values = array("d"), array("d")
+            if last <= first:
+                return times, values
+            begin = self.position(first)
+            end_position = begin + (last - first)
+            segments = [(begin, min(end_position, self.capacity))]
+            if end_position > self.capacity:
+                segments.append((0, end_position - self.capacity))
+            for low, high in segments:
+                times.frombytes(self.times[low:high].tobytes())
+                values.frombytes(self.values[low:high].tobytes())
+            return times, values
+
+    def close(self):
+        with self.lock:
+            self.times.release()
+            self.values.release()
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+
+class Historian:
+    # 进程内时序历史：每个变量一个环形文件，磁盘和内存占用都有上限
+    def __init__(self, directory, var_names, capacity):
+        os.makedirs(directory, exist_ok=True)
+        self.rings = {var_name: RingFile(os.path.join(directory, f"{var_name}.ring"), capacity)
+                      for var_name in var_names}
+        logger.info(f"Historian recording {len(self.rings)} variables to {directory} ({capacity} samples each)")
+
+    def record(self, var_name, value, timestamp=None):
+        ring = self.rings.get(var_name)
+        if ring is None:
+            return
+        # 布尔量记为 0/1，读取失败记为 NaN
+        if isinstance(value, (bool, int, float)):
+            value = float(value)
+        else:
+            value = math.nan
+        ring.append(time.time() if timestamp is None else timestamp, value)
+
+    def record_values(self, values, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        for var_name, value in values.items():
+            self.record(var_name, value, timestamp)
+
+    def query(self, var_name, start=None, end=None):
+        # 返回 [start, end) 内的 (时间戳列, 数值列)，均为 array("d")
+        return self.rings[var_name].columns(start, end)
+
+    def downsample(self, var_name, start=None, end=None, buckets=500):
+        # 按时间等分为 buckets 段，返回 [(段起始时间, 最小值, 最大值, 平均值, 样本数)]，跳过 NaN
+        times, values = self.query(var_name, start, end)
+        if not times:
+            return []
+        first = times[0]
+        width = (times[-1] - first) / buckets or 1.0
+        stats = {}
+        for timestamp, value in zip(times, values):
+            if math.isnan(value):
+                continue
+            index = min(int((timestamp - first) / width), buckets - 1)
+            entry = stats.get(index)
+            if entry is None:
+                stats[index] = [value, value, value, 1]
+            else:
+                entry[0] = min(entry[0], value)
+                entry[1] = max(entry[1], value)
+                entry[2] += value
+                entry[3] += 1
+        return [(first + index * width, low, high, total / count, count)
+                for index, (low, high, total, count) in sorted(stats.items())]
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
\ No newline at end of file
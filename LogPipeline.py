@@ -0,0 +1,93 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    # 同一条告警/错误（同一 logger、级别和未格式化的消息）在 interval 秒内只输出一次，被抑制的次数附加在下一次
+    # 输出的消息后；带 extra={"rate_limit": False} 的记录（如报警触发/解除）不受限制
+    def __init__(self, interval, level=logging.WARNING, max_keys=1000):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.max_keys = max_keys
+        self.seen = {}  # (logger, level, 消息模板) -> [上次输出时间, 抑制次数]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level or not self.interval or not getattr(record, "rate_limit", True):
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry and now - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+            suppressed = entry[1] if entry else 0
+            self.seen[key] = [now, 0]
+            if len(self.seen) > self.max_keys:
+                self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.interval}
+        if suppressed:
+            record.msg = f"{record.getMessage()} (repeated {suppressed} times)"
+            record.args = None
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # 每条日志一行 JSON，便于机器解析
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "logger": record.name,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def make_file_handler(path, max_bytes, backup_count, rotate_when):
+    # rotate_when 为 None 时按大小轮转，否则按时间轮转（如 "midnight"）
+    if rotate_when:
+        return TimedRotatingFileHandler(path, when=rotate_when, backupCount=backup_count, encoding="utf-8")
+    return RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+
+
+def setup_logging(log_file, level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=5, rotate_when=None,
+                  json_file=None, rate_limit=60, console=True, library_level=logging.WARNING):
+    # 调用线程只把日志放入队列，格式化和磁盘/控制台输出由后台线程完成。
+    # python-opcua 在每个请求上都输出 INFO 日志，默认只保留其告警和错误
+    logging.getLogger("opcua").setLevel(library_level)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    file_handler = make_file_handler(log_file, max_bytes, backup_count, rotate_when)
+    file_handler.setFormatter(formatter)
+    handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+    if json_file:
+        json_handler = make_file_handler(json_file, max_bytes, backup_count, rotate_when)
+        json_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(json_handler)
+
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate_limit))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
\ No newline at end of file
@@ -0,0 +1,210 @@
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import threading
+import time
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+# 进程内指标：直方图/计数器/仪表，常开且只在记录时加锁；通过 HTTP 以 Prometheus 文本格式导出。
+# PLC 会话相关的指标带 machine 标签，机群中为机器名，单机为空
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECENT_SAMPLES = 256  # 状态栏摘要使用的最近样本数
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = OrderedDict()  # 标签值元组 -> 数据
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self.series.get(label_values, 0)
+
+    def total(self):
+        with self.lock:
+            return sum(self.series.values())
+
+    def render(self):
+        with self.lock:
+            items = list(self.series.items())
+        if not items and not self.labels:
+            items = [((), 0)]
+        return self.header() + [f"{self.name}{format_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.series[label_values] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            entry = self.series.get(label_values)
+            if entry is None:
+                # [各桶计数, 总和, 总数, 最近样本]
+                entry = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0,
+                                                     deque(maxlen=RECENT_SAMPLES)]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+            entry[3].append(value)
+
+    def time(self, *label_values):
+        return Timer(self, label_values)
+
+    def recent_percentile(self, p, *label_values):
+        # 最近 RECENT_SAMPLES 个样本的分位数，没有样本时返回 None
+        with self.lock:
+            entry = self.series.get(label_values)
+            samples = sorted(entry[3]) if entry else []
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self.series.items()]
+        for label_values, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), label_values + (le,))} "
+                             f"{cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Timer:
+    # with histogram.time(): ... 记录代码块耗时 (s)
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+read_cycle_seconds = Histogram("opcua_read_cycle_seconds", "Duration of one batched read cycle", ["machine"])
+read_nodes = Counter("opcua_read_nodes_total", "Nodes read", ["machine"])
+node_errors = Counter("opcua_node_errors_total", "Bad status codes per node", ["machine", "node"])
+read_failures = Counter("opcua_read_failures_total", "Read requests that raised an exception", ["machine"])
+write_seconds = Histogram("opcua_write_seconds", "Duration of one batched Write request", ["machine"])
+write_errors = Counter("opcua_write_errors_total", "Failed variable writes", ["machine", "variable"])
+data_changes = Counter("opcua_data_changes_total", "Subscription data change notifications", ["machine"])
+scan_lag_seconds = Histogram("opcua_scan_lag_seconds", "Delay between a scan class becoming due and being read",
+                             ["machine", "scan_class"])
+scan_overruns = Counter("opcua_scan_overruns_total", "Scan cycles missed or slower than their interval",
+                        ["machine", "scan_class"])
+keepalive_failures = Counter("opcua_keepalive_failures_total", "Failed keepalive checks", ["machine"])
+reconnects = Counter("opcua_reconnects_total", "Successful reconnects", ["machine"])
+reconnect_seconds = Histogram("opcua_reconnect_seconds", "Time from connection loss to reconnect", ["machine"],
+                              buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+connected = Gauge("opcua_connected", "1 while the PLC session is usable", ["machine"])
+render_seconds = Histogram("hmi_render_seconds", "Duration of one GUI render pass")
+alarm_evaluations = Counter("alarm_rule_evaluations_total", "Alarm rules evaluated after a value change or timeout")
+alarms_active = Gauge("alarms_active", "Alarms currently in the active state")
+motion_step_seconds = Histogram("motion_step_seconds", "Duration of one motion step from command to completion",
+                                ["step"], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+METRICS = [read_cycle_seconds, read_nodes, node_errors, read_failures, write_seconds, write_errors, data_changes,
+           scan_lag_seconds, scan_overruns, keepalive_failures, reconnects, reconnect_seconds, connected,
+           render_seconds, alarm_evaluations, alarms_active, motion_step_seconds]
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def summary(machine=""):
+    # 状态栏用的一行摘要，只包含已有数据的项；读写耗时为 machine 的会话，超限、错误和重连为整个进程
+    parts = []
+    for label, histogram, label_values in [("读取", read_cycle_seconds, (machine,)), ("写入", write_seconds, (machine,)),
+                                           ("渲染", render_seconds, ())]:
+        p95 = histogram.recent_percentile(0.95, *label_values)
+        if p95 is not None:
+            parts.append(f"{label} p95 {p95 * 1000:.1f} ms")
+    overruns = scan_overruns.total()
+    if overruns:
+        parts.append(f"超限 {overruns}")
+    errors = node_errors.total() + read_failures.total()
+    if errors:
+        parts.append(f"读错误 {errors}")
+    count = reconnects.total()
+    if count:
+        parts.append(f"重连 {count}")
+    return " | ".join(parts)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host, port):
+    # 端口被占用（如同一台机器上的网关和界面）时只记录警告，指标仍在进程内记录
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="Metrics", daemon=True).start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return server
\ No newline at end of file
@@ -0,0 +1,249 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from ClientApp import (OPCUAHandler, VARIABLES, MOTION_AXES, MOTION_PUBLISHING_INTERVAL, MOTION_SAMPLING_INTERVAL,
+                       MOTION_TOLERANCE, MOTION_TIMEOUT, MOTION_HOME_POSITION, KEEPALIVE_INTERVAL)
+from Alarms import is_number
+import Metrics
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+# 运动序列使用的变量：各轴的全部变量（命令位、设定值、完成标志和当前位置）
+MOTION_VARIABLES = [v for v in VARIABLES if v.split("_")[0] in MOTION_AXES]
+
+
+class MotionError(Exception):
+    pass
+
+
+class MotionTimeout(MotionError):
+    pass
+
+
+class Condition:
+    # 依赖 var_names 的条件，predicate 接收最新值 {变量名: 值}；变量未收到或读取失败时视为不满足
+    def __init__(self, description, var_names, predicate):
+        self.description = description
+        self.var_names = list(var_names)
+        self.predicate = predicate
+
+    def check(self, values):
+        if any(values.get(v) is None or values.get(v) == "N/A" for v in self.var_names):
+            return False
+        try:
+            return bool(self.predicate(values))
+        except (TypeError, ValueError):
+            return False
+
+
+def equals(var_name, expected):
+    return Condition(f"{var_name} == {expected}", [var_name], lambda values: values[var_name] == expected)
+
+
+def within(var_name, target, tolerance=MOTION_TOLERANCE):
+    return Condition(f"|{var_name} - {target}| <= {tolerance}", [var_name],
+                     lambda values: abs(values[var_name] - target) <= tolerance)
+
+
+def all_of(*conditions):
+    var_names = list(OrderedDict.fromkeys(v for condition in conditions for v in condition.var_names))
+    return Condition(" and ".join(condition.description for condition in conditions), var_names,
+                     lambda values: all(condition.predicate(values) for condition in conditions))
+
+
+class MotionSequencer:
+    # 在 asyncio 中编排运动：写入复用 OPCUAHandler.write_values，等待由订阅通知唤醒，不依赖界面刷新周期
+    # 用法: async with MotionSequencer() as motion: await motion.parallel(motion.home("X"), motion.home("Y"))
+    def __init__(self, opc_handler=None):
+        self.opc_handler = opc_handler or OPCUAHandler()
+        self.values = {}  # 变量名 -> 最新值，只在事件循环线程中修改
+        self.changes = {}  # 变量名 -> 值变化的次数，用于确认命令发出后变量确实变化过
+        self.waiters = {}  # 变量名 -> {(条件, future)}
+        self.loop = None
+        self.executor = None
+        self.poller = None
+        self.watchdog = None
+
+    async def call(self, function, *args):
+        # python-opcua 的服务调用是阻塞的，放到线程池执行；不同轴的请求可以同时进行
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=len(MOTION_AXES) + 1, thread_name_prefix="Motion")
+        if not await self.call(self.opc_handler.connect):
+            await self.close()
+            raise MotionError(f"Cannot connect to PLC at {self.opc_handler.url}")
+        monitored = await self.call(self.opc_handler.subscribe, self.on_data_change, MOTION_VARIABLES,
+                                    MOTION_PUBLISHING_INTERVAL, MOTION_SAMPLING_INTERVAL)
+        # 订阅被拒绝的变量按采样周期轮询
+        polled = [v for v in MOTION_VARIABLES if v not in monitored]
+        self.update(await self.call(self.opc_handler.read_values, MOTION_VARIABLES))
+        if polled:
+            logger.warning(f"Motion: polling {len(polled)} variables without subscription")
+            self.poller = asyncio.ensure_future(self.poll(polled))
+        self.watchdog = asyncio.ensure_future(self.watch())
+
+    async def close(self):
+        for task in (self.poller, self.watchdog):
+            if task:
+                task.cancel()
+        self.poller = self.watchdog = None
+        if self.executor:
+            await self.call(self.opc_handler.disconnect)
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def poll(self, var_names):
+        while True:
+            await asyncio.sleep(MOTION_SAMPLING_INTERVAL / 1000)
+            self.update(await self.call(self.opc_handler.read_values, var_names))
+
+    async def watch(self):
+        # 看门狗：无成功通信超过 KEEPALIVE_INTERVAL 时读取服务器状态确认连接；断开后所有等待立即失败，不等到超时
+        opc_handler = self.opc_handler
+        while opc_handler.connected:
+            idle = KEEPALIVE_INTERVAL - (time.monotonic() - opc_handler.last_ok)
+            await asyncio.sleep(max(idle, MOTION_SAMPLING_INTERVAL / 1000))
+            if time.monotonic() - opc_handler.last_ok >= KEEPALIVE_INTERVAL:
+                await self.call(opc_handler.check_alive)
+        logger.error("Motion: connection to PLC lost")
+        self.fail(MotionError("Connection to PLC lost"))
+
+    def fail(self, error):
+        for waiters in self.waiters.values():
+            for _, future in waiters:
+                if not future.done():
+                    future.set_exception(error)
+
+    def on_data_change(self, var_name, value):
+        # 运行在 opcua 的接收线程中
+        try:
+            self.loop.call_soon_threadsafe(self.update, {var_name: value})
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def update(self, values):
+        for var_name, value in values.items():
+            if var_name not in self.values or self.values[var_name] != value:
+                self.changes[var_name] = self.changes.get(var_name, 0) + 1
+        self.values.update(values)
+        for var_name in values:
+            for condition, future in list(self.waiters.get(var_name, ())):
+                if not future.done() and condition.check(self.values):
+                    future.set_result(None)
+
+    async def wait(self, condition, timeout=MOTION_TIMEOUT):
+        # 条件已满足时立即返回，否则等待相关变量的数据变化；连接已断开时直接失败
+        if not self.opc_handler.connected:
+            raise MotionError("Connection to PLC lost")
+        if condition.check(self.values):
+            return
+        future = self.loop.create_future()
+        waiter = (condition, future)
+        for var_name in condition.var_names:
+            self.waiters.setdefault(var_name, set()).add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise MotionTimeout(f"Timed out after {timeout} s waiting for {condition.description}")
+        finally:
+            for var_name in condition.var_names:
+                self.waiters[var_name].discard(waiter)
+
+    async def write(self, values):
+        results = await self.call(self.opc_handler.write_values, values)
+        failed = [message for success, message in results.values() if not success]
+        if failed:
+            raise MotionError("; ".join(failed))
+        # 写入成功的值立即生效，不等待订阅回显
+        self.update(OrderedDict(values))
+
+    async def pulse(self, var_name, values=None):
+        # PLC 功能块按上升沿启动：命令位仍为 True 时先复位，再与设定值一起置位
+        if self.values.get(var_name) is not False:
+            await self.write({var_name: False})
+        command = OrderedDict(values or {})
+        command[var_name] = True
+        await self.write(command)
+
+    async def step(self, axis, name, start, condition, timeout, reset):
+        # 发出命令、等待条件、复位命令位，返回耗时 (s)
+        start_time = time.monotonic()
+        await start
+        try:
+            await self.wait(condition, timeout)
+        finally:
+            # 连接已断开时无法复位，保留原来的异常
+            if self.opc_handler.connected:
+                await self.write(reset)
+        elapsed = time.monotonic() - start_time
+        Metrics.motion_step_seconds.observe(elapsed, name)
+        logger.info(f"Motion: {axis} {name} finished in {elapsed * 1000:.0f} ms")
+        return elapsed
+
+    async def enable(self, *axes):
+        await self.write(OrderedDict((f"{axis}_POWER", True) for axis in axes))
+
+    async def move_abs(self, axis, position, velocity=None, tolerance=MOTION_TOLERANCE, timeout=MOTION_TIMEOUT):
+        # 完成条件同时要求完成标志和实际位置，避免上一次运动遗留的完成标志
+        settings = OrderedDict([(f"{axis}_MoveABSPos", position)])
+        if velocity is not None:
+            settings[f"{axis}_MoveVel"] = velocity
+        condition = all_of(equals(f"{axis}_MoveAbs_done", True), within(f"{axis}_PosNow", position, tolerance))
+        return await self.step(axis, "move_abs", self.pulse(f"{axis}_MoveAbs", settings), condition, timeout,
+                               {f"{axis}_MoveAbs": False})
+
+    async def move_rel(self, axis, distance, velocity=None, tolerance=MOTION_TOLERANCE, timeout=MOTION_TIMEOUT):
+        # 相对位移值由零变为非零时启动，结束后写回零
+        position = self.values.get(f"{axis}_PosNow")
+        if not is_number(position):
+            raise MotionError(f"Cannot move {axis} by {distance}: current position unknown ({position})")
+        target = position + distance
+        settings = OrderedDict()
+        if velocity is not None:
+            settings[f"{axis}_MoveVel"] = velocity
+        settings[f"{axis}_MoveRelaDist"] = distance
+        condition = all_of(equals(f"{axis}_MoveRela_done", True), within(f"{axis}_PosNow", target, tolerance))
+        return await self.step(axis, "move_rel", self.write(settings), condition, timeout,
+                               {f"{axis}_MoveRelaDist": 0.0})
+
+    async def home(self, axis, tolerance=MOTION_TOLERANCE, timeout=MOTION_TIMEOUT):
+        # 没有回零完成标志：要求发出命令后位置有过变化，且到达原点；已在原点的轴不会在命令发出前就判为完成。
+        # PLC 回零时会先离开原点开关再回来，轴没有动作时按超时报错
+        var_name = f"{axis}_PosNow"
+        changes = self.changes.get(var_name, 0)
+        arrived = within(var_name, MOTION_HOME_POSITION, tolerance)
+        condition = Condition(f"{var_name} changed and {arrived.description}", [var_name],
+                              lambda values: self.changes.get(var_name, 0) > changes and arrived.predicate(values))
+        return await self.step(axis, "home", self.pulse(f"{axis}_HOME"), condition, timeout, {f"{axis}_HOME": False})
+
+    async def stop(self, *axes):
+        axes = axes or MOTION_AXES
+        await self.write(OrderedDict((f"{axis}_Stop", True) for axis in axes))
+        await self.write(OrderedDict((f"{axis}_Stop", False) for axis in axes))
+
+    async def parallel(self, *steps):
+        # 并行执行各步骤并按顺序返回结果；任一步骤失败时取消其余步骤并停止全部轴
+        tasks = [asyncio.ensure_future(step) for step in steps]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        failed = [task for task in done if task.exception()]
+        if failed:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            try:
+                await self.stop()
+            except MotionError as e:
+                logger.error(f"Motion: failed to stop axes: {e}")
+            raise failed[0].exception()
+        return [task.result() for task in tasks]
\ No newline at end of file
@@ -0,0 +1,289 @@
+from array import array
+from collections import OrderedDict
+from Alarms import AlarmEngine
+import csv
+import json
+import os
+import struct
+import threading
+import time
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+# 会话录制文件：文件头 (magic, JSON 元数据长度) + JSON 元数据 (变量表等) + 定长记录，只追加写入
+# 每条记录 19 字节：时间戳 (float64)、变量序号 (uint16)、值类型 (uint8)、值 (float64)
+RECORD_MAGIC = b"OPCREC01"
+RECORD_HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<dHBd")
+KIND_FLOAT, KIND_BOOL, KIND_INT, KIND_BAD = range(4)
+READ_CHUNK = 65536  # 读取时每次解析的记录数
+
+
+def encode_value(value):
+    if isinstance(value, bool):
+        return KIND_BOOL, float(value)
+    if isinstance(value, int):
+        return KIND_INT, float(value)
+    if isinstance(value, float):
+        return KIND_FLOAT, value
+    return KIND_BAD, 0.0  # 读取失败 ("N/A") 等
+
+
+def decode_value(kind, number):
+    if kind == KIND_FLOAT:
+        return number
+    if kind == KIND_BOOL:
+        return number != 0.0
+    if kind == KIND_INT:
+        return int(number)
+    return "N/A"
+
+
+def session_path(directory):
+    return os.path.join(directory, time.strftime("session-%Y%m%d-%H%M%S.opcrec"))
+
+
+def remove_old_sessions(directory, keep_days):
+    # 删除超过保留天数的录制文件
+    if not keep_days or not os.path.isdir(directory):
+        return
+    cutoff = time.time() - keep_days * 86400
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(".opcrec") and os.path.getmtime(path) < cutoff:
+            try:
+                os.remove(path)
+                logger.info(f"Removed old recording {path}")
+            except OSError as e:
+                logger.warning(f"Failed to remove old recording {path}: {e}")
+
+
+class SessionRecorder:
+    # 调用线程只把变化放入缓冲区，后台线程定期把整批记录打包后一次写入
+    def __init__(self, path, var_names, metadata=None, flush_interval=1.0, batch_size=10000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.var_index = {var_name: index for index, var_name in enumerate(var_names)}
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        header = dict(metadata or {}, version=1, start=time.time(), variables=list(var_names))
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        self.file = open(path, "wb")
+        self.file.write(RECORD_HEADER.pack(RECORD_MAGIC, len(header_bytes)) + header_bytes)
+        self.file.flush()
+        self.buffer = []
+        self.last_values = {}  # 变量序号 -> 最近记录的 (类型, 值)，只记录真正的变化
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.count = 0
+        self.thread = threading.Thread(target=self.flush_loop, name="Recorder", daemon=True)
+        self.thread.start()
+        logger.info(f"Recording session to {path}")
+
+    def record(self, var_name, value, timestamp=None):
+        index = self.var_index.get(var_name)
+        if index is None:
+            return
+        encoded = encode_value(value)
+        with self.lock:
+            if self.last_values.get(index) == encoded:
+                return
+            self.last_values[index] = encoded
+            self.buffer.append((time.time() if timestamp is None else timestamp, index) + encoded)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def record_values(self, values, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        for var_name, value in values.items():
+            self.record(var_name, value, timestamp)
+
+    def flush_loop(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if not batch:
+            return
+        data = bytearray(RECORD.size * len(batch))
+        for offset, entry in zip(range(0, len(data), RECORD.size), batch):
+            RECORD.pack_into(data, offset, *entry)
+        try:
+            self.file.write(data)
+            self.file.flush()
+            self.count += len(batch)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to write recording {self.path}: {e}")
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        self.file.close()
+        logger.info(f"Recording {self.path} closed ({self.count} changes)")
+
+
+class Recording:
+    # 读取录制文件；进程异常退出时末尾不完整的记录被忽略
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, "rb") as f:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size or header[:len(RECORD_MAGIC)] != RECORD_MAGIC:
+                    raise ValueError(f"Not a session recording: {path}")
+                _, header_length = RECORD_HEADER.unpack(header)
+                self.metadata = json.loads(f.read(header_length).decode("utf-8"))
+        except OSError as e:
+            raise ValueError(f"Cannot open recording {path}: {e}")
+        self.var_names = self.metadata["variables"]
+        self.data_offset = RECORD_HEADER.size + header_length
+        self.count = (os.path.getsize(path) - self.data_offset) // RECORD.size
+
+    def chunks(self, size=READ_CHUNK):
+        # 按块返回列: (时间戳, 变量序号, 值类型, 值)，均为 array
+        with open(self.path, "rb") as f:
+            f.seek(self.data_offset)
+            while True:
+                data = f.read(RECORD.size * size)
+                data = data[:len(data) - len(data) % RECORD.size]
+                if not data:
+                    return
+                times, indices, kinds, numbers = array("d"), array("H"), array("B"), array("d")
+                for timestamp, index, kind, number in RECORD.iter_unpack(data):
+                    times.append(timestamp)
+                    indices.append(index)
+                    kinds.append(kind)
+                    numbers.append(number)
+                yield times, indices, kinds, numbers
+
+    def __iter__(self):
+        # 逐条返回 (时间戳, 变量名, 值)
+        var_names = self.var_names
+        for times, indices, kinds, numbers in self.chunks():
+            for timestamp, index, kind, number in zip(times, indices, kinds, numbers):
+                yield timestamp, var_names[index], decode_value(kind, number)
+
+
+def export_csv(recording, path):
+    # 长表格式，每个变化一行
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp", "time", "variable", "value"])
+        for timestamp, var_name, value in recording:
+            local = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp % 1 * 1000):03d}"
+            writer.writerow([f"{timestamp:.6f}", local, var_name, value])
+
+
+def export_parquet(recording, path):
+    # pyarrow 为可选依赖，只在导出 Parquet 时需要；变量名列用字典编码，布尔量记为 0/1，读取失败时 bad 为 True
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export requires pyarrow (pip install pyarrow)")
+    dictionary = pa.array(recording.var_names, pa.string())
+    schema = pa.schema([("timestamp", pa.timestamp("us")), ("variable", pa.dictionary(pa.uint16(), pa.string())),
+                        ("value", pa.float64()), ("bad", pa.bool_())])
+    with pq.ParquetWriter(path, schema) as writer:
+        for times, indices, kinds, numbers in recording.chunks():
+            table = pa.Table.from_arrays([
+                pa.array([int(t * 1000000) for t in times], pa.int64()).cast(pa.timestamp("us")),
+                pa.DictionaryArray.from_arrays(pa.array(indices, pa.uint16()), dictionary),
+                pa.array(numbers, pa.float64()),
+                pa.array([kind == KIND_BAD for kind in kinds], pa.bool_()),
+            ], schema=schema)
+            writer.write_table(table)
+
+
+class ReplayEngine:
+    # 与 AcquisitionEngine 接口相同，数据来自录制文件；speed 为回放倍速，0 表示尽快回放。
+    # 报警规则按录制时间重新判断，不写入报警历史文件
+    def __init__(self, path, speed=1.0, alarm_rules=(), frame_interval=0.02):
+        self.recording = Recording(path)
+        self.speed = speed
+        self.frame_interval = frame_interval  # 同一帧内的变化合并为一次 on_values (录制时间 s)
+        self.alarms = None
+        if alarm_rules:
+            try:
+                self.alarms = AlarmEngine(alarm_rules, self.recording.var_names)
+            except ValueError as e:
+                logger.warning(f"Replaying without alarms: {e}")
+        self.on_connection_changed = lambda connected, message: None
+        self.on_values = lambda values: None
+        self.on_value_changed = lambda var_name, value: None
+        self.on_write_done = lambda var_name, value, success, message: None
+        self.on_alarm = lambda event: None
+        if self.alarms:
+            self.alarms.on_alarm = lambda event: self.on_alarm(event)
+        self.record_history = False
+        self.stopped = threading.Event()
+        self.is_running = True
+
+    def write(self, var_name, value):
+        self.write_many({var_name: value})
+
+    def write_many(self, values):
+        for var_name, value in values.items():
+            self.on_write_done(var_name, value, False, "回放模式下不能写入")
+
+    def acknowledge(self, name=None):
+        if self.alarms:
+            self.alarms.acknowledge(name)
+
+    def alarm_snapshot(self):
+        return self.alarms.snapshot() if self.alarms else []
+
+    def alarm_history(self):
+        return list(self.alarms.history) if self.alarms else []
+
+    def stop(self):
+        self.is_running = False
+        self.stopped.set()
+
+    def emit(self, frame, timestamp):
+        if self.alarms:
+            # 报警的时间判断使用录制时间，不受回放倍速影响
+            self.alarms.update(frame, timestamp)
+        self.on_values(frame)
+
+    def run(self):
+        name = os.path.basename(self.recording.path)
+        speed_text = f"{self.speed:g}x" if self.speed else "最快"
+        self.on_connection_changed(True, f"回放 {name} ({speed_text})")
+        start_wall = time.monotonic()
+        start_time = frame_time = None
+        frame = OrderedDict()
+        for timestamp, var_name, value in self.recording:
+            if not self.is_running:
+                return True
+            if start_time is None:
+                start_time = frame_time = timestamp
+            if timestamp - frame_time >= self.frame_interval:
+                self.emit(frame, frame_time)
+                frame = OrderedDict()
+                frame_time = timestamp
+                if self.speed:
+                    # 按录制时间对齐墙钟，落后时不等待
+                    delay = start_wall + (timestamp - start_time) / self.speed - time.monotonic()
+                    if delay > 0 and self.stopped.wait(delay):
+                        return True
+            frame[var_name] = value
+        if frame:
+            self.emit(frame, frame_time)
+        elapsed = (frame_time - start_time) if start_time is not None else 0.0
+        logger.info(f"Replay of {name} finished ({self.recording.count} changes, {elapsed:.1f} s recorded)")
+        self.on_connection_changed(True, f"回放结束: {name}")
+        # 保持窗口显示最后的状态，直到停止
+        self.stopped.wait()
+        return True
\ No newline at end of file
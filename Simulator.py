@@ -0,0 +1,219 @@
+from opcua import Server, ua
+from opcua.server import binary_server_asyncio
+from opcua.server.uaprocessor import UaProcessor
+from ClientApp import VARIABLES, VARIANT_TYPES
+import math
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+# 模拟 PLC：在本机提供 VARIABLES 中的全部节点，带简单的轴运动、氧含量和压力动态
+SIM_ENDPOINT = "opc.tcp://127.0.0.1:4841"
+SIM_NAMESPACE = "CODESYSSPV3/3S/IecVarAccess"  # 注册后索引为 2，与 VARIABLES 中的 ns=2 一致
+SIM_TICK = 0.05  # 动态更新周期 (s)
+AXES = ["X", "Y", "A", "B", "Z"]
+AXIS_DEFAULT_VEL = 50.0  # 速度设定为 0 时使用 (单位/s)
+AXIS_RANGE = 500.0  # 演示模式随机定位的范围
+AXIS_HOME_BACKOFF = 5.0  # 回零时在原点附近的轴先离开这段距离再回到原点，与 PLC 寻找原点开关的动作一致
+O2_AMBIENT = 209000.0  # 腔体漏气时趋向的氧含量 (ppm)
+O2_PURGED = 50.0  # 洗气时趋向的氧含量 (ppm)
+O2_OK_LIMIT = 1000.0  # 低于此值 CHAMBER_O2_OK 为 True
+
+
+class DelayedProcessor(UaProcessor):
+    # 每个服务请求处理前等待 latency ± jitter 秒；请求按顺序串行处理，与 PLC 通信任务一致
+    latency = 0.0
+    jitter = 0.0
+
+    def process_message(self, seqhdr, body):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        return super().process_message(seqhdr, body)
+
+
+class Axis:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.position = 0.0
+        self.target = None
+        self.targets = []  # 到达 target 后依次前往的位置
+        self.jog = 0  # 1 正转, -1 反转
+        self.done_flag = None  # 运动结束后置位的完成标志
+        self.last_commands = {}
+
+    def edge(self, name, value):
+        # 上升沿检测，PLC 中功能块按上升沿启动
+        previous = self.last_commands.get(name, False)
+        self.last_commands[name] = value
+        return value and not previous
+
+    def step(self, dt, velocity):
+        velocity = abs(velocity) or AXIS_DEFAULT_VEL
+        if self.jog:
+            self.position += self.jog * velocity * dt
+            return None
+        if self.target is None:
+            return None
+        distance = self.target - self.position
+        if abs(distance) <= velocity * dt:
+            self.position = self.target
+            if self.targets:
+                self.target = self.targets.pop(0)
+                return None
+            self.target = None
+            return self.done_flag
+        self.position += math.copysign(velocity * dt, distance)
+        return None
+
+
+class SimulatedPLC:
+    def __init__(self, endpoint=None, latency=0.0, jitter=0.0, demo=True, seed=None):
+        self.endpoint = endpoint or SIM_ENDPOINT
+        self.demo = demo
+        self.random = random.Random(seed)
+        DelayedProcessor.latency = latency
+        DelayedProcessor.jitter = jitter
+        binary_server_asyncio.UaProcessor = DelayedProcessor
+        self.server = Server()
+        self.server.set_endpoint(self.endpoint)
+        self.server.set_server_name("Simulated PLC")
+        namespace = self.server.register_namespace(SIM_NAMESPACE)
+        assert namespace == 2, f"Unexpected namespace index {namespace}"
+        self.nodes = {}  # 变量名 -> 节点，同一节点的多个变量名共用
+        self.values = {}  # NodeId -> 最近写入服务器的值，别名共用
+        # 与 CODESYS 相同的目录结构 Application/GVL_HMI，discover 命令可以直接浏览
+        application = self.server.get_objects_node().add_folder(ua.NodeId.from_string("ns=2;s=Application"),
+                                                                "Application")
+        folder = application.add_folder(ua.NodeId.from_string("ns=2;s=Application.GVL_HMI"), "GVL_HMI")
+        created = {}
+        for var_name, info in VARIABLES.items():
+            node = created.get(info["node"])
+            if node is None:
+                convert, variant_type = VARIANT_TYPES[info["type"]]
+                node = folder.add_variable(ua.NodeId.from_string(info["node"]), var_name,
+                                            ua.Variant(convert(0), variant_type))
+                if info["writable"]:
+                    node.set_writable()
+                created[info["node"]] = node
+            self.nodes[var_name] = node
+        self.axes = [Axis(prefix) for prefix in AXES]
+        # 每个氧含量节点一个腔体模型：_SEAL/_LASER 指向同一组节点时只有一个腔体，避免两个模型轮流写同一节点
+        chambers = {}
+        for chamber in ("SEAL", "LASER"):
+            chambers.setdefault(VARIABLES[f"AI_CHAMBER_O2_CONTENT_OUTPUT_{chamber}"]["node"], chamber)
+        self.chambers = list(chambers.values())
+        self.o2 = {chamber: 2000.0 for chamber in self.chambers}
+        self.pressure = {chamber: 12.0 for chamber in self.chambers}
+        self.filter_pressure = 0.0
+        self.demo_purging = True
+        self.is_running = False
+        self.thread = None
+
+    def get(self, var_name):
+        return self.nodes[var_name].get_value()
+
+    def set(self, var_name, value):
+        # 只在值变化时写入地址空间，避免无意义的数据变化通知
+        if var_name not in self.nodes:
+            return
+        node_id = VARIABLES[var_name]["node"]
+        if node_id in self.values and self.values[node_id] == value:
+            return
+        convert, variant_type = VARIANT_TYPES[VARIABLES[var_name]["type"]]
+        self.nodes[var_name].set_value(ua.Variant(convert(value), variant_type))
+        self.values[node_id] = value
+
+    def step_axis(self, axis, dt):
+        p = axis.prefix
+        powered = self.get(f"{p}_POWER")
+        if axis.edge("REST", self.get(f"{p}_REST")):
+            self.set(f"{p}_MoveAbs_done", False)
+            self.set(f"{p}_MoveRela_done", False)
+        # 演示模式下未使能的轴也会自行运动
+        if axis.edge("Stop", self.get(f"{p}_Stop")) or not (powered or self.demo):
+            axis.target, axis.targets, axis.jog = None, [], 0
+        elif axis.edge("MoveAbs", self.get(f"{p}_MoveAbs")):
+            axis.target, axis.targets, axis.done_flag = self.get(f"{p}_MoveABSPos"), [], f"{p}_MoveAbs_done"
+            self.set(axis.done_flag, False)
+        elif axis.edge("HOME", self.get(f"{p}_HOME")):
+            if abs(axis.position) < AXIS_HOME_BACKOFF:
+                axis.target, axis.targets, axis.done_flag = AXIS_HOME_BACKOFF, [0.0], None
+            else:
+                axis.target, axis.targets, axis.done_flag = 0.0, [], None
+        elif axis.edge("MoveRelaDist", self.get(f"{p}_MoveRelaDist") != 0):
+            # 没有单独的相对运动启动位，相对位移值变为非零时启动
+            axis.target, axis.targets = axis.position + self.get(f"{p}_MoveRelaDist"), []
+            axis.done_flag = f"{p}_MoveRela_done"
+            self.set(axis.done_flag, False)
+        if powered:
+            axis.jog = 1 if self.get(f"{p}_JogNeg") else -1 if self.get(f"{p}_Jogrev") else 0
+        elif self.demo and axis.target is None and self.random.random() < dt / 3:
+            # 演示模式：未使能的轴每隔几秒随机定位一次，保证趋势有变化
+            axis.target, axis.done_flag = self.random.uniform(-AXIS_RANGE, AXIS_RANGE), f"{p}_MoveAbs_done"
+            self.set(axis.done_flag, False)
+        done = axis.step(dt, self.get(f"{p}_MoveVel"))
+        if done:
+            self.set(done, True)
+        self.set(f"{p}_PosNow", round(axis.position, 4))
+
+    def step_chamber(self, dt):
+        purging = self.get("START_AIR_CLEAN") or self.get("FAST_FLUX_VALVE_ENBLE_H_1")
+        if self.demo:
+            # 演示模式：氧含量在洗气和漏气之间往复
+            o2 = self.o2[self.chambers[0]]
+            if o2 < O2_OK_LIMIT / 5:
+                self.demo_purging = False
+            elif o2 > O2_OK_LIMIT * 20:
+                self.demo_purging = True
+            purging = purging or self.demo_purging
+        for chamber in self.chambers:
+            # 洗气时指数下降，否则缓慢漏气上升；压力在设定值附近随机漂移
+            target, rate = (O2_PURGED, 0.05) if purging else (O2_AMBIENT, 0.0005)
+            o2 = self.o2[chamber]
+            o2 += (target - o2) * rate * dt / SIM_TICK + self.random.gauss(0, max(1.0, o2 * 0.002))
+            self.o2[chamber] = o2 = max(0.0, o2)
+            self.pressure[chamber] += (12.0 - self.pressure[chamber]) * 0.01 + self.random.gauss(0, 0.05)
+            self.set(f"AI_CHAMBER_O2_CONTENT_OUTPUT_{chamber}", round(o2, 1))
+            self.set(f"AI_HP_O2_CONTENT_OUTPUT_{chamber}", round(o2 / 10000, 4))
+            self.set(f"AI_LP_O2_CONTENT_OUTPUT_{chamber}", round(o2 / 10000, 2))
+            self.set(f"CHAMBER_O2_OK_{chamber}", o2 < O2_OK_LIMIT)
+            self.set(f"AI_CHAMBER_PRESSURE_OUTPUT_{chamber}", round(self.pressure[chamber], 3))
+        fan_on = self.get("RECIRCULATING_FAN_ON_H") or self.demo
+        target = (self.get("AI_FILTER_ELEMENT_PRESSURE_SET_H") or 800.0) if fan_on else 0.0
+        self.filter_pressure += (target - self.filter_pressure) * 0.05 + (self.random.gauss(0, 2.0) if fan_on else 0)
+        self.set("AI_FILTER_ELEMENT_PRESSURE_OUTPUT", round(max(0.0, self.filter_pressure), 1))
+
+    def loop(self):
+        last = time.monotonic()
+        while self.is_running:
+            time.sleep(SIM_TICK)
+            now = time.monotonic()
+            dt, last = now - last, now
+            try:
+                for axis in self.axes:
+                    self.step_axis(axis, dt)
+                self.step_chamber(dt)
+            except Exception as e:
+                logger.error(f"Simulation step failed: {e}")
+
+    def start(self):
+        self.set("CNC_XygapVel", 100.0)
+        self.set("CNCfDefaultVel", 100.0)
+        self.set("CNCfDefaultAccel", 1000.0)
+        self.set("CNCfDefaultDecel", 1000.0)
+        self.server.start()
+        self.is_running = True
+        self.thread = threading.Thread(target=self.loop, name="Simulator", daemon=True)
+        self.thread.start()
+        logger.info(f"Simulated PLC listening on {self.endpoint} ({len(self.nodes)} variables, "
+                    f"latency {DelayedProcessor.latency * 1000:.0f} ms, jitter {DelayedProcessor.jitter * 1000:.0f} ms)")
+
+    def stop(self):
+        self.is_running = False
+        if self.thread:
+            self.thread.join()
+        self.server.stop()
\ No newline at end of file
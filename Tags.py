@@ -0,0 +1,205 @@
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger("OPCUA")
+
+# 变量配置文件：{"variables": {变量名: {"node", "type", "comment", "writable", 可选 "scan"/"sampling_interval"/
+# "queue_size"/"deadband"}}, "groups": {分组名: [变量名]}}；扩展名为 .yaml/.yml 时按 YAML 读写 (需要 PyYAML)，否则为 JSON
+VARIABLE_KEYS = {"node", "type", "comment", "writable", "scan", "sampling_interval", "queue_size", "deadband"}
+DISPLAY_KEYS = {"comment", "writable"}  # 只影响界面显示的键，变化时不需要重建节点
+
+
+def is_yaml(path):
+    return os.path.splitext(path)[1].lower() in (".yaml", ".yml")
+
+
+def import_yaml():
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("YAML tag files require PyYAML (pip install pyyaml), or use a .json file")
+    return yaml
+
+
+def validate_tags(data, types, scan_classes, source):
+    # 返回 (variables, groups)，内容错误时抛出 ValueError
+    if not isinstance(data, dict) or not isinstance(data.get("variables"), dict):
+        raise ValueError(f"{source}: expected a mapping with 'variables' and 'groups'")
+    variables = OrderedDict()
+    for var_name, info in data["variables"].items():
+        if not isinstance(info, dict) or not isinstance(info.get("node"), str):
+            raise ValueError(f"{source}: variable {var_name} needs a node id")
+        if info.get("type") not in types:
+            raise ValueError(f"{source}: variable {var_name} has unsupported type {info.get('type')}")
+        if "scan" in info and info["scan"] not in scan_classes:
+            raise ValueError(f"{source}: variable {var_name} has unknown scan class {info['scan']}")
+        unknown = sorted(set(info) - VARIABLE_KEYS)
+        if unknown:
+            raise ValueError(f"{source}: variable {var_name} has unknown keys {unknown}")
+        variables[str(var_name)] = dict(info, comment=str(info.get("comment") or ""),
+                                        writable=bool(info.get("writable", False)))
+    groups = OrderedDict()
+    for group_name, var_names in (data.get("groups") or {}).items():
+        if not isinstance(var_names, list):
+            raise ValueError(f"{source}: group {group_name} must be a list of variable names")
+        unknown = [v for v in var_names if v not in variables]
+        if unknown:
+            raise ValueError(f"{source}: group {group_name} refers to unknown variable {unknown[0]}")
+        groups[str(group_name)] = list(var_names)
+    return variables, groups
+
+
+def load_tags(path, types, scan_classes):
+    yaml = import_yaml() if is_yaml(path) else None
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f) if yaml else json.load(f)
+    except Exception as e:
+        raise ValueError(f"Failed to load tags from {path}: {e}")
+    return validate_tags(data, types, scan_classes, path)
+
+
+def save_tags(path, variables, groups):
+    # 先写临时文件再替换，运行中的进程不会读到写了一半的配置
+    data = {"variables": {k: dict(v) for k, v in variables.items()}, "groups": {k: list(v) for k, v in groups.items()}}
+    yaml = import_yaml() if is_yaml(path) else None
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        if yaml:
+            yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False, default_flow_style=None, width=120)
+        else:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def copy_tags(variables, groups):
+    return ({var_name: dict(info) for var_name, info in variables.items()},
+            OrderedDict((group_name, list(var_names)) for group_name, var_names in groups.items()))
+
+
+class TagChanges:
+    # 两份配置的差异；detach/attach 为需要解除/重新建立节点的变量，groups 为需要重建的分组（含删除的分组）
+    def __init__(self, old_variables, old_groups, variables, groups):
+        self.added = [v for v in variables if v not in old_variables]
+        self.removed = [v for v in old_variables if v not in variables]
+        self.changed = [v for v in variables if v in old_variables and old_variables[v] != variables[v]]
+        relinked = [v for v in self.changed if self.acquisition(old_variables[v]) != self.acquisition(variables[v])]
+        self.detach = self.removed + relinked
+        self.attach = self.added + relinked
+        changed = set(self.changed)
+        self.groups = [g for g, var_names in groups.items()
+                       if old_groups.get(g) != var_names or any(v in changed for v in var_names)]
+        self.groups += [g for g in old_groups if g not in groups]
+        self.group_names = list(groups)  # 新的分组顺序
+        self.reordered = [g for g in old_groups if g in groups] != [g for g in groups if g in old_groups]
+
+    @staticmethod
+    def acquisition(info):
+        return {key: value for key, value in info.items() if key not in DISPLAY_KEYS}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or self.groups or self.reordered)
+
+    def summary(self):
+        return (f"{len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} changed, "
+                f"{len(self.groups)} groups changed")
+
+
+class TagFile:
+    # 外部变量配置，原地替换 variables/groups（其他模块 from ClientApp import VARIABLES 得到的是同一个对象）。
+    # 配置变化时 generation 加一，各使用方（采集引擎、机群会话、网关客户端）与自己的快照比较得到 TagChanges
+    def __init__(self, path, variables, groups, types, scan_classes, interval=2.0):
+        self.path = path
+        self.variables = variables
+        self.groups = groups
+        self.types = types
+        self.scan_classes = scan_classes
+        self.interval = interval
+        self.generation = 0
+        self.signature = None  # 最近加载时文件的 (修改时间, 大小)
+        self.next_check = 0.0
+        self.lock = threading.Lock()
+
+    def stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except (OSError, TypeError):
+            return None
+
+    def load(self):
+        # 启动时调用，文件不存在时使用内置配置；文件内容错误时抛出 ValueError
+        signature = self.stat()
+        if signature is None:
+            return False
+        variables, groups = load_tags(self.path, self.types, self.scan_classes)
+        self.signature = signature
+        self.replace(variables, groups)
+        logger.info(f"Loaded {len(variables)} variables in {len(groups)} groups from {self.path}")
+        return True
+
+    def reload_if_changed(self):
+        # 可在任意线程调用，每 interval 秒最多检查一次文件；解析失败或文件被删除时保留当前配置
+        now = time.monotonic()
+        with self.lock:
+            if not self.path or now < self.next_check:
+                return False
+            self.next_check = now + self.interval
+            signature = self.stat()
+            if signature is None or signature == self.signature:
+                return False
+            self.signature = signature
+        try:
+            variables, groups = load_tags(self.path, self.types, self.scan_classes)
+        except ValueError as e:
+            logger.error(f"Tag file not reloaded, keeping the current configuration: {e}")
+            return False
+        changes = self.replace(variables, groups)
+        logger.info(f"Reloaded {self.path}: {changes.summary()}")
+        return bool(changes)
+
+    def replace(self, variables, groups):
+        # 先加入新变量、再替换分组、最后删除旧变量：其他线程任何时刻读到的分组都只引用存在的变量
+        with self.lock:
+            changes = TagChanges(self.variables, self.groups, variables, groups)
+            if not changes:
+                return changes
+            for var_name in changes.added + changes.changed:
+                self.variables[var_name] = variables[var_name]
+            for group_name in [g for g in self.groups if g not in groups]:
+                del self.groups[group_name]
+            for group_name, var_names in groups.items():
+                if changes.reordered:
+                    self.groups.pop(group_name, None)
+                self.groups[group_name] = var_names
+            for var_name in changes.removed:
+                del self.variables[var_name]
+            self.generation += 1
+            return changes
+
+    def snapshot(self):
+        # (generation, variables, groups) 的副本，供使用方比较
+        with self.lock:
+            return (self.generation,) + copy_tags(self.variables, self.groups)
+
+
+class TagSubscriber:
+    # 使用方持有的配置快照：changes() 返回自上次调用以来的变化，没有变化时返回 None
+    def __init__(self, tag_file):
+        self.tag_file = tag_file
+        self.generation, self.variables, self.groups = tag_file.snapshot()
+
+    def changes(self):
+        if self.tag_file.generation == self.generation:
+            return None
+        generation, variables, groups = self.tag_file.snapshot()
+        changes = TagChanges(self.variables, self.groups, variables, groups)
+        self.generation, self.variables, self.groups = generation, variables, groups
+        return changes if changes else None
\ No newline at end of file
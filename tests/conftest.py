@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 模块都在仓库根目录，从任意目录运行 pytest 时都能导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
\ No newline at end of file
@@ -0,0 +1,57 @@
+from ClientApp import ScanScheduler, WriteQueue, scan_class
+import pytest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("ClientApp.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_scan_classes_become_due_on_their_own_cycle(clock):
+    assert scan_class("X_PosNow") == "fast" and scan_class("CNCStatus") == "medium"
+    scheduler = ScanScheduler(["X_PosNow", "CNCStatus"])
+    assert scheduler.due_vars() == ["X_PosNow", "CNCStatus"]
+    assert scheduler.time_until_due() == pytest.approx(0.05)
+    for _ in range(5):
+        clock[0] = scheduler.next_due["fast"] + 0.001
+        assert scheduler.due_vars() == ["X_PosNow"]
+    clock[0] = scheduler.next_due["fast"] + 0.001
+    assert sorted(scheduler.due_vars()) == ["CNCStatus", "X_PosNow"]
+    assert scheduler.overruns == 0
+
+
+def test_scan_overrun_skips_missed_cycles(clock):
+    scheduler = ScanScheduler(["X_PosNow"])
+    scheduler.due_vars()
+    clock[0] += 0.175  # 落后 2 个周期多
+    assert scheduler.due_vars() == ["X_PosNow"]
+    assert scheduler.overruns == 2
+    # 按原来的节拍继续，不从当前时刻重新计时
+    assert scheduler.next_due["fast"] == pytest.approx(1000.2)
+    assert scheduler.due_vars() == []
+
+
+def test_slow_read_counts_as_overrun(clock):
+    scheduler = ScanScheduler(["X_PosNow", "CNCStatus"])
+    scheduler.check_duration(["CNCStatus"], 0.1)
+    assert scheduler.overruns == 0
+    scheduler.check_duration(["X_PosNow", "CNCStatus"], 0.1)
+    assert scheduler.overruns == 1
+
+
+def test_write_queue_coalesces_by_variable():
+    writes = WriteQueue()
+    writes.put("a", 1)
+    writes.put("b", 2)
+    writes.put_many({"a": 3, "c": 4})
+    # 同一变量只保留最新值，按最后一次提交的顺序执行
+    assert list(writes.get(0).items()) == [("b", 2), ("a", 3), ("c", 4)]
+    assert writes.get(0) == {}
+
+
+def test_write_queue_close_wakes_waiter():
+    writes = WriteQueue()
+    writes.close()
+    assert writes.get(10) == {}
\ No newline at end of file
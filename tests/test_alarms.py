@@ -0,0 +1,106 @@
+from Alarms import AlarmEngine
+import pytest
+
+KNOWN = ["temp", "pos", "flag"]
+
+
+def make_engine(*rules):
+    engine = AlarmEngine(list(rules), KNOWN)
+    events = []
+    engine.on_alarm = events.append
+    return engine, events
+
+
+def test_limit_rule_deadband():
+    engine, events = make_engine({"name": "hot", "type": "high", "var": "temp", "limit": 100, "deadband": 5})
+    engine.update({"temp": 101.0}, now=0.0)
+    engine.update({"temp": 97.0}, now=1.0)
+    assert engine.states["hot"].active
+    engine.update({"temp": 94.0}, now=2.0)
+    assert [e["event"] for e in events] == ["raised", "cleared"]
+
+
+def test_rate_rule_clears_when_samples_expire():
+    engine, events = make_engine({"name": "fast", "type": "rate", "var": "pos", "limit": 10, "window": 1.0})
+    engine.update({"pos": 0.0}, now=0.1)
+    engine.update({"pos": 5.0}, now=0.2)
+    assert engine.states["fast"].active
+    # 到期时刻与样本过期判断用同一个表达式，正好到期时必须删除样本并解除
+    engine.check_timeouts(now=0.1 + 1.0)
+    assert not engine.states["fast"].active
+    assert [e["event"] for e in events] == ["raised", "cleared"]
+    assert not engine.deadlines and not engine.pending
+
+
+def test_rate_rule_direction():
+    engine, events = make_engine({"name": "drop", "type": "rate", "var": "pos", "limit": 4, "window": 1.0,
+                                  "direction": "falling"})
+    engine.update({"pos": 0.0}, now=0.0)
+    engine.update({"pos": 5.0}, now=0.1)
+    assert not engine.states["drop"].active
+    # 上升的样本过期后，窗口内只剩下降
+    engine.update({"pos": 0.0}, now=1.05)
+    assert engine.states["drop"].active
+
+
+def test_stuck_rule_fires_at_deadline():
+    engine, events = make_engine({"name": "stuck", "type": "stuck", "var": "pos", "timeout": 5})
+    engine.update({"pos": 1.0}, now=0.0)
+    engine.check_timeouts(now=4.9)
+    assert not engine.states["stuck"].active
+    engine.check_timeouts(now=5.0)
+    assert engine.states["stuck"].active
+    engine.update({"pos": 2.0}, now=6.0)
+    assert not engine.states["stuck"].active
+
+
+def test_postponed_deadline_is_rescheduled_not_evaluated():
+    engine, events = make_engine({"name": "stuck", "type": "stuck", "var": "pos", "timeout": 5})
+    engine.update({"pos": 1.0}, now=0.0)
+    engine.update({"pos": 2.0}, now=3.0)
+    engine.check_timeouts(now=5.0)
+    assert not engine.states["stuck"].active
+    assert engine.scheduled == {"stuck": 8.0}
+    engine.check_timeouts(now=8.0)
+    assert engine.states["stuck"].active
+
+
+def test_deadline_heap_stays_bounded():
+    # 回归：变量频繁变化时每个规则在堆中最多一个有效条目，到期检查不会空转
+    engine, events = make_engine({"name": "stuck", "type": "stuck", "var": "pos", "timeout": 5},
+                                 {"name": "fast", "type": "rate", "var": "pos", "limit": 1000, "window": 1.0})
+    for i in range(10000):
+        engine.update({"pos": float(i)}, now=i * 0.001)
+    assert len(engine.deadlines) <= 2 * len(engine.rules)
+    engine.check_timeouts(now=100.0)
+    assert engine.states["stuck"].active
+    assert not engine.states["fast"].active
+
+
+def test_expression_rule_waits_for_all_variables():
+    engine, events = make_engine({"name": "combo", "type": "expression", "expr": "flag and temp > 50"})
+    engine.update({"flag": True}, now=0.0)
+    assert not events
+    engine.update({"temp": 60.0}, now=1.0)
+    assert engine.states["combo"].active
+
+
+def test_acknowledge():
+    engine, events = make_engine({"name": "hot", "type": "high", "var": "temp", "limit": 100})
+    engine.update({"temp": 101.0}, now=0.0)
+    engine.update({"temp": 99.0}, now=1.0)
+    assert [s["alarm"] for s in engine.snapshot()] == ["hot"]
+    engine.acknowledge("hot")
+    assert engine.snapshot() == []
+    assert events[-1]["event"] == "acknowledged"
+
+
+@pytest.mark.parametrize("spec", [
+    {"name": "a", "type": "high", "var": "missing", "limit": 1},
+    {"name": "a", "type": "unknown", "var": "temp"},
+    {"name": "a", "type": "high", "var": "temp", "limit": 1, "severity": "fatal"},
+    {"name": "a", "type": "expression", "expr": "__import__('os')"},
+])
+def test_invalid_rules(spec):
+    with pytest.raises(ValueError):
+        AlarmEngine([spec], KNOWN)
\ No newline at end of file
@@ -0,0 +1,37 @@
+from Recorder import Recording, SessionRecorder
+import pytest
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "session.opcrec")
+    recorder = SessionRecorder(path, ["temp", "flag", "count"], metadata={"machine": "m1"}, flush_interval=60)
+    recorder.record("temp", 21.5, timestamp=1.0)
+    recorder.record("temp", 21.5, timestamp=2.0)  # 未变化，不记录
+    recorder.record("unknown", 1, timestamp=2.0)
+    recorder.record_values({"flag": True, "count": 7}, timestamp=3.0)
+    recorder.record("temp", "N/A", timestamp=4.0)
+    recorder.close()
+    recording = Recording(path)
+    assert recording.metadata["machine"] == "m1"
+    assert recording.var_names == ["temp", "flag", "count"]
+    assert recording.count == 4
+    values = list(recording)
+    assert values == [(1.0, "temp", 21.5), (3.0, "flag", True), (3.0, "count", 7), (4.0, "temp", "N/A")]
+    assert type(values[1][2]) is bool and type(values[2][2]) is int
+
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = str(tmp_path / "session.opcrec")
+    recorder = SessionRecorder(path, ["temp"], flush_interval=60)
+    recorder.record("temp", 1.0, timestamp=1.0)
+    recorder.close()
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 5)
+    assert list(Recording(path)) == [(1.0, "temp", 1.0)]
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"hello world")
+    with pytest.raises(ValueError):
+        Recording(str(path))
\ No newline at end of file
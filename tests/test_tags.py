@@ -0,0 +1,47 @@
+from collections import OrderedDict
+from Tags import TagChanges
+
+
+def tag(node, comment="", writable=False):
+    return {"node": node, "type": "REAL", "comment": comment, "writable": writable}
+
+
+VARIABLES = {"a": tag("ns=2;s=a"), "b": tag("ns=2;s=b"), "c": tag("ns=2;s=c")}
+GROUPS = OrderedDict([("g1", ["a", "b"]), ("g2", ["c"])])
+
+
+def test_no_changes():
+    changes = TagChanges(VARIABLES, GROUPS, dict(VARIABLES), OrderedDict(GROUPS))
+    assert not changes
+    assert changes.detach == changes.attach == changes.groups == []
+
+
+def test_added_and_removed():
+    variables = {"a": VARIABLES["a"], "b": VARIABLES["b"], "d": tag("ns=2;s=d")}
+    groups = OrderedDict([("g1", ["a", "b"]), ("g3", ["d"])])
+    changes = TagChanges(VARIABLES, GROUPS, variables, groups)
+    assert changes.added == ["d"] and changes.removed == ["c"]
+    assert changes.detach == ["c"] and changes.attach == ["d"]
+    assert changes.groups == ["g3", "g2"]
+    assert changes.group_names == ["g1", "g3"]
+
+
+def test_display_only_change_does_not_relink():
+    variables = dict(VARIABLES, a=tag("ns=2;s=a", comment="新注释"))
+    changes = TagChanges(VARIABLES, GROUPS, variables, GROUPS)
+    assert changes.changed == ["a"]
+    assert changes.detach == changes.attach == []
+    assert changes.groups == ["g1"]
+
+
+def test_node_change_relinks():
+    variables = dict(VARIABLES, b=tag("ns=2;s=b2"))
+    changes = TagChanges(VARIABLES, GROUPS, variables, GROUPS)
+    assert changes.detach == ["b"] and changes.attach == ["b"]
+
+
+def test_reordered_groups():
+    groups = OrderedDict([("g2", ["c"]), ("g1", ["a", "b"])])
+    changes = TagChanges(VARIABLES, GROUPS, VARIABLES, groups)
+    assert changes.reordered and changes.groups == []
+    assert changes
\ No newline at end of file